@@ -0,0 +1,257 @@
+"""Arranque do ambiente de benchmark: mongod local (ou replica set), os quatro servidores e o catálogo."""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import psutil
+from pymongo import MongoClient
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# protocolo -> (diretório, script, porta)
+SERVIDORES = {
+    "rest": ("servera/rest", "app.py", 5000),
+    "soap": ("serverb/soap", "server.py", 8000),
+    "grpc": ("serverc/grpc", "server.py", 50051),
+    "graphql": ("serverc/graphql", "app.py", 5001),
+}
+
+MARCAS = ["Samsung", "JBL", "Dell", "Xiaomi", "BOSE", "Canon", "SteelSeries", "Apple", "Sony", "LG"]
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def esperar_porta(porta, timeout=60, processo=None):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        if processo is not None and processo.poll() is not None:
+            raise RuntimeError(f"O processo na porta {porta} terminou com código {processo.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", porta), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nada à escuta na porta {porta} ao fim de {timeout}s")
+
+
+class MongoLocal:
+    """mongod temporário; com dbpath num tmpfs (ex.: /dev/shm) fica todo em memória."""
+
+    def __init__(self, binario="mongod", dbpath_base=None, replica_set=None):
+        self.binario = binario
+        self.dbpath_base = dbpath_base
+        self.replica_set = replica_set
+        self.processo = None
+        self.dbpath = None
+        self.porta = None
+
+    @property
+    def url(self):
+        return f"mongodb://127.0.0.1:{self.porta}"
+
+    def iniciar(self):
+        if not shutil.which(self.binario):
+            raise RuntimeError(f"'{self.binario}' não encontrado; usar --mongo-url para um mongod existente")
+        self.dbpath = tempfile.mkdtemp(prefix="bench-mongo-", dir=self.dbpath_base)
+        self.porta = porta_livre()
+        comando = [self.binario, "--dbpath", self.dbpath, "--port", str(self.porta),
+                   "--bind_ip", "127.0.0.1", "--quiet"]
+        if self.replica_set:
+            comando += ["--replSet", self.replica_set]
+        self.processo = subprocess.Popen(
+            comando,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        esperar_porta(self.porta, processo=self.processo)
+
+    def parar(self):
+        if self.processo:
+            self.processo.terminate()
+            self.processo.wait(timeout=30)
+        if self.dbpath:
+            shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+class ReplicaSetLocal:
+    """Replica set temporário de `membros` mongod locais (um primário e os restantes secundários).
+
+    Tem o mesmo url/iniciar()/parar() do MongoLocal. Com ele os servidores
+    usam transações no outbox e as leituras pesadas vão aos secundários.
+    """
+
+    def __init__(self, binario="mongod", dbpath_base=None, membros=3, nome="bench"):
+        self.nome = nome
+        self.membros = [MongoLocal(binario, dbpath_base, replica_set=nome) for _ in range(membros)]
+
+    @property
+    def url(self):
+        anfitrioes = ",".join(f"127.0.0.1:{membro.porta}" for membro in self.membros)
+        return f"mongodb://{anfitrioes}/?replicaSet={self.nome}"
+
+    def iniciar(self, timeout=60):
+        try:
+            for membro in self.membros:
+                membro.iniciar()
+            # O primeiro membro tem prioridade maior para ser sempre o primário
+            config = {"_id": self.nome, "members": [
+                {"_id": i, "host": f"127.0.0.1:{membro.porta}", "priority": 2 if i == 0 else 1}
+                for i, membro in enumerate(self.membros)
+            ]}
+            with MongoClient(self.membros[0].url, directConnection=True) as cliente:
+                cliente.admin.command("replSetInitiate", config)
+            self._esperar_membros(timeout)
+        except Exception:
+            self.parar()
+            raise
+
+    def _esperar_membros(self, timeout):
+        limite = time.time() + timeout
+        with MongoClient(self.membros[0].url, directConnection=True) as cliente:
+            while time.time() < limite:
+                estados = sorted(m["stateStr"] for m in cliente.admin.command("replSetGetStatus")["members"])
+                if estados == ["PRIMARY"] + ["SECONDARY"] * (len(self.membros) - 1):
+                    return
+                time.sleep(0.5)
+        raise RuntimeError(f"O replica set {self.nome} não ficou pronto ao fim de {timeout}s")
+
+    def parar(self):
+        for membro in self.membros:
+            membro.parar()
+
+
+def arrancar_mongo(binario, dbpath_base, replica_set=False):
+    """mongod temporário, ou um replica set de três membros com replica_set=True."""
+    mongo = ReplicaSetLocal(binario, dbpath_base) if replica_set else MongoLocal(binario, dbpath_base)
+    mongo.iniciar()
+    return mongo
+
+
+def produto_sintetico(i):
+    return {
+        "id": i,
+        "nome": f"Produto {i}",
+        "marca": MARCAS[i % len(MARCAS)],
+        "preco": round(5 + (i * 7919 % 200000) / 100, 2),
+        "stock": i * 31 % 500,
+        "caracteristicas": {
+            "tela": f"{4 + i % 12} polegadas",
+            "bateria": f"{1000 + i % 4000}mAh",
+            "armazenamento": f"{2 ** (4 + i % 6)}GB"
+        }
+    }
+
+
+def popular_catalogo(mongo_url, tamanho, lote=10000, indice_id=True):
+    """Substitui catalogo.produtos por `tamanho` produtos sintéticos."""
+    colecao = MongoClient(mongo_url)["catalogo"]["produtos"]
+    colecao.drop()
+    for inicio in range(1, tamanho + 1, lote):
+        fim = min(inicio + lote, tamanho + 1)
+        colecao.insert_many([produto_sintetico(i) for i in range(inicio, fim)], ordered=False)
+    if indice_id:
+        colecao.create_index("id", unique=True)
+    return colecao
+
+
+class Servidor:
+    def __init__(self, protocolo, python, env):
+        self.protocolo = protocolo
+        self.diretorio, self.script, self.porta = SERVIDORES[protocolo]
+        self.python = python
+        self.env = env
+        self.processo = None
+        self.log = None
+
+    def iniciar(self, pasta_logs):
+        self.log = open(os.path.join(pasta_logs, f"{self.protocolo}.log"), "wb")
+        self.processo = subprocess.Popen(
+            [self.python, self.script],
+            cwd=os.path.join(RAIZ, self.diretorio),
+            env=self.env,
+            stdout=self.log,
+            stderr=subprocess.STDOUT
+        )
+        esperar_porta(self.porta, processo=self.processo)
+
+    def processos(self):
+        # Inclui filhos: o reloader do Flask e os workers do uvicorn
+        raiz = psutil.Process(self.processo.pid)
+        return [raiz] + raiz.children(recursive=True)
+
+    def parar(self):
+        if self.processo and self.processo.poll() is None:
+            for p in reversed(self.processos()):
+                try:
+                    p.terminate()
+                except psutil.NoSuchProcess:
+                    pass
+            try:
+                self.processo.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.processo.kill()
+        if self.log:
+            self.log.close()
+
+
+def env_servidores(mongo_url, keycloak_url, extra=None):
+    env = dict(os.environ)
+    env.update({
+        "MONGO_URL": mongo_url,
+        "KEYCLOAK_URL": keycloak_url,
+        "PYTHONUNBUFFERED": "1",
+        # Todos os clientes usam o mesmo utilizador: sem isto o benchmark mede o limite de taxa
+        "ADMISSAO": "0"
+    })
+    env.update(extra or {})
+    return env
+
+
+class AmostradorRecursos:
+    """Mede CPU (fração de um core) e RSS da árvore de processos de um servidor."""
+
+    def __init__(self, servidor):
+        self.servidor = servidor
+        self.inicio = None
+        self.cpu_inicio = None
+        self.rss_max = 0
+
+    def _cpu(self):
+        total = 0.0
+        for p in self.servidor.processos():
+            try:
+                t = p.cpu_times()
+                total += t.user + t.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def iniciar(self):
+        self.inicio = time.perf_counter()
+        self.cpu_inicio = self._cpu()
+        self.rss_max = 0
+        self.amostrar()
+
+    def amostrar(self):
+        rss = 0
+        for p in self.servidor.processos():
+            try:
+                rss += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        self.rss_max = max(self.rss_max, rss)
+
+    def resultado(self):
+        self.amostrar()
+        decorrido = time.perf_counter() - self.inicio
+        return {
+            "cpu_percent": round(100 * (self._cpu() - self.cpu_inicio) / decorrido, 1),
+            "rss_max_mb": round(self.rss_max / 2 ** 20, 1)
+        }
@@ -0,0 +1,252 @@
+"""Benchmark de carga ponta-a-ponta REST / SOAP / gRPC / GraphQL.
+
+Arranca um mongod temporário (ou um replica set local de três membros com
+--replica-set, ou usa --mongo-url), um emissor de tokens no lugar do
+Keycloak e os quatro servidores, e repete a mesma mistura de operações para
+cada tamanho de catálogo e nível de concorrência.
+
+Exemplo:
+    python carga.py --tamanhos 1000,100000 --concorrencia 1,16,64 \\
+        --mix listar=5,editar=10 --duracao 20 --saida resultados.json
+
+A mistura por omissão só tem operações que os quatro protocolos suportam.
+SOAP e gRPC não têm `obter`: para medir leituras por id, comparar só REST e
+GraphQL (--protocolos rest,graphql --mix listar=5,obter=85,editar=10).
+Só entram na mistura as operações que todos os protocolos escolhidos
+suportam: as outras são retiradas a todos, com um aviso, para que as linhas
+"*" sejam comparáveis. Com --mix-por-protocolo
+cada protocolo usa as operações que tem, e cada linha regista a sua mistura.
+
+Para medir as leituras nos secundários, repetir com --replica-set e com
+--replica-set --env MONGO_LEITURAS=primario e comparar os dois resultados.
+
+As dependências de cada servidor têm de estar instaladas no interpretador
+indicado em --python. As escritas SOAP publicam no RabbitMQ (RABBITMQ_HOST).
+ATENÇÃO: com --mongo-url a coleção catalogo.produtos é apagada e recriada.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from ambiente import (RAIZ, AmostradorRecursos, Servidor, arrancar_mongo,
+                      env_servidores, popular_catalogo)
+from clientes import CLIENTES
+from emissor_tokens import EmissorTokens
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    # Percentil pelo método nearest-rank
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def resumo(nome, latencias, erros, duracao):
+    ordenados = sorted(latencias)
+    em_ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "operacao": nome,
+        "pedidos": len(ordenados),
+        "erros": erros,
+        "rps": round(len(ordenados) / duracao, 1),
+        "p50_ms": em_ms(percentil(ordenados, 50)),
+        "p90_ms": em_ms(percentil(ordenados, 90)),
+        "p99_ms": em_ms(percentil(ordenados, 99)),
+        "max_ms": em_ms(ordenados[-1] if ordenados else None),
+    }
+
+
+async def correr_cenario(cliente, mix, tamanho, concorrencia, duracao, aquecimento, amostrador):
+    operacoes = [(nome, peso) for nome, peso in mix.items() if nome in cliente.operacoes]
+    if not operacoes:
+        return []
+    nomes = [nome for nome, _ in operacoes]
+    pesos = [peso for _, peso in operacoes]
+    latencias = {nome: [] for nome in nomes}
+    erros = {nome: 0 for nome in nomes}
+
+    async def trabalhador(semente, fim, medir):
+        rnd = random.Random(semente)
+        while time.perf_counter() < fim:
+            nome = rnd.choices(nomes, pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                await cliente.operacoes[nome](rnd.randint(1, tamanho))
+            except Exception:
+                if medir:
+                    erros[nome] += 1
+                continue
+            if medir:
+                latencias[nome].append(time.perf_counter() - inicio)
+
+    async def amostrar(fim):
+        while time.perf_counter() < fim:
+            amostrador.amostrar()
+            await asyncio.sleep(0.5)
+
+    if aquecimento:
+        fim = time.perf_counter() + aquecimento
+        await asyncio.gather(*(trabalhador(i, fim, False) for i in range(concorrencia)))
+
+    amostrador.iniciar()
+    inicio = time.perf_counter()
+    fim = inicio + duracao
+    await asyncio.gather(amostrar(fim), *(trabalhador(1000 + i, fim, True) for i in range(concorrencia)))
+    decorrido = time.perf_counter() - inicio
+    recursos = amostrador.resultado()
+
+    linhas = [resumo(nome, latencias[nome], erros[nome], decorrido) for nome in nomes]
+    todas = [v for nome in nomes for v in latencias[nome]]
+    linhas.append(resumo("*", todas, sum(erros.values()), decorrido))
+    for linha in linhas:
+        linha.update(recursos)
+    return linhas
+
+
+def ler_mix(texto):
+    mix = {}
+    for parte in texto.split(","):
+        nome, peso = parte.split("=")
+        mix[nome.strip()] = float(peso)
+    return mix
+
+
+def mistura_comum(mix, protocolos):
+    """Operações do mix suportadas por todos os protocolos, e {operação: protocolos sem ela} das retiradas."""
+    retiradas = {}
+    for nome in mix:
+        sem = [p for p in protocolos if nome not in CLIENTES[p].OPERACOES]
+        if sem:
+            retiradas[nome] = sem
+    return {nome: peso for nome, peso in mix.items() if nome not in retiradas}, retiradas
+
+
+def ler_inteiros(texto):
+    return [int(v) for v in texto.split(",")]
+
+
+def commit_atual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def imprimir(linhas):
+    cabecalho = f"{'tamanho':>8} {'protocolo':<8} {'operacao':<14} {'conc':>4} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'erros':>6} {'cpu %':>6} {'rss MB':>7}"
+    print(cabecalho)
+    print("-" * len(cabecalho))
+    for l in linhas:
+        print(f"{l['tamanho']:>8} {l['protocolo']:<8} {l['operacao']:<14} {l['concorrencia']:>4} "
+              f"{l['rps']:>9} {str(l['p50_ms']):>9} {str(l['p99_ms']):>9} {l['erros']:>6} "
+              f"{l['cpu_percent']:>6} {l['rss_max_mb']:>7}")
+
+
+async def correr(args, servidores, token):
+    resultados = []
+    mix = ler_mix(args.mix)
+    if not args.mix_por_protocolo:
+        mix, retiradas = mistura_comum(mix, list(servidores))
+        for nome, sem in retiradas.items():
+            print(f"[!] '{nome}' não existe em {', '.join(sem)}: retirada da mistura de todos os protocolos")
+        if not mix:
+            raise SystemExit("[x] Nenhuma operação do --mix é suportada por todos os protocolos")
+    for tamanho in ler_inteiros(args.tamanhos):
+        print(f"[*] A popular o catálogo com {tamanho} produtos...")
+        popular_catalogo(args.mongo_url, tamanho, indice_id=not args.sem_indice)
+        for protocolo, servidor in servidores.items():
+            amostrador = AmostradorRecursos(servidor)
+            for concorrencia in ler_inteiros(args.concorrencia):
+                cliente = CLIENTES[protocolo](token, concorrencia)
+                try:
+                    linhas = await correr_cenario(
+                        cliente, mix, tamanho, concorrencia, args.duracao, args.aquecimento, amostrador
+                    )
+                finally:
+                    await cliente.fechar()
+                efetiva = {nome: peso for nome, peso in mix.items() if nome in CLIENTES[protocolo].OPERACOES}
+                for linha in linhas:
+                    linha.update({
+                        "tamanho": tamanho, "protocolo": protocolo, "concorrencia": concorrencia, "mix": efetiva
+                    })
+                imprimir(linhas)
+                resultados.extend(linhas)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--protocolos", default="rest,soap,grpc,graphql")
+    parser.add_argument("--tamanhos", default="1000,100000,1000000")
+    parser.add_argument("--concorrencia", default="1,16,64")
+    parser.add_argument("--mix", default="listar=5,editar=10",
+                        help="pesos por operação; as que algum protocolo não suporta são retiradas a todos")
+    parser.add_argument("--mix-por-protocolo", action="store_true",
+                        help="cada protocolo usa as operações do --mix que suporta (misturas diferentes)")
+    parser.add_argument("--duracao", type=float, default=20, help="segundos medidos por cenário")
+    parser.add_argument("--aquecimento", type=float, default=3, help="segundos de aquecimento por cenário")
+    parser.add_argument("--mongo-url", help="mongod existente (a coleção é substituída)")
+    parser.add_argument("--mongod", default="mongod", help="binário mongod a arrancar")
+    parser.add_argument("--dbpath-base", help="diretório para o dbpath temporário (ex.: /dev/shm)")
+    parser.add_argument("--replica-set", action="store_true",
+                        help="arrancar um replica set local de três membros em vez de um mongod")
+    parser.add_argument("--sem-indice", action="store_true", help="não criar o índice em produtos.id")
+    parser.add_argument("--porta-jwks", type=int, default=8089)
+    parser.add_argument("--python", default=sys.executable, help="interpretador dos servidores")
+    parser.add_argument("--env", action="append", default=[], help="VAR=valor extra para os servidores")
+    parser.add_argument("--saida", help="ficheiro JSON com os resultados")
+    args = parser.parse_args()
+
+    emissor = EmissorTokens(porta=args.porta_jwks)
+    emissor.iniciar()
+    mongo = None
+    if not args.mongo_url:
+        mongo = arrancar_mongo(args.mongod, args.dbpath_base, args.replica_set)
+        args.mongo_url = mongo.url
+
+    extra = dict(v.split("=", 1) for v in args.env)
+    env = env_servidores(args.mongo_url, emissor.url, extra)
+    pasta_logs = tempfile.mkdtemp(prefix="bench-logs-")
+    servidores = {}
+    try:
+        for protocolo in args.protocolos.split(","):
+            servidor = Servidor(protocolo, args.python, env)
+            print(f"[*] A arrancar {protocolo} (log em {pasta_logs}/{protocolo}.log)")
+            servidor.iniciar(pasta_logs)
+            servidores[protocolo] = servidor
+
+        inicio = time.time()
+        resultados = asyncio.run(correr(args, servidores, emissor.emitir()))
+        if args.saida:
+            with open(args.saida, "w") as f:
+                json.dump({
+                    "metadados": {
+                        "inicio": inicio,
+                        "commit": commit_atual(),
+                        "host": platform.node(),
+                        "cpus": os.cpu_count(),
+                        "python": platform.python_version(),
+                        "argumentos": {k: v for k, v in vars(args).items() if k != "env"},
+                        "env_servidores": extra
+                    },
+                    "resultados": resultados
+                }, f, indent=2)
+            print(f"[*] Resultados guardados em {args.saida}")
+    finally:
+        for servidor in servidores.values():
+            servidor.parar()
+        if mongo:
+            mongo.parar()
+        emissor.parar()
+
+
+if __name__ == "__main__":
+    main()
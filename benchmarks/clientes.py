@@ -0,0 +1,190 @@
+"""Clientes assíncronos por protocolo; cada operação recebe um id de produto.
+
+OPERACOES lista, por classe, as operações que o protocolo tem.
+
+Uma operação que falha levanta exceção, e o gerador de carga conta-a como erro.
+"""
+import os
+import sys
+from xml.sax.saxutils import escape
+
+import grpc
+import httpx
+from google.protobuf import empty_pb2
+
+from ambiente import RAIZ, produto_sintetico
+
+sys.path.insert(0, os.path.join(RAIZ, "serverc", "grpc"))
+import produtos_pb2  # noqa: E402
+import produtos_pb2_grpc  # noqa: E402
+
+CAMPOS_GRAPHQL = "id nome marca preco stock caracteristicas { tela bateria armazenamento }"
+SOAP_TNS = "catalogo.eletronica.soap"
+
+
+def produto_editado(id):
+    produto = produto_sintetico(id)
+    produto["stock"] += 1
+    return produto
+
+
+class ClienteREST:
+    protocolo = "rest"
+    OPERACOES = ("listar", "obter", "exportar", "editar")
+
+    def __init__(self, token, concorrencia, url="http://127.0.0.1:5000"):
+        self.http = httpx.AsyncClient(
+            base_url=url,
+            headers={"Authorization": f"Bearer {token}"},
+            limits=httpx.Limits(max_connections=concorrencia),
+            timeout=120
+        )
+        self.operacoes = {nome: getattr(self, nome) for nome in self.OPERACOES}
+
+    async def _verificar(self, resposta):
+        resposta.raise_for_status()
+        return resposta.content
+
+    async def listar(self, id):
+        return await self._verificar(await self.http.get("/produtos"))
+
+    async def obter(self, id):
+        return await self._verificar(await self.http.get(f"/produtos/{id}"))
+
+    async def exportar(self, id):
+        return await self._verificar(await self.http.get("/exportar"))
+
+    async def editar(self, id):
+        return await self._verificar(await self.http.put(f"/produtos/{id}", json=produto_editado(id)))
+
+    async def fechar(self):
+        await self.http.aclose()
+
+
+class ClienteSOAP:
+    protocolo = "soap"
+    OPERACOES = ("listar", "editar")
+
+    def __init__(self, token, concorrencia, url="http://127.0.0.1:8000"):
+        self.http = httpx.AsyncClient(
+            base_url=url,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "text/xml; charset=utf-8"},
+            limits=httpx.Limits(max_connections=concorrencia),
+            timeout=120
+        )
+        self.operacoes = {nome: getattr(self, nome) for nome in self.OPERACOES}
+
+    def _envelope(self, metodo, argumentos=None):
+        corpo = "".join(f"<tns:{k}>{escape(str(v))}</tns:{k}>" for k, v in (argumentos or {}).items())
+        return (
+            '<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+            f'xmlns:tns="{SOAP_TNS}"><soapenv:Body><tns:{metodo}>{corpo}</tns:{metodo}>'
+            "</soapenv:Body></soapenv:Envelope>"
+        )
+
+    async def _chamar(self, metodo, argumentos=None):
+        resposta = await self.http.post("/", content=self._envelope(metodo, argumentos), headers={"SOAPAction": metodo})
+        resposta.raise_for_status()
+        if b"Fault>" in resposta.content:
+            raise RuntimeError(f"SOAP Fault em {metodo}")
+        return resposta.content
+
+    async def listar(self, id):
+        return await self._chamar("getProdutos")
+
+    async def editar(self, id):
+        p = produto_editado(id)
+        return await self._chamar("editarProduto", {
+            "id": p["id"], "nome": p["nome"], "marca": p["marca"], "preco": p["preco"], "stock": p["stock"],
+            "tela": p["caracteristicas"]["tela"],
+            "bateria": p["caracteristicas"]["bateria"],
+            "armazenamento": p["caracteristicas"]["armazenamento"]
+        })
+
+    async def fechar(self):
+        await self.http.aclose()
+
+
+class ClienteGRPC:
+    protocolo = "grpc"
+    OPERACOES = ("listar", "listar_stream", "editar")
+
+    def __init__(self, token, concorrencia, alvo="127.0.0.1:50051"):
+        self.canal = grpc.aio.insecure_channel(alvo, options=[
+            ("grpc.max_receive_message_length", -1),
+        ])
+        self.stub = produtos_pb2_grpc.ProdutoServiceStub(self.canal)
+        self.metadata = (("authorization", f"Bearer {token}"),)
+        self.operacoes = {nome: getattr(self, nome) for nome in self.OPERACOES}
+
+    async def listar(self, id):
+        return await self.stub.ListarProdutos(empty_pb2.Empty(), metadata=self.metadata)
+
+    async def listar_stream(self, id):
+        total = 0
+        async for _ in self.stub.ListarProdutosStream(empty_pb2.Empty(), metadata=self.metadata):
+            total += 1
+        return total
+
+    async def editar(self, id):
+        p = produto_editado(id)
+        resposta = await self.stub.EditarProduto(produtos_pb2.Produto(
+            id=p["id"], nome=p["nome"], marca=p["marca"], preco=p["preco"], stock=p["stock"],
+            tela=p["caracteristicas"]["tela"],
+            bateria=p["caracteristicas"]["bateria"],
+            armazenamento=p["caracteristicas"]["armazenamento"]
+        ), metadata=self.metadata)
+        if not resposta.sucesso:
+            raise RuntimeError(resposta.mensagem)
+        return resposta
+
+    async def fechar(self):
+        await self.canal.close()
+
+
+class ClienteGraphQL:
+    protocolo = "graphql"
+    OPERACOES = ("listar", "obter", "editar")
+
+    def __init__(self, token, concorrencia, url="http://127.0.0.1:5001"):
+        self.http = httpx.AsyncClient(
+            base_url=url,
+            headers={"Authorization": f"Bearer {token}"},
+            limits=httpx.Limits(max_connections=concorrencia),
+            timeout=120
+        )
+        self.operacoes = {nome: getattr(self, nome) for nome in self.OPERACOES}
+
+    async def _executar(self, query, variables=None):
+        resposta = await self.http.post("/graphql", json={"query": query, "variables": variables})
+        resposta.raise_for_status()
+        corpo = resposta.json()
+        if corpo.get("errors"):
+            raise RuntimeError(corpo["errors"][0]["message"])
+        return corpo
+
+    async def listar(self, id):
+        return await self._executar(f"{{ produtos {{ {CAMPOS_GRAPHQL} }} }}")
+
+    async def obter(self, id):
+        return await self._executar(f"query($id: Int!) {{ produto(id: $id) {{ {CAMPOS_GRAPHQL} }} }}", {"id": id})
+
+    async def editar(self, id):
+        p = produto_editado(id)
+        corpo = await self._executar(
+            "mutation($id: Int!, $nome: String!, $marca: String!, $preco: Float!, $stock: Int!, "
+            "$tela: String!, $bateria: String!, $armazenamento: String!) { "
+            "editarProduto(id: $id, nome: $nome, marca: $marca, preco: $preco, stock: $stock, "
+            "tela: $tela, bateria: $bateria, armazenamento: $armazenamento) { ok mensagem } }",
+            {"id": p["id"], "nome": p["nome"], "marca": p["marca"], "preco": p["preco"], "stock": p["stock"],
+             **p["caracteristicas"]}
+        )
+        if not corpo["data"]["editarProduto"]["ok"]:
+            raise RuntimeError(corpo["data"]["editarProduto"]["mensagem"])
+        return corpo
+
+    async def fechar(self):
+        await self.http.aclose()
+
+
+CLIENTES = {c.protocolo: c for c in (ClienteREST, ClienteSOAP, ClienteGRPC, ClienteGraphQL)}
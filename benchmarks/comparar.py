@@ -0,0 +1,56 @@
+"""Compara dois ficheiros de resultados de carga.py e assinala regressões.
+
+    python comparar.py base.json novo.json --limite 10
+
+Termina com código 1 se algum cenário perder mais do que --limite % de rps
+ou subir mais do que --limite % no p99.
+"""
+import argparse
+import json
+import sys
+
+
+def chave(linha):
+    return (linha["tamanho"], linha["protocolo"], linha["operacao"], linha["concorrencia"])
+
+
+def variacao(antes, depois):
+    if not antes or depois is None:
+        return None
+    return 100 * (depois - antes) / antes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("novo")
+    parser.add_argument("--limite", type=float, default=10, help="percentagem tolerada")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = {chave(l): l for l in json.load(f)["resultados"]}
+    with open(args.novo) as f:
+        novo = {chave(l): l for l in json.load(f)["resultados"]}
+
+    regressoes = 0
+    print(f"{'tamanho':>8} {'protocolo':<8} {'operacao':<14} {'conc':>4} {'rps':>10} {'Δrps %':>8} {'p99 ms':>10} {'Δp99 %':>8}")
+    for k in sorted(base.keys() & novo.keys(), key=str):
+        antes, depois = base[k], novo[k]
+        d_rps = variacao(antes["rps"], depois["rps"])
+        d_p99 = variacao(antes["p99_ms"], depois["p99_ms"])
+        regressao = (d_rps is not None and d_rps < -args.limite) or (d_p99 is not None and d_p99 > args.limite)
+        regressoes += regressao
+        formatar = lambda v: f"{v:+.1f}" if v is not None else "n/a"
+        print(f"{k[0]:>8} {k[1]:<8} {k[2]:<14} {k[3]:>4} {depois['rps']:>10} {formatar(d_rps):>8} "
+              f"{str(depois['p99_ms']):>10} {formatar(d_p99):>8}{'  <-- regressão' if regressao else ''}")
+
+    for k in sorted(base.keys() ^ novo.keys(), key=str):
+        print(f"[!] Cenário só num dos ficheiros: {k}")
+
+    if regressoes:
+        print(f"[x] {regressoes} cenário(s) com regressão acima de {args.limite}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Substituto local do Keycloak: publica um JWKS e emite tokens RS256.
+
+Os servidores só precisam de KEYCLOAK_URL a apontar para aqui; o issuer e o
+caminho do JWKS são os mesmos do realm catalogo-produtos.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import json
+import threading
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+KEYCLOAK_REALM = "catalogo-produtos"
+KID = "benchmark"
+
+
+def _b64url_int(valor):
+    dados = valor.to_bytes((valor.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(dados).rstrip(b"=").decode("ascii")
+
+
+class EmissorTokens:
+    def __init__(self, host="127.0.0.1", porta=8089):
+        self.host = host
+        self.porta = porta
+        self.chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.chave_pem = self.chave.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        numeros = self.chave.public_key().public_numbers()
+        self.jwks = {"keys": [{
+            "kid": KID,
+            "kty": "RSA",
+            "alg": "RS256",
+            "use": "sig",
+            "n": _b64url_int(numeros.n),
+            "e": _b64url_int(numeros.e)
+        }]}
+        self.servidor = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.porta}"
+
+    @property
+    def issuer(self):
+        return f"{self.url}/realms/{KEYCLOAK_REALM}"
+
+    def emitir(self, utilizador="benchmark", validade=24 * 3600):
+        agora = int(time.time())
+        claims = {
+            "iss": self.issuer,
+            "sub": utilizador,
+            "preferred_username": utilizador,
+            "iat": agora,
+            "exp": agora + validade
+        }
+        return jwt.encode(claims, self.chave_pem, algorithm="RS256", headers={"kid": KID})
+
+    def iniciar(self):
+        jwks = json.dumps(self.jwks).encode("utf-8")
+        caminho_jwks = f"/realms/{KEYCLOAK_REALM}/protocol/openid-connect/certs"
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != caminho_jwks:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(jwks)))
+                self.end_headers()
+                self.wfile.write(jwks)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer((self.host, self.porta), Handler)
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def parar(self):
+        if self.servidor:
+            self.servidor.shutdown()
+            self.servidor.server_close()
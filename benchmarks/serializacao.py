@@ -0,0 +1,247 @@
+"""Microbenchmark do custo de serialização de N produtos em cada formato.
+
+Sem rede nem base de dados: mede encode, decode, memória alocada e tamanho do
+payload exatamente com as bibliotecas usadas por cada servidor.
+
+    python serializacao.py --n 1,100,10000 --repeticoes 20 --saida serializacao.json
+
+Os modelos SOAP e GraphQL replicam ProdutoSOAP (serverb/soap/server.py) e
+ProdutoType (serverc/graphql/schema.py), cujos módulos têm efeitos laterais
+no import (ligações ao RabbitMQ e ao Keycloak).
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from bson import json_util
+import graphene
+from graphql import execute, parse
+from lxml import etree
+from spyne import Application, rpc, ServiceBase, Integer, Unicode, Float, Iterable, ComplexModel
+from spyne.protocol.soap import Soap11
+from spyne.server.null import NullServer
+from spyne.util.xml import get_xml_as_object
+
+from ambiente import RAIZ, produto_sintetico
+
+sys.path.insert(0, os.path.join(RAIZ, "serverc", "grpc"))
+sys.path.insert(0, os.path.join(RAIZ, "servera", "rest"))
+import produtos_pb2  # noqa: E402
+import codificadores  # noqa: E402
+
+
+# === REST: bson.json_util como em servera/rest/app.py ===
+def rest_encode(produtos):
+    return json_util.dumps(produtos).encode("utf-8")
+
+
+def rest_decode(payload):
+    return json_util.loads(payload)
+
+
+# === SOAP: Spyne Soap11 ===
+SOAP_TNS = "catalogo.eletronica.soap"
+
+
+class ProdutoSOAP(ComplexModel):
+    id = Integer
+    nome = Unicode
+    marca = Unicode
+    preco = Float
+    stock = Integer
+    tela = Unicode
+    bateria = Unicode
+    armazenamento = Unicode
+
+
+_soap_atuais = []
+
+
+class ProdutoService(ServiceBase):
+    @rpc(_returns=Iterable(ProdutoSOAP))
+    def getProdutos(ctx):
+        return [ProdutoSOAP(**p) for p in _soap_atuais]
+
+
+# O NullServer escreve um cabeçalho por pedido como warning
+logging.getLogger("spyne.server.null").setLevel(logging.ERROR)
+_soap_servidor = NullServer(
+    Application([ProdutoService], tns=SOAP_TNS, in_protocol=Soap11(), out_protocol=Soap11()),
+    ostr=True
+)
+
+
+def soap_preparar(produtos):
+    # O servidor SOAP guarda tela/bateria/armazenamento no topo do documento
+    return [{**{k: v for k, v in p.items() if k != "caracteristicas"}, **p["caracteristicas"]} for p in produtos]
+
+
+def soap_encode(produtos):
+    _soap_atuais[:] = produtos
+    return b"".join(_soap_servidor.service.getProdutos())
+
+
+def soap_decode(payload):
+    raiz = etree.fromstring(payload)
+    # O namespace de ProdutoSOAP é o do módulo onde está definido
+    return [get_xml_as_object(e, ProdutoSOAP) for e in raiz.xpath("//*[local-name()='ProdutoSOAP']")]
+
+
+# === gRPC: protobuf ListaProdutos ===
+def grpc_encode(produtos):
+    resposta = produtos_pb2.ListaProdutos()
+    for p in produtos:
+        resposta.produtos.append(produtos_pb2.Produto(
+            id=p["id"],
+            nome=p["nome"],
+            marca=p["marca"],
+            preco=p["preco"],
+            stock=p["stock"],
+            tela=p.get("caracteristicas", {}).get("tela", "n/a"),
+            bateria=p.get("caracteristicas", {}).get("bateria", "n/a"),
+            armazenamento=p.get("caracteristicas", {}).get("armazenamento", "n/a")
+        ))
+    return resposta.SerializeToString()
+
+
+def grpc_decode(payload):
+    resposta = produtos_pb2.ListaProdutos()
+    resposta.ParseFromString(payload)
+    return resposta
+
+
+# === GraphQL: executor graphene + JSON da resposta ===
+class CaracteristicasType(graphene.ObjectType):
+    tela = graphene.String()
+    bateria = graphene.String()
+    armazenamento = graphene.String()
+
+
+class ProdutoType(graphene.ObjectType):
+    id = graphene.Int()
+    nome = graphene.String()
+    marca = graphene.String()
+    preco = graphene.Float()
+    stock = graphene.Int()
+    caracteristicas = graphene.Field(CaracteristicasType)
+
+
+class Query(graphene.ObjectType):
+    produtos = graphene.List(ProdutoType)
+
+    def resolve_produtos(root, info):
+        return root
+
+
+_graphql_schema = graphene.Schema(query=Query)
+# O servidor guarda os documentos já parsed (cache_documentos), por isso só a execução conta
+GRAPHQL_DOCUMENTO = parse("{ produtos { id nome marca preco stock caracteristicas { tela bateria armazenamento } } }")
+
+
+def graphql_encode(produtos):
+    resultado = execute(_graphql_schema.graphql_schema, GRAPHQL_DOCUMENTO, root_value=produtos)
+    return json.dumps(resultado.formatted).encode("utf-8")
+
+
+def graphql_decode(payload):
+    return json.loads(payload)
+
+
+# formato -> (preparar, encode, decode)
+FORMATOS = {
+    "rest_json_util": (None, rest_encode, rest_decode),
+}
+# Codificadores negociados pelo REST (servera/rest/codificadores.py)
+for _mimetype, _nome in (("application/json", "rest_json"), ("application/msgpack", "rest_msgpack"), ("application/cbor", "rest_cbor")):
+    if _mimetype in codificadores.FORMATOS:
+        FORMATOS[_nome] = (None, *codificadores.FORMATOS[_mimetype])
+FORMATOS.update({
+    "soap_spyne": (soap_preparar, soap_encode, soap_decode),
+    "grpc_protobuf": (None, grpc_encode, grpc_decode),
+    "graphql_graphene": (None, graphql_encode, graphql_decode),
+})
+
+
+def cronometrar(funcao, argumento, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(argumento)
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def memoria_pico(funcao, argumento):
+    tracemalloc.start()
+    try:
+        funcao(argumento)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return pico
+
+
+def medir(nome, n, repeticoes):
+    preparar, encode, decode = FORMATOS[nome]
+    produtos = [produto_sintetico(i) for i in range(1, n + 1)]
+    if preparar:
+        produtos = preparar(produtos)
+
+    payload = encode(produtos)
+    decode(payload)
+    t_encode = cronometrar(encode, produtos, repeticoes)
+    t_decode = cronometrar(decode, payload, repeticoes)
+    em_us = lambda v: round(v * 1e6, 2)
+    return {
+        "formato": nome,
+        "n": n,
+        "bytes": len(payload),
+        "bytes_por_produto": round(len(payload) / n, 1),
+        "encode_mediana_us": em_us(statistics.median(t_encode)),
+        "encode_min_us": em_us(min(t_encode)),
+        "encode_us_por_produto": em_us(statistics.median(t_encode) / n),
+        "decode_mediana_us": em_us(statistics.median(t_decode)),
+        "decode_min_us": em_us(min(t_decode)),
+        "decode_us_por_produto": em_us(statistics.median(t_decode) / n),
+        "encode_alocado_kb": round(memoria_pico(encode, produtos) / 1024, 1),
+        "decode_alocado_kb": round(memoria_pico(decode, payload) / 1024, 1),
+    }
+
+
+def imprimir(linhas):
+    cabecalho = (f"{'formato':<18} {'n':>7} {'bytes/prod':>10} {'enc µs/prod':>11} {'dec µs/prod':>11} "
+                 f"{'enc KB':>9} {'dec KB':>9}")
+    print(cabecalho)
+    print("-" * len(cabecalho))
+    for l in linhas:
+        print(f"{l['formato']:<18} {l['n']:>7} {l['bytes_por_produto']:>10} {l['encode_us_por_produto']:>11} "
+              f"{l['decode_us_por_produto']:>11} {l['encode_alocado_kb']:>9} {l['decode_alocado_kb']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", default="1,100,10000", help="números de produtos por payload")
+    parser.add_argument("--formatos", default=",".join(FORMATOS))
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--saida", help="ficheiro JSON com os resultados")
+    args = parser.parse_args()
+
+    linhas = []
+    for n in (int(v) for v in args.n.split(",")):
+        for nome in args.formatos.split(","):
+            linhas.append(medir(nome, n, args.repeticoes))
+    imprimir(linhas)
+
+    if args.saida:
+        with open(args.saida, "w") as f:
+            json.dump({"metadados": {"python": sys.version, "repeticoes": args.repeticoes}, "resultados": linhas}, f, indent=2)
+        print(f"[*] Resultados guardados em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
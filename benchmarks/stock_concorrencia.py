@@ -0,0 +1,176 @@
+"""Teste de stress da API de stock: muitos clientes a disputar poucos produtos.
+
+Cada thread faz decrementos de 1 unidade e reservas de vários produtos
+(confirmadas ou canceladas ao acaso) sobre um pequeno conjunto de produtos
+"quentes". No fim verifica, por produto:
+
+    stock final == stock inicial - decrementos aceites - reservas confirmadas
+
+e que o stock nunca fica negativo, e que cada alteração aceite deixou o seu
+evento stock_alterado no outbox. Sai com código 1 se alguma atualização se
+perdeu. --modo rmw corre o mesmo teste com ler-modificar-escrever (o que um
+cliente tem de fazer hoje com PUT/EditarProduto), para comparação.
+
+    python stock_concorrencia.py --threads 32 --produtos 4 --stock 2000 --operacoes 500
+
+Com --replica-set corre contra um replica set local de três membros, onde o
+outbox grava o evento na mesma transação que o stock.
+
+ATENÇÃO: com --mongo-url as coleções catalogo.produtos, catalogo.reservas e
+catalogo.outbox são apagadas.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from pymongo import MongoClient
+
+from ambiente import RAIZ, arrancar_mongo, produto_sintetico
+
+sys.path.insert(0, os.path.join(RAIZ, "servera", "rest"))
+from stock import GestorStock, ErroStock  # noqa: E402
+from outbox import Outbox, COLECAO_OUTBOX  # noqa: E402
+
+
+class ReadModifyWrite:
+    """O padrão que a API de stock substitui: ler o produto e gravar o stock calculado."""
+
+    def __init__(self, colecao):
+        self.colecao = colecao
+
+    def ajustar(self, produto_id, delta):
+        produto = self.colecao.find_one({"id": produto_id}, {"_id": 0, "stock": 1})
+        if produto["stock"] + delta < 0:
+            raise ErroStock("insuficiente", "Stock insuficiente", produto_id)
+        self.colecao.update_one({"id": produto_id}, {"$set": {"stock": produto["stock"] + delta}})
+        return produto["stock"] + delta
+
+
+def trabalhador(gestor, ids, operacoes, semente, contagens, latencias, lock):
+    rnd = random.Random(semente)
+    locais = Counter()
+    tempos = []
+    for _ in range(operacoes):
+        inicio = time.perf_counter()
+        if isinstance(gestor, GestorStock) and rnd.random() < 0.3:
+            itens = [(produto_id, rnd.randint(1, 3)) for produto_id in rnd.sample(ids, min(2, len(ids)))]
+            try:
+                reserva = gestor.reservar(itens, ttl=60)
+            except ErroStock:
+                locais["reservas_recusadas"] += 1
+            else:
+                if rnd.random() < 0.5:
+                    gestor.confirmar(reserva["_id"])
+                    for item in reserva["itens"]:
+                        locais[("consumido", item["id"])] += item["quantidade"]
+                    locais["reservas_confirmadas"] += 1
+                else:
+                    gestor.cancelar(reserva["_id"])
+                    locais["reservas_canceladas"] += 1
+        else:
+            produto_id = rnd.choice(ids)
+            try:
+                gestor.ajustar(produto_id, -1)
+            except ErroStock:
+                locais["decrementos_recusados"] += 1
+            else:
+                locais[("consumido", produto_id)] += 1
+                locais["decrementos_aceites"] += 1
+        tempos.append(time.perf_counter() - inicio)
+    with lock:
+        contagens.update(locais)
+        latencias.extend(tempos)
+
+
+def correr(colecao, reservas, modo, threads, produtos, stock, operacoes):
+    eventos = colecao.database[COLECAO_OUTBOX]
+    colecao.drop()
+    reservas.drop()
+    eventos.drop()
+    ids = list(range(1, produtos + 1))
+    colecao.insert_many([{**produto_sintetico(i), "stock": stock} for i in ids])
+    colecao.create_index("id", unique=True)
+
+    if modo == "atomico":
+        gestor = GestorStock(colecao, reservas, Outbox(colecao.database, "benchmark"))
+        gestor.criar_indices()
+    else:
+        gestor = ReadModifyWrite(colecao)
+    contagens, latencias, lock = Counter(), [], threading.Lock()
+    workers = [
+        threading.Thread(target=trabalhador, args=(gestor, ids, operacoes, i, contagens, latencias, lock))
+        for i in range(threads)
+    ]
+    inicio = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    decorrido = time.perf_counter() - inicio
+
+    finais = {p["id"]: p["stock"] for p in colecao.find({"id": {"$in": ids}}, {"_id": 0, "id": 1, "stock": 1})}
+    violacoes = []
+    for produto_id in ids:
+        esperado = stock - contagens[("consumido", produto_id)]
+        if finais[produto_id] != esperado or finais[produto_id] < 0:
+            violacoes.append({"id": produto_id, "esperado": esperado, "final": finais[produto_id]})
+
+    if modo == "atomico":
+        # Um evento por decremento, por reserva criada e por reserva cancelada
+        esperados = (contagens["decrementos_aceites"] + contagens["reservas_confirmadas"]
+                     + 2 * contagens["reservas_canceladas"])
+        gravados = eventos.count_documents({"tipo": "stock_alterado"})
+        if gravados != esperados:
+            violacoes.append({"id": "outbox", "esperado": esperados, "final": gravados})
+
+    latencias.sort()
+    print(f"[*] modo={modo} threads={threads} produtos={produtos} operações={threads * operacoes} "
+          f"em {decorrido:.2f}s ({threads * operacoes / decorrido:.0f} ops/s)")
+    print(f"    p50={latencias[len(latencias) // 2] * 1000:.2f} ms "
+          f"p99={latencias[int(len(latencias) * 0.99) - 1] * 1000:.2f} ms")
+    for chave in ("decrementos_aceites", "decrementos_recusados", "reservas_confirmadas",
+                  "reservas_canceladas", "reservas_recusadas"):
+        print(f"    {chave}: {contagens[chave]}")
+    for v in violacoes:
+        print(f"    [!] {v['id']}: esperado {v['esperado']}, final {v['final']}")
+    return violacoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modo", choices=["atomico", "rmw"], default="atomico")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--produtos", type=int, default=4, help="número de produtos disputados")
+    parser.add_argument("--stock", type=int, default=2000, help="stock inicial de cada produto")
+    parser.add_argument("--operacoes", type=int, default=500, help="operações por thread")
+    parser.add_argument("--mongo-url", help="mongod existente (as coleções são substituídas)")
+    parser.add_argument("--mongod", default="mongod", help="binário mongod a arrancar")
+    parser.add_argument("--dbpath-base", help="diretório para o dbpath temporário (ex.: /dev/shm)")
+    parser.add_argument("--replica-set", action="store_true",
+                        help="replica set local de três membros (o outbox passa a usar transações)")
+    args = parser.parse_args()
+
+    mongo = None
+    if not args.mongo_url:
+        mongo = arrancar_mongo(args.mongod, args.dbpath_base, args.replica_set)
+        args.mongo_url = mongo.url
+    try:
+        db = MongoClient(args.mongo_url, maxPoolSize=args.threads)["catalogo"]
+        violacoes = correr(db["produtos"], db["reservas"], args.modo, args.threads,
+                           args.produtos, args.stock, args.operacoes)
+    finally:
+        if mongo:
+            mongo.parar()
+
+    if violacoes:
+        print(f"[!] {len(violacoes)} produto(s) com atualizações perdidas")
+        sys.exit(1)
+    print("[*] Nenhuma atualização perdida")
+
+
+if __name__ == "__main__":
+    main()
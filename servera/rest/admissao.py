@@ -0,0 +1,290 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# Cópia partilhada com serverb/soap/admissao.py, serverc/grpc/admissao.py e
+# serverc/graphql/admissao.py (cada serviço tem o seu contexto Docker)
+
+# Acima deste número de utilizadores, os baldes já cheios (inativos) são descartados
+BALDES_MAXIMOS = 10000
+# Peso da última duração na média móvel de cada operação
+PESO_DURACAO = 0.2
+
+
+class Recusado(Exception):
+    """Pedido não admitido; `motivo` é limite (taxa do utilizador) ou sobrecarga (fila da operação)."""
+
+    def __init__(self, motivo, mensagem, repetir_apos):
+        super().__init__(mensagem)
+        self.motivo = motivo
+        self.mensagem = mensagem
+        self.repetir_apos = repetir_apos
+
+    @property
+    def segundos(self):
+        # Para o header Retry-After, que só aceita segundos inteiros
+        return max(1, math.ceil(self.repetir_apos))
+
+
+class Balde:
+    __slots__ = ("tokens", "atualizado_em")
+
+    def __init__(self, tokens, atualizado_em):
+        self.tokens = tokens
+        self.atualizado_em = atualizado_em
+
+
+class Fila:
+    """Vagas de uma operação e pedidos à espera delas, por ordem de chegada."""
+
+    def __init__(self, limite):
+        self.limite = limite
+        self.ativos = 0
+        self.espera = deque()
+        self.duracao_media = None
+
+    def registar(self, duracao):
+        if self.duracao_media is None:
+            self.duracao_media = duracao
+        else:
+            self.duracao_media += PESO_DURACAO * (duracao - self.duracao_media)
+
+    def espera_estimada(self):
+        # Os pedidos à frente saem `limite` de cada vez, cada leva a demorar a duração média
+        if self.duracao_media is None:
+            return 0.0
+        return (len(self.espera) + 1) * self.duracao_media / self.limite
+
+
+class Pedido:
+    __slots__ = ("acordar", "concedido")
+
+    def __init__(self, acordar):
+        self.acordar = acordar
+        self.concedido = False
+
+
+class Bilhete:
+    """Vaga ocupada por um pedido admitido; sair() liberta-a (pode ser chamado mais de uma vez)."""
+
+    def __init__(self, controlo, operacao):
+        self.controlo = controlo
+        self.operacao = operacao
+        self.entrada = time.monotonic()
+        self.saiu = False
+
+    def sair(self):
+        if not self.saiu:
+            self.saiu = True
+            self.controlo._sair(self.operacao, time.monotonic() - self.entrada)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.sair()
+
+
+class ControloAdmissao:
+    """Limites por utilizador e por operação, aplicados antes de tocar no MongoDB.
+
+    Cada utilizador (preferred_username do JWT) tem um balde de tokens com
+    `taxa` tokens/s e capacidade `rajada`; cada operação custa `custos[op]`
+    tokens (1 por omissão), pelo que as operações sobre o catálogo inteiro
+    esgotam o balde mais depressa. Cada operação tem ainda um limite de
+    pedidos em simultâneo; quem chega com as vagas ocupadas espera por ordem,
+    mas se a espera estimada (ou real) passar `espera_maxima` o pedido é
+    recusado logo, em vez de acumular latência para todos.
+
+    entrar() serve servidores com threads (ou green threads do eventlet) e
+    entrar_async() o event loop do GraphQL; um servidor usa só um dos dois.
+    """
+
+    def __init__(self, taxa, rajada, custos=None, concorrencia=None, concorrencia_padrao=32,
+                 espera_maxima=0.5, ativo=True):
+        self.taxa = taxa
+        self.rajada = rajada
+        self.custos = custos or {}
+        self.concorrencia = concorrencia or {}
+        self.concorrencia_padrao = concorrencia_padrao
+        self.espera_maxima = espera_maxima
+        self.ativo = ativo
+        self.baldes = {}
+        self.filas = {}
+        self.lock = threading.Lock()
+        self.contagens = {"admitidos": 0, "limite": 0, "sobrecarga": 0}
+
+    @classmethod
+    def do_ambiente(cls, pesadas=()):
+        """Configuração pelas variáveis ADMISSAO_*; `pesadas` são as operações sobre o catálogo inteiro."""
+        custo_pesado = float(os.getenv("ADMISSAO_CUSTO_PESADO", "20"))
+        concorrencia_pesada = int(os.getenv("ADMISSAO_CONCORRENCIA_PESADA", "4"))
+        return cls(
+            taxa=float(os.getenv("ADMISSAO_TAXA", "20")),
+            rajada=float(os.getenv("ADMISSAO_RAJADA", "60")),
+            custos={operacao: custo_pesado for operacao in pesadas},
+            concorrencia={operacao: concorrencia_pesada for operacao in pesadas},
+            concorrencia_padrao=int(os.getenv("ADMISSAO_CONCORRENCIA", "32")),
+            espera_maxima=float(os.getenv("ADMISSAO_ESPERA_MAXIMA", "0.5")),
+            ativo=os.getenv("ADMISSAO", "1") == "1"
+        )
+
+    # === Balde de tokens por utilizador ===
+    def _custo(self, operacao):
+        # Um custo acima da rajada nunca seria admitido
+        return min(self.custos.get(operacao, 1), self.rajada)
+
+    def _cobrar(self, utilizador, custo, agora):
+        if self.taxa <= 0:
+            return
+        balde = self.baldes.get(utilizador)
+        if balde is None:
+            if len(self.baldes) >= BALDES_MAXIMOS:
+                self._descartar_inativos(agora)
+            balde = self.baldes[utilizador] = Balde(self.rajada, agora)
+        tokens = min(self.rajada, balde.tokens + (agora - balde.atualizado_em) * self.taxa)
+        balde.atualizado_em = agora
+        if tokens < custo:
+            balde.tokens = tokens
+            self.contagens["limite"] += 1
+            raise Recusado(
+                "limite",
+                f"Limite de pedidos excedido para o utilizador {utilizador}",
+                (custo - tokens) / self.taxa
+            )
+        balde.tokens = tokens - custo
+
+    def _devolver(self, utilizador, custo):
+        balde = self.baldes.get(utilizador)
+        if balde is not None:
+            balde.tokens = min(self.rajada, balde.tokens + custo)
+
+    def _descartar_inativos(self, agora):
+        cheio = self.rajada / self.taxa
+        for utilizador in [u for u, b in self.baldes.items() if agora - b.atualizado_em >= cheio]:
+            del self.baldes[utilizador]
+
+    # === Vagas por operação ===
+    def _fila(self, operacao):
+        fila = self.filas.get(operacao)
+        if fila is None:
+            fila = self.filas[operacao] = Fila(self.concorrencia.get(operacao, self.concorrencia_padrao))
+        return fila
+
+    def _sobrecarga(self, operacao, fila):
+        self.contagens["sobrecarga"] += 1
+        return Recusado(
+            "sobrecarga",
+            f"Servidor sobrecarregado em {operacao}, tente mais tarde",
+            max(fila.espera_estimada(), self.espera_maxima)
+        )
+
+    def _pedir(self, utilizador, operacao, acordar):
+        """Cobra e ocupa uma vaga; devolve None se entrou já ou o Pedido que ficou na fila."""
+        with self.lock:
+            self._cobrar(utilizador, self._custo(operacao), time.monotonic())
+            fila = self._fila(operacao)
+            if fila.ativos < fila.limite and not fila.espera:
+                fila.ativos += 1
+                self.contagens["admitidos"] += 1
+                return None
+            if fila.espera_estimada() > self.espera_maxima:
+                # Cortar já: o pedido não seria servido a tempo
+                self._devolver(utilizador, self._custo(operacao))
+                raise self._sobrecarga(operacao, fila)
+            pedido = Pedido(acordar)
+            fila.espera.append(pedido)
+            return pedido
+
+    def _desistir(self, utilizador, operacao, pedido):
+        """Retira um pedido da fila; devolve True se a vaga lhe foi entregue entretanto."""
+        with self.lock:
+            if pedido.concedido:
+                return True
+            self.filas[operacao].espera.remove(pedido)
+            self._devolver(utilizador, self._custo(operacao))
+            return False
+
+    def _sair(self, operacao, duracao):
+        with self.lock:
+            fila = self.filas[operacao]
+            fila.registar(duracao)
+            if fila.espera:
+                # A vaga passa diretamente ao primeiro da fila
+                pedido = fila.espera.popleft()
+                pedido.concedido = True
+                self.contagens["admitidos"] += 1
+                pedido.acordar()
+            else:
+                fila.ativos -= 1
+
+    def entrar(self, utilizador, operacao):
+        """Admite o pedido (esperando por vaga até `espera_maxima`) ou levanta Recusado."""
+        if not self.ativo:
+            return BILHETE_NULO
+        evento = threading.Event()
+        pedido = self._pedir(utilizador, operacao, evento.set)
+        if pedido is not None and not evento.wait(self.espera_maxima):
+            if not self._desistir(utilizador, operacao, pedido):
+                with self.lock:
+                    raise self._sobrecarga(operacao, self.filas[operacao])
+        return Bilhete(self, operacao)
+
+    async def entrar_async(self, utilizador, operacao):
+        if not self.ativo:
+            return BILHETE_NULO
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        pedido = self._pedir(utilizador, operacao, lambda: loop.call_soon_threadsafe(_concluir, futuro))
+        if pedido is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(futuro), self.espera_maxima)
+            except asyncio.TimeoutError:
+                if not self._desistir(utilizador, operacao, pedido):
+                    with self.lock:
+                        raise self._sobrecarga(operacao, self.filas[operacao])
+            except asyncio.CancelledError:
+                # Cliente desligou-se: não deixar a vaga presa se já tinha sido entregue
+                if self._desistir(utilizador, operacao, pedido):
+                    Bilhete(self, operacao).sair()
+                raise
+        return Bilhete(self, operacao)
+
+    def estatisticas(self):
+        with self.lock:
+            return {
+                **self.contagens,
+                "utilizadores": len(self.baldes),
+                "operacoes": {
+                    operacao: {
+                        "ativos": fila.ativos,
+                        "em_espera": len(fila.espera),
+                        "limite": fila.limite,
+                        "duracao_media_ms": round(fila.duracao_media * 1000, 2) if fila.duracao_media is not None else None
+                    }
+                    for operacao, fila in self.filas.items()
+                }
+            }
+
+
+def _concluir(futuro):
+    if not futuro.done():
+        futuro.set_result(None)
+
+
+class _BilheteNulo:
+    def sair(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+# Com o controlo desligado (ADMISSAO=0, ex.: nos benchmarks) todos os pedidos entram
+BILHETE_NULO = _BilheteNulo()
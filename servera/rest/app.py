@@ -1,14 +1,15 @@
 import eventlet
 eventlet.monkey_patch()
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
 from flask_socketio import SocketIO
-from pymongo import MongoClient
-from bson.json_util import dumps
+from pymongo import ReturnDocument, UpdateOne, DeleteOne
 from jsonschema import validate, ValidationError
 from jsonpath_ng.ext import parse
 import os
 import json
+import time
+from collections import Counter
 from functools import wraps
 from jose import jwt
 from jose.exceptions import JWTError
@@ -16,24 +17,134 @@ import requests
 from jose.utils import base64url_decode
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
+from werkzeug.exceptions import BadRequest
+from pymongo.errors import PyMongoError, BulkWriteError, OperationFailure
+from codificadores import negociar, codificar, descodificar
+from cache_respostas import CacheRespostas
+from stock import GestorStock, ErroStock, reserva_publica
+from pesquisa import (Vocabulario, ESPEC_INDICE, OPCOES_INDICE, PROJECAO_RELEVANCIA, ORDEM_RELEVANCIA,
+                      contar_termos, consulta_texto, termos_pesquisa)
+from colunar import MotorColunar, filtro_mongo, traduzir_jsonpath
+from admissao import ControloAdmissao, Recusado
+from rastreio import Rastreador
+from ligacao import LigacaoMongo
+from outbox import Outbox, Relay, Seguidor, Destino, DestinoRabbitMQ, evento, eventos_lote, em_partes
+from versoes import VersaoExpirada, LIMITE_ALTERACOES, primeira_versao, nova_versao
+from estatisticas import (COLECAO_ESTATISTICAS, EstadoEstatisticas, Agregador, pipeline_estatisticas,
+                          filtro_obsoletas, totais, linha_publica)
 
 # === Configuração da aplicação ===
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*")  # Habilitar CORS para WebSocket
 
+# === Rastreio de pedidos (RASTREIO_FICHEIRO ou RASTREIO_OTLP_URL) ===
+rastreador = Rastreador.do_ambiente("rest")
+# Spans para a validação e a serialização, só em pedidos amostrados
+validate = rastreador.rastrear("validar_schema")(validate)
+codificar = rastreador.rastrear("serializar")(codificar)
+
 # === Conexão com MongoDB ===
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-client = MongoClient(MONGO_URL)
-db = client["catalogo"]
+ligacao = LigacaoMongo.do_ambiente(rastreador, "mongodb://localhost:27017")
+client = ligacao.client
+db = ligacao.db
 colecao = db["produtos"]
+# Listagens, exportação, /consulta e pesquisa: podem ir aos secundários
+colecao_leituras = ligacao.leituras(colecao)
+
+# === Eventos de alteração (outbox gravado na mesma transação que a escrita) ===
+outbox = Outbox.do_ambiente(db, "rest", rastreador)
+
+
+class DestinoSocketIO(Destino):
+    """Clientes Socket.IO ligados a este processo; recebem as escritas dos quatro servidores."""
+
+    nome = "socketio"
+
+    def publicar(self, documento):
+        socketio.emit(documento["tipo"], documento["dados"])
+
+
+# Cada processo segue o outbox para os seus clientes; acordado a cada escrita local (sem change stream)
+seguidor_socketio = Seguidor.do_ambiente(db, DestinoSocketIO(), rastreador)
+outbox.ouvintes.append(seguidor_socketio.acordar)
+
+# RabbitMQ: o mesmo relay corre nos quatro servidores, só o que tem o arrendamento publica
+relay_rabbitmq = Relay.do_ambiente(db, DestinoRabbitMQ.do_ambiente(rastreador), rastreador)
+outbox.ouvintes.append(relay_rabbitmq.acordar)
+
+# === Sincronização incremental (versão global gravada em cada escrita) ===
+versoes = outbox.versoes
+
+# === Pesquisa de texto e autocompletar ===
+vocabulario = Vocabulario()
+INTERVALO_VOCABULARIO = float(os.getenv("REST_VOCABULARIO_INTERVALO", "300"))
+PESQUISA_LIMITE_MAXIMO = 100
+
+# === Estatísticas por marca (coleção materializada) ===
+colecao_estatisticas = db[COLECAO_ESTATISTICAS]
+estado_estatisticas = EstadoEstatisticas(float(os.getenv("ESTATISTICAS_IDADE_MAXIMA", "60")))
+# Só um processo (REST ou GraphQL) agrega de cada vez
+agregador = Agregador.do_ambiente(db, estado_estatisticas)
+INTERVALO_ESTATISTICAS = float(os.getenv("ESTATISTICAS_INTERVALO", "2"))
+LIMIAR_STOCK_BAIXO = int(os.getenv("ESTATISTICAS_STOCK_BAIXO", "5"))
+
+# === Motor colunar em memória (opcional, precisa do NumPy) ===
+motor_colunar = None
+if os.getenv("REST_MOTOR_COLUNAR", "0") == "1":
+    try:
+        motor_colunar = MotorColunar()
+    except RuntimeError as e:
+        print(f"[Colunar] Desligado: {e}")
+# Sem change stream, recarregar periodicamente para apanhar escritas de outros servidores
+INTERVALO_COLUNAR = float(os.getenv("REST_COLUNAR_RECARREGAR", "60"))
+colunar_por_recarregar = False
+LOTE_IDS = 10000
+
+# === Stock e reservas ===
+gestor_stock = GestorStock(colecao, db["reservas"], outbox)
+RESERVA_TTL = int(os.getenv("RESERVA_TTL", "900"))
+RESERVA_TTL_MAXIMO = int(os.getenv("RESERVA_TTL_MAXIMO", "86400"))
+INTERVALO_EXPIRACAO = float(os.getenv("RESERVA_INTERVALO_EXPIRACAO", "5"))
+
+# === Cache de respostas comprimidas (/produtos, /exportar, /consulta) ===
+cache_respostas = CacheRespostas(
+    bytes_maximo=int(os.getenv("REST_CACHE_BYTES", str(64 * 2 ** 20))),
+    ttl=float(os.getenv("REST_CACHE_TTL", "5")),
+    nivel_gzip=int(os.getenv("REST_CACHE_GZIP", "6")),
+    nivel_brotli=int(os.getenv("REST_CACHE_BROTLI", "5"))
+)
+# Uma resposta lida de um secundário atrasado pode ser guardada depois da invalidação
+cache_respostas.leituras_atrasadas = ligacao.secundarios
+
+# === Controlo de admissão (taxa por utilizador e vagas por rota) ===
+# Rotas que leem ou escrevem o catálogo inteiro custam mais e têm menos vagas
+admissao = ControloAdmissao.do_ambiente(
+    pesadas=("listar_produtos", "exportar_json", "consulta_jsonpath", "importar_json", "lote_produtos")
+)
 
 # === Carregamento do schema JSON ===
 with open("schema.json") as f:
     schema = json.load(f)
 
+# PATCH e atualizações em lote: os mesmos tipos, mas nenhum campo obrigatório. Só os campos do
+# schema: os outros (_id, versao, ...) são do servidor, e as características viram caminhos com ponto
+schema_parcial = {
+    **schema,
+    "required": [],
+    "minProperties": 1,
+    "additionalProperties": False,
+    "properties": {
+        **schema["properties"],
+        "caracteristicas": {**schema["properties"]["caracteristicas"], "propertyNames": {"pattern": r"^[^.$]+$"}}
+    }
+}
+
+BATCH_MAXIMO = int(os.getenv("REST_BATCH_MAXIMO", "10000"))
+CHAVE_DUPLICADA = 11000  # DuplicateKey num writeError
+
 # === Configurações do Keycloak ===
 KEYCLOAK_REALM = "catalogo-produtos"
-KEYCLOAK_URL = "http://192.168.2.122:8080"
+KEYCLOAK_URL = os.getenv("KEYCLOAK_URL", "http://192.168.2.122:8080")
 KEYCLOAK_ISSUER = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}"
 JWKS_URL = f"{KEYCLOAK_ISSUER}/protocol/openid-connect/certs"
 jwks = requests.get(JWKS_URL).json()
@@ -47,6 +158,7 @@ def jwk_to_rsa_key(jwk):
     )
     return public_numbers.public_key(backend=default_backend())
 
+@rastreador.rastrear("validar_token")
 def validar_token(token):
     try:
         header = jwt.get_unverified_header(token)
@@ -67,6 +179,35 @@ def validar_token(token):
         return None
 
 
+# === Um span por pedido, filho do traceparent recebido ===
+@app.before_request
+def iniciar_rastreio():
+    rota = request.url_rule.rule if request.url_rule else request.path
+    g.rastreio = rastreador.pedido(
+        f"{request.method} {rota}",
+        request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.route": rota}
+    )
+    g.rastreio.__enter__()
+
+
+@app.after_request
+def registar_estado(resposta):
+    span = rastreador.atual()
+    if span is not None:
+        span.definir("http.status_code", resposta.status_code)
+        if resposta.status_code >= 500:
+            span.falhar(resposta.status)
+    return resposta
+
+
+@app.teardown_request
+def terminar_rastreio(erro):
+    rastreio = g.pop("rastreio", None)
+    if rastreio is not None:
+        rastreio.__exit__(type(erro) if erro else None, erro, None)
+
+
 def login_obrigatorio(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -78,16 +219,207 @@ def login_obrigatorio(f):
         if not payload:
             return jsonify({"erro": "Token inválido ou expirado"}), 401
         request.user = payload
-        return f(*args, **kwargs)
+        utilizador = payload.get("preferred_username", "desconhecido")
+        try:
+            with rastreador.span("admissao", **{"enduser.id": utilizador}):
+                bilhete = admissao.entrar(utilizador, f.__name__)
+        except Recusado as e:
+            return recusar(e)
+        with bilhete:
+            return f(*args, **kwargs)
     return decorated
 
+
+def utilizador_atual():
+    return request.user.get("preferred_username", "desconhecido")
+
+
+def recusar(e):
+    # 429 quando é o utilizador que excede a sua taxa, 503 quando é o servidor que está cheio
+    resposta = jsonify({"erro": e.mensagem, "motivo": e.motivo, "repetir_apos": round(e.repetir_apos, 3)})
+    resposta.status_code = 429 if e.motivo == "limite" else 503
+    resposta.headers["Retry-After"] = str(e.segundos)
+    return resposta
+
+# === Codificação das respostas (JSON, MessagePack, CBOR) ===
+def responder(dados, status=200):
+    mimetype = negociar(request.accept_mimetypes)
+    resposta = Response(codificar(dados, mimetype), status=status, mimetype=mimetype)
+    resposta.vary.add("Accept")
+    return resposta
+
+
+def responder_cacheado(chave, produzir):
+    """Como responder(), mas serve o corpo (e a variante comprimida) a partir da cache."""
+    mimetype = negociar(request.accept_mimetypes)
+    encoding = request.accept_encodings.best_match(cache_respostas.encodings) or "identity"
+    corpo, encoding = cache_respostas.obter(
+        (chave, mimetype),
+        lambda: codificar(produzir(), mimetype),
+        encoding
+    )
+    resposta = Response(corpo, mimetype=mimetype)
+    if encoding != "identity":
+        resposta.headers["Content-Encoding"] = encoding
+    resposta.vary.add("Accept")
+    resposta.vary.add("Accept-Encoding")
+    return resposta
+
+
+def apos_escrita(criados=(), editados=(), removidos=()):
+    """Invalida a cache e aplica os produtos escritos ao motor colunar e os criados ao vocabulário."""
+    cache_respostas.invalidar()
+    estado_estatisticas.marcar()
+    # Com o change stream ativo as escritas chegam por lá
+    if cache_respostas.change_stream_ativo:
+        return
+    for produto in criados:
+        vocabulario.adicionar(produto)
+    if motor_colunar is not None:
+        for produto in [*criados, *editados]:
+            motor_colunar.atualizar(produto)
+    if motor_colunar is not None:
+        for produto_id in removidos:
+            motor_colunar.remover(produto_id)
+
+
+# === Filtros numéricos (motor colunar ou MongoDB) ===
+PARAMETROS_FILTRO = {
+    "preco_min": ("preco", ">=", float),
+    "preco_max": ("preco", "<=", float),
+    "stock_min": ("stock", ">=", int),
+    "stock_max": ("stock", "<=", int),
+}
+PARAMETROS_CONSULTA = set(PARAMETROS_FILTRO) | {"marca", "ordenar_por", "ordem", "limite"}
+
+
+def ler_filtros():
+    """Lê os filtros, a ordenação e o limite da query string."""
+    filtros = []
+    for parametro, (campo, operador, tipo) in PARAMETROS_FILTRO.items():
+        if parametro in request.args:
+            try:
+                filtros.append((campo, operador, tipo(request.args[parametro])))
+            except ValueError:
+                raise BadRequest(f"Parâmetro '{parametro}' inválido")
+    marcas = request.args.getlist("marca")
+    if marcas:
+        filtros.append(("marca", "in", marcas))
+
+    ordenar_por = request.args.get("ordenar_por")
+    if ordenar_por not in (None, "id", "preco", "stock"):
+        raise BadRequest("'ordenar_por' tem de ser id, preco ou stock")
+    ordem = -1 if request.args.get("ordem", "asc") == "desc" else 1
+    limite = request.args.get("limite")
+    if limite is not None:
+        if not limite.isdigit() or int(limite) == 0:
+            raise BadRequest("'limite' tem de ser um inteiro positivo")
+        limite = int(limite)
+    return filtros, ordenar_por, ordem, limite
+
+
+def motor_disponivel():
+    return motor_colunar is not None and motor_colunar.carregado
+
+
+def produtos_por_ids(ids):
+    # Os documentos vêm do MongoDB em lotes, pela ordem dada pelo motor. Do primário,
+    # como o motor: um secundário atrasado podia não ter (ou ter antigo) um id que ele já tem
+    produtos = []
+    for inicio in range(0, len(ids), LOTE_IDS):
+        lote = ids[inicio:inicio + LOTE_IDS]
+        por_id = {p["id"]: p for p in colecao.find({"id": {"$in": lote}}, {"_id": 0})}
+        produtos.extend(por_id[produto_id] for produto_id in lote if produto_id in por_id)
+    return produtos
+
+
+def consultar_produtos(filtros, ordenar_por=None, ordem=1, limite=None):
+    if motor_disponivel():
+        return produtos_por_ids(motor_colunar.consultar(filtros, ordenar_por, ordem, limite))
+    cursor = colecao_leituras.find(filtro_mongo(filtros), {"_id": 0})
+    if ordenar_por:
+        cursor = cursor.sort([(ordenar_por, ordem), ("id", ordem)])
+    if limite:
+        cursor = cursor.limit(limite)
+    return list(cursor)
+
+
+def ler_corpo():
+    try:
+        dados = descodificar(request.get_data(), request.mimetype)
+    except ValueError:
+        raise BadRequest("Corpo do pedido inválido")
+    if dados is None:
+        return request.get_json()
+    return dados
+
+# === Atualizações parciais ===
+def campos_parciais(dados, produto_id):
+    """Valida um documento parcial e devolve o $set correspondente (ou levanta ValidationError)."""
+    validate(dados, schema_parcial)
+    if "id" in dados and dados["id"] != produto_id:
+        raise ValidationError("O campo 'id' não pode ser alterado")
+    campos = {k: v for k, v in dados.items() if k not in ("id", "caracteristicas")}
+    # Subcampos com notação de ponto, para não apagar as características omitidas
+    for k, v in dados.get("caracteristicas", {}).items():
+        campos[f"caracteristicas.{k}"] = v
+    if not campos:
+        raise ValidationError("Nenhum campo para atualizar")
+    return campos
+
 # === Rotas REST ===
 
 @app.route("/produtos", methods=["GET"])
 @login_obrigatorio
 def listar_produtos():
-    produtos = list(colecao.find({}, {"_id": 0}))
-    return Response(dumps(produtos), mimetype="application/json")
+    """Catálogo completo, ou filtrado com preco_min/max, stock_min/max, marca, ordenar_por, ordem e limite."""
+    if not PARAMETROS_CONSULTA.intersection(request.args):
+        return responder_cacheado("catalogo", lambda: list(colecao_leituras.find({}, {"_id": 0})))
+    filtros, ordenar_por, ordem, limite = ler_filtros()
+    chave = ("produtos", tuple(sorted(request.args.items(multi=True))))
+    return responder_cacheado(chave, lambda: consultar_produtos(filtros, ordenar_por, ordem, limite))
+
+
+@app.route("/produtos/histograma", methods=["GET"])
+@login_obrigatorio
+def histograma_produtos():
+    """?campo=preco|stock&intervalos=10, com os mesmos filtros de /produtos."""
+    if not motor_disponivel():
+        return jsonify({"erro": "Histogramas precisam do motor colunar (REST_MOTOR_COLUNAR=1)"}), 501
+    campo = request.args.get("campo", "preco")
+    if campo not in ("preco", "stock"):
+        return jsonify({"erro": "'campo' tem de ser preco ou stock"}), 400
+    intervalos = request.args.get("intervalos", "10")
+    if not intervalos.isdigit() or not 0 < int(intervalos) <= 1000:
+        return jsonify({"erro": "'intervalos' tem de estar entre 1 e 1000"}), 400
+    filtros, _, _, _ = ler_filtros()
+    return responder(motor_colunar.histograma(campo, int(intervalos), filtros))
+
+
+@app.route("/produtos/alteracoes", methods=["GET"])
+@login_obrigatorio
+def alteracoes_produtos():
+    """Produtos alterados e ids removidos desde a versão ?desde= (0 ou ausente: o catálogo inteiro), até ?limite=.
+
+    O cliente substitui os produtos devolvidos, apaga os removidos e guarda
+    `proximo` para o pedido seguinte; com `mais` verdadeiro há mais já.
+    """
+    try:
+        desde = int(request.args.get("desde", "0"))
+    except ValueError:
+        desde = -1
+    if desde < 0:
+        return jsonify({"erro": "'desde' tem de ser uma versão devolvida em 'proximo'"}), 400
+    try:
+        limite = int(request.args.get("limite", "1000"))
+    except ValueError:
+        limite = 0
+    if not 0 < limite <= LIMITE_ALTERACOES:
+        return jsonify({"erro": f"'limite' tem de estar entre 1 e {LIMITE_ALTERACOES}"}), 400
+    try:
+        return responder(versoes.alteracoes(desde, limite))
+    except VersaoExpirada as e:
+        return jsonify({"erro": "Versão expirada", "detalhes": str(e)}), 410
 
 
 @app.route("/produtos/<int:produto_id>", methods=["GET"])
@@ -95,14 +427,14 @@ def listar_produtos():
 def obter_produto(produto_id):
     produto = colecao.find_one({"id": produto_id}, {"_id": 0})
     if produto:
-        return Response(dumps(produto), mimetype="application/json")
+        return responder(produto)
     return jsonify({"erro": "Produto não encontrado"}), 404
 
 
 @app.route("/produtos", methods=["POST"])
 @login_obrigatorio
 def adicionar_produto():
-    produto = request.get_json()
+    produto = ler_corpo()
     try:
         validate(produto, schema)
     except ValidationError as e:
@@ -111,51 +443,360 @@ def adicionar_produto():
     if colecao.find_one({"id": produto["id"]}):
         return jsonify({"erro": "Produto com este ID já existe"}), 400
 
-    colecao.insert_one(produto)
-    produto_limpo = {k: v for k, v in produto.items() if k != "_id"}
-    socketio.emit("novo_produto", produto_limpo)
+    def escrever(sessao, versao):
+        # primeira_versao() devolve uma cópia: o _id que o insert_one acrescenta não fica em `produto`
+        colecao.insert_one(primeira_versao(produto, versao), session=sessao)
+        return None, [evento("novo_produto", [produto["id"]], produto, utilizador_atual())]
+
+    outbox.gravar(escrever)
+    apos_escrita(criados=[produto])
     return jsonify({"mensagem": "Produto adicionado"}), 201
 
 
 @app.route("/produtos/<int:produto_id>", methods=["PUT"])
 @login_obrigatorio
 def atualizar_produto(produto_id):
-    novos_dados = request.get_json()
+    novos_dados = ler_corpo()
     try:
         validate(novos_dados, schema)
     except ValidationError as e:
         return jsonify({"erro": "Dados inválidos", "detalhes": e.message}), 400
 
-    resultado = colecao.update_one({"id": produto_id}, {"$set": novos_dados})
-    if resultado.matched_count == 0:
+    def escrever(sessao, versao):
+        resultado = colecao.update_one({"id": produto_id}, nova_versao({"$set": novos_dados}, versao), session=sessao)
+        if resultado.matched_count == 0:
+            return False, []
+        return True, [evento("produto_editado", [produto_id], novos_dados, utilizador_atual())]
+
+    if not outbox.gravar(escrever):
         return jsonify({"erro": "Produto não encontrado"}), 404
 
-    socketio.emit("produto_editado", novos_dados)
+    apos_escrita(editados=[{**novos_dados, "id": produto_id}])
     return jsonify({"mensagem": "Produto atualizado"})
 
 
+@app.route("/produtos/<int:produto_id>", methods=["PATCH"])
+@login_obrigatorio
+def atualizar_parcial(produto_id):
+    dados = ler_corpo()
+    try:
+        campos = campos_parciais(dados, produto_id)
+    except ValidationError as e:
+        return jsonify({"erro": "Dados inválidos", "detalhes": e.message}), 400
+
+    def escrever(sessao, versao):
+        produto = colecao.find_one_and_update(
+            {"id": produto_id},
+            nova_versao({"$set": campos}, versao),
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=sessao
+        )
+        if produto is None:
+            return None, []
+        return produto, [evento("produto_editado", [produto_id], produto, utilizador_atual())]
+
+    produto = outbox.gravar(escrever)
+    if produto is None:
+        return jsonify({"erro": "Produto não encontrado"}), 404
+
+    apos_escrita(editados=[produto])
+    return responder(produto)
+
+
 @app.route("/produtos/<int:produto_id>", methods=["DELETE"])
 @login_obrigatorio
 def remover_produto(produto_id):
-    resultado = colecao.delete_one({"id": produto_id})
-    if resultado.deleted_count == 0:
+    def escrever(sessao, versao):
+        resultado = colecao.delete_one({"id": produto_id}, session=sessao)
+        if resultado.deleted_count == 0:
+            return False, []
+        return True, [evento("produto_removido", [produto_id], {"id": produto_id}, utilizador_atual(), [produto_id])]
+
+    if not outbox.gravar(escrever):
         return jsonify({"erro": "Produto não encontrado"}), 404
 
-    socketio.emit("produto_removido", {"id": produto_id})
+    apos_escrita(removidos=[produto_id])
     return jsonify({"mensagem": "Produto removido"})
 
 
+def operacao_lote(op, produto_id, valor, versao):
+    """Operação pymongo de /produtos/batch, com a versão da escrita."""
+    if op == "criar":
+        return UpdateOne({"id": produto_id}, {"$setOnInsert": primeira_versao(valor, versao)}, upsert=True)
+    if op == "atualizar":
+        return UpdateOne({"id": produto_id}, nova_versao({"$set": valor}, versao))
+    return DeleteOne({"id": produto_id})
+
+
+@app.route("/produtos/batch", methods=["POST"])
+@login_obrigatorio
+def lote_produtos():
+    """Operações mistas num só bulk_write não ordenado.
+
+    Corpo: {"operacoes": [{"op": "criar", "produto": {...}},
+                          {"op": "atualizar", "id": 1, "campos": {...}},
+                          {"op": "remover", "id": 2}]}
+    """
+    corpo = ler_corpo()
+    pedidas = corpo.get("operacoes") if isinstance(corpo, dict) else None
+    if not isinstance(pedidas, list) or not pedidas:
+        return jsonify({"erro": "Campo 'operacoes' obrigatório"}), 400
+    if len(pedidas) > BATCH_MAXIMO:
+        return jsonify({"erro": f"Máximo de {BATCH_MAXIMO} operações por pedido"}), 413
+
+    resultados = [None] * len(pedidas)
+    validas = []  # (posição, op, id, produto ou campos a escrever, dados para a notificação)
+    vistos = set()
+
+    def falhar(posicao, op, produto_id, mensagem):
+        resultados[posicao] = {"op": op, "id": produto_id, "ok": False, "mensagem": mensagem}
+
+    for posicao, pedida in enumerate(pedidas):
+        op = pedida.get("op") if isinstance(pedida, dict) else None
+        produto_id = pedida.get("id") if isinstance(pedida, dict) else None
+        try:
+            if op == "criar":
+                produto = pedida.get("produto")
+                if isinstance(produto, dict):
+                    produto_id = produto.get("id")
+                validate(produto, schema)
+                valor = produto
+                dados = produto
+            elif op == "atualizar":
+                if not e_id(produto_id):
+                    raise ValidationError("Campo 'id' obrigatório")
+                campos = campos_parciais(pedida.get("campos") or {}, produto_id)
+                valor = campos
+                dados = {"id": produto_id, **pedida["campos"]}
+            elif op == "remover":
+                if not e_id(produto_id):
+                    raise ValidationError("Campo 'id' obrigatório")
+                valor = None
+                dados = {"id": produto_id}
+            else:
+                falhar(posicao, op, produto_id, "Operação desconhecida (criar, atualizar ou remover)")
+                continue
+        except ValidationError as e:
+            falhar(posicao, op, produto_id, f"Dados inválidos: {e.message}")
+            continue
+        # Sem ordem garantida, duas operações sobre o mesmo id dariam resultados imprevisíveis
+        if produto_id in vistos:
+            falhar(posicao, op, produto_id, "ID repetido no lote")
+            continue
+        vistos.add(produto_id)
+        validas.append((posicao, op, produto_id, valor, dados))
+
+    # Uma leitura só para saber que ids existem: o bulk_write não dá resultados por operação
+    existentes = {p["id"] for p in colecao.find({"id": {"$in": list(vistos)}}, {"_id": 0, "id": 1})}
+    a_escrever = []
+    for posicao, op, produto_id, valor, dados in validas:
+        if op == "criar" and produto_id in existentes:
+            falhar(posicao, op, produto_id, "Produto com este ID já existe")
+        elif op != "criar" and produto_id not in existentes:
+            falhar(posicao, op, produto_id, "Produto não encontrado")
+        else:
+            a_escrever.append((posicao, op, produto_id, valor, dados))
+
+    # Operações com erro de escrita numa transação anulada: a seguinte já não as leva
+    rejeitadas = {}
+
+    def escrever(sessao, versao):
+        pendentes = [indice for indice in range(len(a_escrever)) if indice not in rejeitadas]
+        erros_escrita = {}
+        try:
+            resultado = colecao.bulk_write(
+                [operacao_lote(*a_escrever[indice][1:4], versao) for indice in pendentes],
+                ordered=False,
+                session=sessao
+            )
+            detalhes = resultado.bulk_api_result
+        except BulkWriteError as e:
+            detalhes = e.details
+            erros_escrita = {
+                pendentes[erro["index"]]: mensagem_escrita(erro) for erro in detalhes.get("writeErrors", [])
+            }
+            if sessao is not None:
+                rejeitadas.update(erros_escrita)
+                raise
+        inseridos = {pendentes[u["index"]] for u in detalhes.get("upserted", [])}
+        falhas = dict(rejeitadas)
+        for indice in pendentes:
+            op = a_escrever[indice][1]
+            if indice in erros_escrita:
+                falhas[indice] = erros_escrita[indice]
+            elif op == "criar" and indice not in inseridos:
+                # Criado por outro pedido entre a leitura e a escrita
+                falhas[indice] = "Produto com este ID já existe"
+        alteracoes = alteracoes_lote(a_escrever, falhas)
+        return (falhas, alteracoes), eventos_lote(alteracoes, utilizador_atual())
+
+    falhas, alteracoes = {}, alteracoes_lote([], {})
+    # Numa transação um erro de escrita anula o lote inteiro: repete-se sem as operações que falharam
+    while len(rejeitadas) < len(a_escrever):
+        antes = len(rejeitadas)
+        try:
+            falhas, alteracoes = outbox.gravar(escrever)
+            break
+        except BulkWriteError:
+            if len(rejeitadas) == antes:
+                raise
+    else:
+        falhas = dict(rejeitadas)
+
+    for indice, (posicao, op, produto_id, _, _) in enumerate(a_escrever):
+        if indice in falhas:
+            falhar(posicao, op, produto_id, falhas[indice])
+        else:
+            resultados[posicao] = {"op": op, "id": produto_id, "ok": True}
+
+    sucessos = sum(1 for r in resultados if r["ok"])
+    if sucessos:
+        apos_escrita(alteracoes["criados"], alteracoes["editados"], alteracoes["removidos"])
+    return responder({
+        "sucessos": sucessos,
+        "falhas": len(resultados) - sucessos,
+        "resultados": resultados
+    }, status=200 if sucessos == len(resultados) else 207)
+
+
+def alteracoes_lote(escritas, falhas):
+    """Produtos criados, editados e removidos pelas escritas de um lote que não falharam."""
+    alteracoes = {"criados": [], "editados": [], "removidos": []}
+    for indice, (_, op, produto_id, _, dados) in enumerate(escritas):
+        if indice in falhas:
+            continue
+        if op == "criar":
+            alteracoes["criados"].append(dados)
+        elif op == "atualizar":
+            alteracoes["editados"].append(dados)
+        else:
+            alteracoes["removidos"].append(produto_id)
+    return alteracoes
+
+
+# === Stock: ajustes atómicos e reservas ===
+ESTADO_ERRO_STOCK = {"nao_encontrado": 404, "insuficiente": 409, "reserva_invalida": 409}
+
+
+def erro_stock(e):
+    return jsonify({"erro": e.mensagem, "codigo": e.codigo, "id": e.produto_id}), ESTADO_ERRO_STOCK[e.codigo]
+
+
+def notificar_stock(alterados):
+    if alterados:
+        cache_respostas.invalidar()
+        estado_estatisticas.marcar()
+        if motor_colunar is not None and not cache_respostas.change_stream_ativo:
+            sem_stock = [a["id"] for a in alterados if "stock" not in a]
+            for produto in alterados:
+                if "stock" in produto:
+                    motor_colunar.atualizar(produto)
+            # As reservas não devolvem o stock resultante
+            for produto in colecao.find({"id": {"$in": sem_stock}}, {"_id": 0, "id": 1, "stock": 1}):
+                motor_colunar.atualizar(produto)
+
+
+def e_id(valor):
+    # bool é subclasse de int, mas não é um id nem uma quantidade
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+def ler_inteiro(dados, campo):
+    valor = dados.get(campo) if isinstance(dados, dict) else None
+    if not e_id(valor):
+        raise BadRequest(f"Campo '{campo}' tem de ser um inteiro")
+    return valor
+
+
+@app.route("/produtos/<int:produto_id>/stock", methods=["POST"])
+@login_obrigatorio
+def ajustar_stock(produto_id):
+    """Corpo: {"delta": -1}; um delta negativo só é aplicado se houver stock suficiente."""
+    delta = ler_inteiro(ler_corpo(), "delta")
+    try:
+        stock = gestor_stock.ajustar(produto_id, delta)
+    except ErroStock as e:
+        return erro_stock(e)
+    notificar_stock([{"id": produto_id, "stock": stock}])
+    return responder({"id": produto_id, "stock": stock})
+
+
+@app.route("/stock/ajustes", methods=["POST"])
+@login_obrigatorio
+def ajustar_stock_lote():
+    """Corpo: {"ajustes": [{"id": 1, "delta": 5}, ...]}; cada ajuste é independente."""
+    corpo = ler_corpo()
+    pedidos = corpo.get("ajustes") if isinstance(corpo, dict) else None
+    if not isinstance(pedidos, list) or not pedidos:
+        return jsonify({"erro": "Campo 'ajustes' obrigatório"}), 400
+    if len(pedidos) > BATCH_MAXIMO:
+        return jsonify({"erro": f"Máximo de {BATCH_MAXIMO} ajustes por pedido"}), 413
+
+    ajustes = [(ler_inteiro(a, "id"), ler_inteiro(a, "delta")) for a in pedidos]
+    resultados = gestor_stock.ajustar_lote(ajustes)
+    notificar_stock([{"id": r["id"], "stock": r["stock"]} for r in resultados if r["ok"]])
+    sucessos = sum(1 for r in resultados if r["ok"])
+    return responder({
+        "sucessos": sucessos,
+        "falhas": len(resultados) - sucessos,
+        "resultados": resultados
+    }, status=200 if sucessos == len(resultados) else 207)
+
+
+@app.route("/reservas", methods=["POST"])
+@login_obrigatorio
+def criar_reserva():
+    """Corpo: {"itens": [{"id": 1, "quantidade": 2}, ...], "ttl": 900}; tudo ou nada."""
+    corpo = ler_corpo()
+    pedidos = corpo.get("itens") if isinstance(corpo, dict) else None
+    if not isinstance(pedidos, list) or not pedidos:
+        return jsonify({"erro": "Campo 'itens' obrigatório"}), 400
+    ttl = ler_inteiro(corpo, "ttl") if "ttl" in corpo else RESERVA_TTL
+    if not 0 < ttl <= RESERVA_TTL_MAXIMO:
+        return jsonify({"erro": f"'ttl' tem de estar entre 1 e {RESERVA_TTL_MAXIMO} segundos"}), 400
+
+    itens = [(ler_inteiro(i, "id"), ler_inteiro(i, "quantidade")) for i in pedidos]
+    try:
+        reserva = gestor_stock.reservar(itens, ttl, request.user.get("preferred_username"))
+    except ErroStock as e:
+        return erro_stock(e)
+    notificar_stock([{"id": i["id"]} for i in reserva["itens"]])
+    return responder(reserva_publica(reserva), status=201)
+
+
+@app.route("/reservas/<reserva_id>/confirmar", methods=["POST"])
+@login_obrigatorio
+def confirmar_reserva(reserva_id):
+    try:
+        reserva = gestor_stock.confirmar(reserva_id, request.user.get("preferred_username"))
+    except ErroStock as e:
+        return erro_stock(e)
+    return responder(reserva_publica(reserva))
+
+
+@app.route("/reservas/<reserva_id>", methods=["DELETE"])
+@login_obrigatorio
+def cancelar_reserva(reserva_id):
+    try:
+        reserva = gestor_stock.cancelar(reserva_id, request.user.get("preferred_username"))
+    except ErroStock as e:
+        return erro_stock(e)
+    notificar_stock([{"id": i["id"]} for i in reserva["itens"]])
+    return responder(reserva_publica(reserva))
+
+
 @app.route("/exportar", methods=["GET"])
 @login_obrigatorio
 def exportar_json():
-    produtos = list(colecao.find({}, {"_id": 0}))
-    return Response(dumps(produtos), mimetype="application/json")
+    # Mesmo conteúdo de /produtos, por isso partilha a entrada da cache
+    return responder_cacheado("catalogo", lambda: list(colecao_leituras.find({}, {"_id": 0})))
 
 
 @app.route("/importar", methods=["POST"])
 @login_obrigatorio
 def importar_json():
-    novos_produtos = request.get_json()
+    novos_produtos = ler_corpo()
     for produto in novos_produtos:
         try:
             validate(produto, schema)
@@ -164,10 +805,66 @@ def importar_json():
                 "erro": f"Erro ao importar produto ID {produto.get('id')}",
                 "detalhes": e.message
             }), 400
-    colecao.insert_many(novos_produtos)
+    contagem = Counter(produto["id"] for produto in novos_produtos)
+    repetidos = sorted(produto_id for produto_id, n in contagem.items() if n > 1)
+    if repetidos:
+        return jsonify({"erro": "IDs repetidos na importação", "ids": repetidos}), 400
+
+    # Uma transação (e um evento) por cada PRODUTOS_POR_EVENTO produtos: um catálogo
+    # inteiro numa só transação passaria os limites de tamanho e de duração
+    importados, falhas = [], {}
+    for parte in em_partes(novos_produtos):
+        # IDs com erro de escrita numa transação anulada: a seguinte já não os leva
+        rejeitados = {}
+
+        def escrever(sessao, versao, parte=parte, rejeitados=rejeitados):
+            pendentes = [p for p in parte if p["id"] not in rejeitados]
+            erros_escrita = {}
+            try:
+                colecao.insert_many([primeira_versao(p, versao) for p in pendentes], ordered=False, session=sessao)
+            except BulkWriteError as e:
+                erros_escrita = {
+                    pendentes[erro["index"]]["id"]: mensagem_escrita(erro) for erro in e.details.get("writeErrors", [])
+                }
+                if sessao is not None:
+                    rejeitados.update(erros_escrita)
+                    raise
+            inseridos = [p for p in pendentes if p["id"] not in erros_escrita]
+            eventos = eventos_lote({"criados": inseridos}, utilizador_atual())
+            return (inseridos, {**rejeitados, **erros_escrita}), eventos
+
+        inseridos, falhas_parte = [], {}
+        while len(rejeitados) < len(parte):
+            antes = len(rejeitados)
+            try:
+                inseridos, falhas_parte = outbox.gravar(escrever)
+                break
+            except BulkWriteError:
+                if len(rejeitados) == antes:
+                    raise
+        else:
+            falhas_parte = dict(rejeitados)
+        importados.extend(inseridos)
+        falhas.update(falhas_parte)
+
+    if importados:
+        apos_escrita(criados=importados)
+    if falhas:
+        return responder({
+            "mensagem": "Importação parcial",
+            "importados": len(importados),
+            "falhas": [{"id": produto_id, "mensagem": mensagem} for produto_id, mensagem in falhas.items()]
+        }, status=207)
     return jsonify({"mensagem": "Importação concluída"})
 
 
+def mensagem_escrita(erro):
+    """Mensagem de um writeError do bulk_write; a chave duplicada é um produto que já existe."""
+    if erro.get("code") == CHAVE_DUPLICADA:
+        return "Produto com este ID já existe"
+    return erro["errmsg"]
+
+
 @app.route("/consulta", methods=["GET"])
 @login_obrigatorio
 def consulta_jsonpath():
@@ -175,17 +872,186 @@ def consulta_jsonpath():
     if not query:
         return jsonify({"erro": "Parâmetro 'q' obrigatório"}), 400
 
-    produtos = list(colecao.find({}, {"_id": 0}))
     try:
         jsonpath_expr = parse(query)
-        resultados = [match.value for match in jsonpath_expr.find(produtos)]
-        return Response(dumps(resultados), mimetype="application/json")
+        return responder_cacheado(("consulta", query), lambda: avaliar_jsonpath(jsonpath_expr))
     except Exception as e:
         return jsonify({
             "erro": "Erro ao processar JSONPath",
             "detalhes": str(e)
         }), 400
 
+
+def avaliar_jsonpath(jsonpath_expr):
+    traducao = traduzir_jsonpath(jsonpath_expr) if motor_disponivel() else None
+    if traducao is None:
+        return [match.value for match in jsonpath_expr.find(list(colecao_leituras.find({}, {"_id": 0})))]
+    # $[?(filtro numérico)]<resto>: o motor escolhe os produtos e o resto
+    # do JSONPath é aplicado só a esses
+    filtros, resto = traducao
+    produtos = produtos_por_ids(motor_colunar.consultar(filtros))
+    if resto is None:
+        return produtos
+    return [match.value for produto in produtos for match in resto.find(produto)]
+
+
+@app.route("/pesquisa", methods=["GET"])
+@login_obrigatorio
+def pesquisar():
+    """Pesquisa por relevância em nome, marca e características.
+
+    ?q=texto&limite=20; com autocompletar=1 a última palavra é tratada como
+    prefixo e completada com os termos mais frequentes do catálogo.
+    """
+    texto = request.args.get("q", "")
+    autocompletar = request.args.get("autocompletar", "0").lower() in ("1", "true")
+    try:
+        limite = int(request.args.get("limite", "20"))
+    except ValueError:
+        return jsonify({"erro": "'limite' tem de ser um inteiro"}), 400
+    if not 0 < limite <= PESQUISA_LIMITE_MAXIMO:
+        return jsonify({"erro": f"'limite' tem de estar entre 1 e {PESQUISA_LIMITE_MAXIMO}"}), 400
+
+    termos, sugestoes = termos_pesquisa(vocabulario, texto, autocompletar)
+    if not termos:
+        return jsonify({"erro": "Parâmetro 'q' obrigatório"}), 400
+
+    def produzir():
+        cursor = colecao_leituras.find(consulta_texto(termos), PROJECAO_RELEVANCIA).sort(ORDEM_RELEVANCIA).limit(limite)
+        return {"sugestoes": sugestoes, "resultados": list(cursor)}
+
+    try:
+        return responder_cacheado(("pesquisa", tuple(termos), limite), produzir)
+    except OperationFailure as e:
+        # Sem o índice de texto (ainda a ser criado ou com outra definição)
+        return jsonify({"erro": "Pesquisa indisponível", "detalhes": str(e)}), 503
+
+
+def manter_vocabulario():
+    """Reconstrói o vocabulário no arranque e depois periodicamente."""
+    while True:
+        try:
+            campos = {"_id": 0, "nome": 1, "marca": 1, "caracteristicas": 1}
+            frequencias = contar_termos(colecao_leituras.find({}, campos))
+            vocabulario.substituir(frequencias)
+            print(f"[Pesquisa] Vocabulário com {len(frequencias)} termos")
+        except PyMongoError as e:
+            print(f"[Pesquisa] Erro ao construir o vocabulário: {e}")
+        socketio.sleep(INTERVALO_VOCABULARIO)
+
+
+def criar_indice_ids():
+    # Garante no servidor um produto por id, também entre escritas concorrentes de serviços diferentes
+    try:
+        colecao.create_index("id", unique=True)
+    except OperationFailure as e:
+        print(f"Não foi possível criar o índice único de 'id' (ids repetidos na coleção?): {e}")
+
+
+def criar_indice_pesquisa():
+    try:
+        colecao.create_index(ESPEC_INDICE, **OPCOES_INDICE)
+    except OperationFailure as e:
+        print(f"[Pesquisa] Não foi possível criar o índice de texto: {e}")
+
+
+@app.route("/estatisticas", methods=["GET"])
+@login_obrigatorio
+def estatisticas_catalogo():
+    """Contagem, stock e preços por marca (?marca= para uma só), lidos da coleção materializada."""
+    if not agregador.agregado():
+        atualizar_estatisticas()
+    filtro = {"marca": request.args["marca"]} if "marca" in request.args else {}
+    linhas = [linha_publica(l) for l in colecao_estatisticas.find(filtro).sort("marca", 1)]
+    return responder({"totais": totais(linhas), "marcas": linhas})
+
+
+def atualizar_estatisticas():
+    atualizado_em = estado_estatisticas.iniciar_atualizacao()
+    try:
+        colecao.aggregate(pipeline_estatisticas(LIMIAR_STOCK_BAIXO, atualizado_em))
+        # Marcas sem produtos não aparecem no $group: apagar as que ficaram por atualizar
+        colecao_estatisticas.delete_many(filtro_obsoletas(atualizado_em))
+    except PyMongoError:
+        estado_estatisticas.marcar()
+        raise
+    estado_estatisticas.concluir_atualizacao()
+
+
+def manter_estatisticas():
+    while True:
+        try:
+            agregador.ciclo(atualizar_estatisticas)
+        except PyMongoError as e:
+            print(f"[Estatísticas] Erro ao atualizar: {e}")
+        socketio.sleep(INTERVALO_ESTATISTICAS)
+
+
+@app.route("/cache/estatisticas", methods=["GET"])
+@login_obrigatorio
+def estatisticas_cache():
+    return jsonify(cache_respostas.estatisticas())
+
+
+@app.route("/admissao/estatisticas", methods=["GET"])
+@login_obrigatorio
+def estatisticas_admissao():
+    return jsonify(admissao.estatisticas())
+
+
+@app.route("/outbox/estatisticas", methods=["GET"])
+@login_obrigatorio
+def estatisticas_outbox():
+    return jsonify({
+        "transacoes": outbox.transacoes,
+        "relays": [relay_rabbitmq.estatisticas()],
+        "seguidores": [seguidor_socketio.estatisticas()]
+    })
+
+
+# === Invalidação por change stream ===
+# Apanha também as escritas feitas por outros servidores (SOAP, gRPC, GraphQL);
+# sem replica set o watch falha e fica só o TTL da cache
+def seguir_alteracoes():
+    global colunar_por_recarregar
+    try:
+        with colecao.watch(full_document="updateLookup") as stream:
+            cache_respostas.change_stream_ativo = True
+            cache_respostas.invalidar()
+            for mudanca in stream:
+                cache_respostas.invalidar()
+                estado_estatisticas.marcar()
+                if mudanca.get("fullDocument"):
+                    if mudanca["operationType"] == "insert":
+                        vocabulario.adicionar(mudanca["fullDocument"])
+                    if motor_colunar is not None:
+                        motor_colunar.atualizar(mudanca["fullDocument"])
+                elif mudanca["operationType"] == "delete":
+                    # O evento só traz o _id; o motor é recarregado
+                    colunar_por_recarregar = True
+    except PyMongoError as e:
+        print(f"Change stream indisponível, cache limitada pelo TTL: {e}")
+    finally:
+        cache_respostas.change_stream_ativo = False
+
+def manter_colunar():
+    global colunar_por_recarregar
+    carregado_em = None
+    while True:
+        velho = carregado_em is None or (
+            not cache_respostas.change_stream_ativo and time.monotonic() - carregado_em > INTERVALO_COLUNAR
+        )
+        if velho or colunar_por_recarregar or motor_colunar.por_recarregar:
+            colunar_por_recarregar = False
+            try:
+                # Do primário: o change stream só aplica as escritas feitas depois desta leitura
+                motor_colunar.carregar(colecao.find({}, {"_id": 0, "id": 1, "preco": 1, "stock": 1, "marca": 1}))
+                carregado_em = time.monotonic()
+                print(f"[Colunar] {motor_colunar.tamanho} produtos carregados")
+            except PyMongoError as e:
+                print(f"[Colunar] Erro ao carregar: {e}")
+        socketio.sleep(1)
+
 # === Eventos WebSocket ===
 @socketio.on("connect")
 def handle_connect():
@@ -199,5 +1065,21 @@ def handle_disconnect():
 
 # === Inicialização do servidor ===
 if __name__ == "__main__":
+    socketio.start_background_task(seguir_alteracoes)
+    criar_indice_ids()
+    gestor_stock.criar_indices()
+    criar_indice_pesquisa()
+    socketio.start_background_task(manter_vocabulario)
+    colecao_estatisticas.create_index("marca", unique=True)
+    socketio.start_background_task(manter_estatisticas)
+    if motor_colunar is not None:
+        socketio.start_background_task(manter_colunar)
+    socketio.start_background_task(gestor_stock.seguir_expiracoes, INTERVALO_EXPIRACAO, socketio.sleep)
+    seguidor_socketio.criar_indices()
+    socketio.start_background_task(seguidor_socketio.correr)
+    relay_rabbitmq.criar_indices()
+    socketio.start_background_task(relay_rabbitmq.correr)
+    versoes.criar_indices()
+    socketio.start_background_task(versoes.manter, socketio.sleep)
     print("Servidor REST + WebSocket a correr em http://localhost:5000")
     socketio.run(app, host="0.0.0.0", port=5000, debug=True)
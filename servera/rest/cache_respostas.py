@@ -0,0 +1,147 @@
+from collections import OrderedDict
+import gzip
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _gzip(corpo, nivel):
+    return gzip.compress(corpo, compresslevel=nivel, mtime=0)
+
+
+def _brotli(corpo, nivel):
+    return brotli.compress(corpo, quality=nivel)
+
+
+class EntradaCache:
+    def __init__(self, corpo):
+        self.variantes = {"identity": corpo}
+        self.criada_em = time.monotonic()
+
+    @property
+    def tamanho(self):
+        return sum(len(v) for v in self.variantes.values())
+
+
+class CacheRespostas:
+    """Cache LRU de respostas já codificadas e comprimidas (gzip/brotli).
+
+    Cada entrada guarda o corpo original e as variantes comprimidas à medida
+    que são pedidas, por isso cada resposta só é comprimida uma vez por
+    encoding. A memória total é limitada a `bytes_maximo`. invalidar() é
+    chamado em cada escrita; sem change stream, ou com `leituras_atrasadas`
+    (respostas lidas de secundários), `ttl` limita quanto tempo uma escrita
+    pode ficar por ver.
+    """
+
+    def __init__(self, bytes_maximo=64 * 2 ** 20, ttl=5, nivel_gzip=6, nivel_brotli=5):
+        self.bytes_maximo = bytes_maximo
+        self.ttl = ttl
+        # A ordem define a preferência quando o cliente aceita vários com o mesmo peso
+        self.compressores = {}
+        if brotli is not None:
+            self.compressores["br"] = lambda corpo: _brotli(corpo, nivel_brotli)
+        self.compressores["gzip"] = lambda corpo: _gzip(corpo, nivel_gzip)
+        self.entradas = OrderedDict()
+        self.bytes_atuais = 0
+        self.versao = 0
+        self.lock = threading.Lock()
+        self.change_stream_ativo = False
+        self.leituras_atrasadas = False
+        self.hits = 0
+        self.misses = 0
+        self.compressoes = 0
+        self.invalidacoes = 0
+        self.evictions = 0
+        self.bytes_servidos = 0
+        self.bytes_poupados = 0
+
+    @property
+    def encodings(self):
+        return list(self.compressores)
+
+    def invalidar(self):
+        with self.lock:
+            self.versao += 1
+            self.entradas.clear()
+            self.bytes_atuais = 0
+            self.invalidacoes += 1
+
+    def _expirada(self, entrada):
+        expira = self.leituras_atrasadas or not self.change_stream_ativo
+        return expira and self.ttl and time.monotonic() - entrada.criada_em > self.ttl
+
+    def _remover(self, chave):
+        entrada = self.entradas.pop(chave)
+        self.bytes_atuais -= entrada.tamanho
+
+    def _ajustar_memoria(self):
+        while self.bytes_atuais > self.bytes_maximo and self.entradas:
+            self._remover(next(iter(self.entradas)))
+            self.evictions += 1
+
+    def obter(self, chave, produzir, encoding="identity"):
+        """Devolve (corpo, encoding); `produzir` só é chamado em caso de miss."""
+        with self.lock:
+            entrada = self.entradas.get(chave)
+            if entrada is not None and self._expirada(entrada):
+                self._remover(chave)
+                entrada = None
+            if entrada is not None:
+                self.entradas.move_to_end(chave)
+                self.hits += 1
+            else:
+                self.misses += 1
+            versao = self.versao
+
+        if entrada is None:
+            entrada = EntradaCache(produzir())
+
+        # A compressão é feita fora do lock; a entrada pode ser partilhada, por isso a
+        # variante só lhe é acrescentada (e contada) com o lock, se ninguém o fez entretanto
+        corpo = entrada.variantes.get(encoding)
+        comprimido = None
+        if corpo is None:
+            comprimido = self.compressores[encoding](entrada.variantes["identity"])
+
+        with self.lock:
+            if comprimido is not None:
+                self.compressoes += 1
+                corpo = entrada.variantes.setdefault(encoding, comprimido)
+            if self.entradas.get(chave) is entrada:
+                if corpo is comprimido:
+                    self.bytes_atuais += len(corpo)
+            elif versao == self.versao and entrada.tamanho <= self.bytes_maximo:
+                # Uma escrita durante a produção torna a entrada obsoleta: serve-se, mas não se guarda
+                anterior = self.entradas.pop(chave, None)
+                if anterior is not None:
+                    self.bytes_atuais -= anterior.tamanho
+                self.entradas[chave] = entrada
+                self.bytes_atuais += entrada.tamanho
+            self._ajustar_memoria()
+            self.bytes_servidos += len(corpo)
+            self.bytes_poupados += len(entrada.variantes["identity"]) - len(corpo)
+        return corpo, encoding
+
+    def estatisticas(self):
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self.entradas),
+            "bytes": self.bytes_atuais,
+            "bytes_maximo": self.bytes_maximo,
+            "versao": self.versao,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "compressoes": self.compressoes,
+            "invalidacoes": self.invalidacoes,
+            "evictions": self.evictions,
+            "bytes_servidos": self.bytes_servidos,
+            "bytes_poupados": self.bytes_poupados,
+            "encodings": ["identity"] + self.encodings,
+            "change_stream_ativo": self.change_stream_ativo
+        }
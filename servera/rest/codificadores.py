@@ -0,0 +1,85 @@
+import json
+from bson import json_util
+
+# Bibliotecas opcionais: sem elas o formato correspondente deixa de ser oferecido
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+# === Fallback para tipos BSON (ObjectId, Decimal128, ...) ===
+# json_util.default só é chamado para valores que o codificador não conhece,
+# por isso documentos sem tipos BSON nunca passam por ele
+_default_bson = json_util.default
+
+
+def _cbor_default(encoder, valor):
+    encoder.encode(json_util.default(valor))
+
+
+# === Codificadores ===
+if orjson is not None:
+    def codificar_json(dados):
+        return orjson.dumps(dados, default=_default_bson)
+
+    def descodificar_json(corpo):
+        return orjson.loads(corpo)
+else:
+    def codificar_json(dados):
+        return json.dumps(dados, default=_default_bson, separators=(",", ":")).encode("utf-8")
+
+    def descodificar_json(corpo):
+        return json.loads(corpo)
+
+
+def codificar_msgpack(dados):
+    return msgpack.packb(dados, default=_default_bson, use_bin_type=True)
+
+
+def descodificar_msgpack(corpo):
+    return msgpack.unpackb(corpo, raw=False)
+
+
+def codificar_cbor(dados):
+    return cbor2.dumps(dados, default=_cbor_default)
+
+
+def descodificar_cbor(corpo):
+    return cbor2.loads(corpo)
+
+
+# mimetype -> (codificar, descodificar); a ordem define a preferência em empates
+FORMATOS = {"application/json": (codificar_json, descodificar_json)}
+if msgpack is not None:
+    FORMATOS["application/msgpack"] = (codificar_msgpack, descodificar_msgpack)
+    FORMATOS["application/x-msgpack"] = (codificar_msgpack, descodificar_msgpack)
+if cbor2 is not None:
+    FORMATOS["application/cbor"] = (codificar_cbor, descodificar_cbor)
+
+
+def negociar(accept_mimetypes):
+    """Escolhe o mimetype da resposta a partir do header Accept (JSON por omissão)."""
+    return accept_mimetypes.best_match(list(FORMATOS), default="application/json") or "application/json"
+
+
+def codificar(dados, mimetype):
+    return FORMATOS[mimetype][0](dados)
+
+
+def descodificar(corpo, mimetype):
+    """Descodifica um corpo de pedido; None se o Content-Type não for suportado."""
+    formato = FORMATOS.get(mimetype)
+    if formato is None:
+        return None
+    return formato[1](corpo)
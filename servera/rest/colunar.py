@@ -0,0 +1,309 @@
+import threading
+
+from jsonpath_ng.jsonpath import Child, Fields, Root, This
+from jsonpath_ng.ext.filter import Filter
+
+# Opcional: sem NumPy o motor fica desligado e as consultas vão ao MongoDB
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CAMPOS_NUMERICOS = ("id", "preco", "stock")
+TIPOS = {"id": "int64", "preco": "float64", "stock": "int64", "marca": "int32"}
+# Colunas que um produto novo tem de trazer para entrar no motor
+COLUNAS = ("preco", "stock", "marca")
+CAPACIDADE_INICIAL = 1024
+# Com mais de metade das posições apagadas as colunas são compactadas
+FRACAO_COMPACTAR = 0.5
+
+
+class MotorColunar:
+    """Cópia em memória das colunas numéricas do catálogo, em arrays NumPy.
+
+    id, preco e stock ficam em arrays contíguos e a marca é codificada num
+    dicionário (uma string por marca, um int32 por produto), pelo que
+    filtros, top-k e histogramas são operações vetorizadas sobre o catálogo
+    inteiro. Só guarda ids e colunas numéricas: os documentos completos
+    continuam a vir do MongoDB. Atualizado produto a produto nas escritas;
+    produtos apagados ficam marcados como inválidos até à compactação.
+    Uma atualização parcial de um produto que o motor não conhece não chega
+    para criar a linha: fica `por_recarregar` até ao próximo carregar().
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("O motor colunar precisa do NumPy")
+        self.lock = threading.Lock()
+        self.carregado = False
+        self.por_recarregar = False
+        # Escritas recebidas durante um carregar(), reaplicadas no fim
+        self.pendentes = None
+        self._limpar(CAPACIDADE_INICIAL)
+
+    def _limpar(self, capacidade):
+        self.colunas = {campo: np.zeros(capacidade, dtype=tipo) for campo, tipo in TIPOS.items()}
+        self.valido = np.zeros(capacidade, dtype=bool)
+        self.n = 0
+        self.posicoes = {}
+        self.marcas = []
+        self.codigos_marca = {}
+        # campo -> (posições ordenadas por (campo, id), valores do campo nessa ordem)
+        self.ordens = {}
+
+    # === Escrita ===
+    def _codigo_marca(self, marca):
+        codigo = self.codigos_marca.get(marca)
+        if codigo is None:
+            codigo = self.codigos_marca[marca] = len(self.marcas)
+            self.marcas.append(marca)
+        return codigo
+
+    def _crescer(self):
+        capacidade = max(CAPACIDADE_INICIAL, 2 * len(self.valido))
+        for campo, coluna in self.colunas.items():
+            nova = np.zeros(capacidade, dtype=coluna.dtype)
+            nova[:self.n] = coluna[:self.n]
+            self.colunas[campo] = nova
+        valido = np.zeros(capacidade, dtype=bool)
+        valido[:self.n] = self.valido[:self.n]
+        self.valido = valido
+
+    def _escrever(self, produto):
+        posicao = self.posicoes.get(produto["id"])
+        if posicao is None:
+            if self.n == len(self.valido):
+                self._crescer()
+            posicao = self.posicoes[produto["id"]] = self.n
+            self.n += 1
+            self.colunas["id"][posicao] = produto["id"]
+            self.valido[posicao] = True
+            self.ordens.clear()
+        # Atualizações parciais só trazem alguns campos
+        for campo in ("preco", "stock"):
+            if produto.get(campo) is not None and self.colunas[campo][posicao] != produto[campo]:
+                self.colunas[campo][posicao] = produto[campo]
+                self.ordens.pop(campo, None)
+        if produto.get("marca") is not None:
+            self.colunas["marca"][posicao] = self._codigo_marca(produto["marca"])
+
+    def _remover(self, produto_id):
+        posicao = self.posicoes.pop(produto_id, None)
+        if posicao is None:
+            return
+        self.valido[posicao] = False
+        if len(self.posicoes) < self.n * FRACAO_COMPACTAR:
+            self._compactar()
+
+    def carregar(self, produtos):
+        """Substitui o conteúdo por `produtos` (iterável de documentos).
+
+        As colunas novas são construídas à parte, por isso as consultas
+        continuam a ser respondidas (com os dados anteriores) durante a carga.
+        """
+        with self.lock:
+            self.pendentes = []
+            self.por_recarregar = False
+        novo = MotorColunar()
+        for produto in produtos:
+            novo._escrever(produto)
+        with self.lock:
+            for atributo in ("colunas", "valido", "n", "posicoes", "marcas", "codigos_marca", "ordens"):
+                setattr(self, atributo, getattr(novo, atributo))
+            for operacao, argumento in self.pendentes:
+                operacao(argumento)
+            self.pendentes = None
+            self.carregado = True
+
+    def atualizar(self, produto):
+        with self.lock:
+            if produto["id"] not in self.posicoes and any(produto.get(campo) is None for campo in COLUNAS):
+                # Ex.: {id, stock} de um produto criado por outro servidor; inventar o resto daria uma linha errada
+                self.por_recarregar = True
+                return
+            self._escrever(produto)
+            if self.pendentes is not None:
+                self.pendentes.append((self._escrever, produto))
+
+    def remover(self, produto_id):
+        with self.lock:
+            self._remover(produto_id)
+            if self.pendentes is not None:
+                self.pendentes.append((self._remover, produto_id))
+
+    def _compactar(self):
+        manter = np.flatnonzero(self.valido[:self.n])
+        for campo, coluna in self.colunas.items():
+            coluna[:len(manter)] = coluna[manter]
+        self.valido[:len(manter)] = True
+        self.valido[len(manter):self.n] = False
+        self.n = len(manter)
+        self.ordens.clear()
+        self.posicoes = {int(produto_id): posicao for posicao, produto_id in enumerate(self.colunas["id"][:self.n])}
+
+    @property
+    def tamanho(self):
+        return len(self.posicoes)
+
+    # === Consulta ===
+    def _condicao(self, campo, operador, valor, posicoes=None):
+        """Máscara de uma condição sobre todas as linhas, ou só sobre `posicoes`."""
+        coluna = self.colunas[campo][:self.n]
+        if posicoes is not None:
+            coluna = coluna[posicoes]
+        if campo != "marca":
+            return OPERADORES[operador](coluna, valor)
+        # Marca: tabela de verdade por código, indexada pela coluna (evita np.isin)
+        tabela = np.zeros(len(self.marcas) + 1, dtype=bool)
+        valores = valor if operador == "in" else [valor]
+        tabela[[self.codigos_marca[m] for m in valores if m in self.codigos_marca]] = True
+        if operador == "!=":
+            tabela = ~tabela
+        return tabela[coluna]
+
+    def _mascara(self, filtros, posicoes=None):
+        mascara = self.valido[:self.n] if posicoes is None else self.valido[posicoes]
+        for campo, operador, valor in filtros:
+            mascara = mascara & self._condicao(campo, operador, valor, posicoes)
+        return mascara
+
+    def _ordem(self, campo):
+        """Posições ordenadas por (campo, id); refeita só quando o campo muda ou entram produtos.
+
+        Produtos apagados continuam na ordem e são filtrados pela coluna `valido`.
+        """
+        if campo not in self.ordens:
+            posicoes = np.lexsort((self.colunas["id"][:self.n], self.colunas[campo][:self.n]))
+            self.ordens[campo] = (posicoes, self.colunas[campo][posicoes])
+        return self.ordens[campo]
+
+    def _intervalo(self, campo, valores, filtros):
+        """Limites em `valores` (ordenados) que cumprem os filtros sobre `campo`, por pesquisa binária."""
+        inicio, fim = 0, len(valores)
+        restantes = []
+        for filtro in filtros:
+            filtro_campo, operador, valor = filtro
+            if filtro_campo != campo or operador not in ("<", "<=", ">", ">=", "=="):
+                restantes.append(filtro)
+                continue
+            if operador in (">", ">=", "=="):
+                inicio = max(inicio, np.searchsorted(valores, valor, side="right" if operador == ">" else "left"))
+            if operador in ("<", "<=", "=="):
+                fim = min(fim, np.searchsorted(valores, valor, side="left" if operador == "<" else "right"))
+        return inicio, max(inicio, fim), restantes
+
+    def consultar(self, filtros=(), ordenar_por=None, ordem=1, limite=None):
+        """Ids dos produtos que cumprem `filtros` [(campo, operador, valor)], ordenados e limitados."""
+        with self.lock:
+            if ordenar_por is None:
+                selecionados = np.flatnonzero(self._mascara(filtros))
+                if limite is not None:
+                    selecionados = selecionados[:limite]
+                return self.colunas["id"][selecionados].tolist()
+
+            # Ordenado: percorre a ordem pré-calculada do campo, restringida pelos
+            # filtros de intervalo nesse campo, e só avalia os outros filtros
+            # em blocos até ter `limite` resultados
+            posicoes, valores = self._ordem(ordenar_por)
+            inicio, fim, restantes = self._intervalo(ordenar_por, valores, filtros)
+            posicoes = posicoes[inicio:fim]
+            if ordem < 0:
+                # Descendente também no desempate por id, como no MongoDB com sort (campo, -1), (id, -1)
+                posicoes = posicoes[::-1]
+
+            bloco = max(len(posicoes), 1) if limite is None else max(4 * limite, 4096)
+            encontrados = []
+            total = 0
+            for i in range(0, len(posicoes), bloco):
+                parte = posicoes[i:i + bloco]
+                parte = parte[self._mascara(restantes, parte)]
+                encontrados.append(parte)
+                total += len(parte)
+                if limite is not None and total >= limite:
+                    break
+            selecionados = np.concatenate(encontrados) if encontrados else posicoes[:0]
+            return self.colunas["id"][selecionados[:limite]].tolist()
+
+    def contar(self, filtros=()):
+        with self.lock:
+            return int(np.count_nonzero(self._mascara(filtros)))
+
+    def histograma(self, campo, intervalos, filtros=()):
+        """Contagens em `intervalos` intervalos de largura igual entre o mínimo e o máximo."""
+        with self.lock:
+            valores = self.colunas[campo][:self.n][self._mascara(filtros)]
+        if len(valores) == 0:
+            return {"campo": campo, "limites": [], "contagens": []}
+        minimo, maximo = float(valores.min()), float(valores.max())
+        if minimo == maximo:
+            return {"campo": campo, "limites": [minimo, maximo], "contagens": [len(valores)]}
+        largura = (maximo - minimo) / intervalos
+        # bincount sobre o índice do intervalo é bem mais rápido do que np.histogram
+        indices = ((valores - minimo) / largura).astype(np.int64)
+        np.minimum(indices, intervalos - 1, out=indices)
+        contagens = np.bincount(indices, minlength=intervalos)
+        limites = [minimo + i * largura for i in range(intervalos)] + [maximo]
+        return {"campo": campo, "limites": limites, "contagens": contagens.tolist()}
+
+
+if np is not None:
+    OPERADORES = {
+        "<": np.less,
+        "<=": np.less_equal,
+        ">": np.greater,
+        ">=": np.greater_equal,
+        "==": np.equal,
+        "!=": np.not_equal,
+    }
+else:
+    OPERADORES = {}
+
+# Operadores equivalentes no MongoDB, para quando o motor está desligado
+OPERADORES_MONGO = {"<": "$lt", "<=": "$lte", ">": "$gt", ">=": "$gte", "==": "$eq", "!=": "$ne", "in": "$in"}
+
+
+def filtro_mongo(filtros):
+    query = {}
+    for campo, operador, valor in filtros:
+        query.setdefault(campo, {})[OPERADORES_MONGO[operador]] = valor
+    return query
+
+
+# === Tradução de JSONPath simples ===
+def traduzir_jsonpath(expressao):
+    """Decompõe $[?(...)]<resto> em (filtros, resto) quando o filtro é só sobre colunas do motor.
+
+    Devolve None se a expressão não tiver essa forma; nesse caso /consulta
+    avalia o JSONPath sobre o catálogo completo como antes.
+    """
+    segmentos = []
+    while isinstance(expressao, Child) and not isinstance(expressao.left, Root):
+        segmentos.insert(0, expressao.right)
+        expressao = expressao.left
+    if not (isinstance(expressao, Child) and isinstance(expressao.right, Filter)):
+        return None
+
+    filtros = []
+    for condicao in expressao.right.expressions:
+        alvo = condicao.target
+        if isinstance(alvo, Child) and isinstance(alvo.left, This):
+            alvo = alvo.right
+        if not isinstance(alvo, Fields) or len(alvo.fields) != 1:
+            return None
+        campo = alvo.fields[0]
+        operador = "==" if condicao.op == "=" else condicao.op
+        valor = condicao.value
+        if campo in CAMPOS_NUMERICOS and operador in OPERADORES_MONGO and operador != "in":
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                return None
+        elif campo == "marca" and operador in ("==", "!="):
+            if not isinstance(valor, str):
+                return None
+        else:
+            return None
+        filtros.append((campo, operador, valor))
+
+    resto = None
+    for segmento in segmentos:
+        resto = segmento if resto is None else Child(resto, segmento)
+    return filtros, resto
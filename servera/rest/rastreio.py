@@ -0,0 +1,308 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# Cópia partilhada com serverb/soap/rastreio.py, serverc/grpc/rastreio.py e
+# serverc/graphql/rastreio.py (cada serviço tem o seu contexto Docker)
+
+# Tipos de span do OTLP
+INTERNO, SERVIDOR, CLIENTE, PRODUTOR, CONSUMIDOR = 1, 2, 3, 4, 5
+# Spans à espera de exportação; acima disto são descartados em vez de acumular memória
+FILA_MAXIMA = 10000
+LOTE_EXPORTACAO = 512
+
+_span_atual = contextvars.ContextVar("span_atual", default=None)
+
+
+def _hex(bits):
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def ler_traceparent(valor):
+    """(trace_id, span_id, amostrado) de um header W3C traceparent, ou None se for inválido."""
+    if not valor:
+        return None
+    partes = valor.strip().split("-")
+    if len(partes) < 4 or len(partes[1]) != 32 or len(partes[2]) != 16 or len(partes[3]) != 2:
+        return None
+    try:
+        int(partes[1], 16), int(partes[2], 16)
+        flags = int(partes[3], 16)
+    except ValueError:
+        return None
+    if partes[1] == "0" * 32 or partes[2] == "0" * 16:
+        return None
+    return partes[1], partes[2], bool(flags & 1)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "pai_id", "nome", "tipo", "inicio", "fim", "atributos", "erro", "amostrado")
+
+    def __init__(self, trace_id, pai_id, nome, tipo, amostrado, atributos=None):
+        self.trace_id = trace_id
+        self.span_id = _hex(64)
+        self.pai_id = pai_id
+        self.nome = nome
+        self.tipo = tipo
+        self.amostrado = amostrado
+        self.atributos = dict(atributos) if atributos else {}
+        self.erro = None
+        self.inicio = time.time_ns()
+        self.fim = None
+
+    def definir(self, chave, valor):
+        if self.amostrado:
+            self.atributos[chave] = valor
+
+    def falhar(self, erro):
+        # Fica o primeiro erro registado, normalmente o mais específico
+        if self.erro is None:
+            self.erro = str(erro) or type(erro).__name__
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.amostrado else '00'}"
+
+    def otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.nome,
+            "kind": self.tipo,
+            "startTimeUnixNano": str(self.inicio),
+            "endTimeUnixNano": str(self.fim),
+            "attributes": [{"key": k, "value": _valor_otlp(v)} for k, v in self.atributos.items()],
+            "status": {"code": 2, "message": self.erro} if self.erro else {"code": 1}
+        }
+        if self.pai_id:
+            span["parentSpanId"] = self.pai_id
+        return span
+
+
+def _valor_otlp(valor):
+    if isinstance(valor, bool):
+        return {"boolValue": valor}
+    if isinstance(valor, int):
+        return {"intValue": str(valor)}
+    if isinstance(valor, float):
+        return {"doubleValue": valor}
+    return {"stringValue": str(valor)}
+
+
+# === Exportação (OTLP/JSON, em lotes, numa thread à parte) ===
+class Exportador:
+    """Junta spans terminados e envia-os em lotes, sem bloquear os pedidos."""
+
+    def __init__(self, servico, intervalo=2.0):
+        self.servico = servico
+        self.intervalo = intervalo
+        self.fila = queue.Queue(FILA_MAXIMA)
+        self.descartados = 0
+        threading.Thread(target=self._correr, daemon=True).start()
+
+    def adicionar(self, span):
+        try:
+            self.fila.put_nowait(span)
+        except queue.Full:
+            self.descartados += 1
+
+    def _correr(self):
+        while True:
+            lote = [self.fila.get()]
+            limite = time.monotonic() + self.intervalo
+            while len(lote) < LOTE_EXPORTACAO:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self.fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+            try:
+                self.enviar(self._documento(lote))
+            except Exception as e:
+                print(f"[Rastreio] Erro ao exportar {len(lote)} span(s): {e}")
+
+    def _documento(self, lote):
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.servico}}]},
+            "scopeSpans": [{"scope": {"name": "catalogo.rastreio"}, "spans": [s.otlp() for s in lote]}]
+        }]}
+
+    def enviar(self, documento):
+        raise NotImplementedError
+
+
+class ExportadorFicheiro(Exportador):
+    """Uma linha OTLP/JSON por lote (formato lido pelo receiver otlpjsonfile do OpenTelemetry Collector)."""
+
+    def __init__(self, servico, caminho):
+        self.caminho = caminho
+        super().__init__(servico)
+
+    def enviar(self, documento):
+        with open(self.caminho, "a") as f:
+            f.write(json.dumps(documento, separators=(",", ":")) + "\n")
+
+
+class ExportadorOTLP(Exportador):
+    """POST para o endpoint OTLP/HTTP (JSON) de um coletor local, ex.: http://localhost:4318."""
+
+    def __init__(self, servico, url):
+        self.url = url.rstrip("/") + "/v1/traces"
+        super().__init__(servico)
+
+    def enviar(self, documento):
+        pedido = urllib.request.Request(
+            self.url,
+            data=json.dumps(documento).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(pedido, timeout=5) as resposta:
+            resposta.read()
+
+
+# === Rastreador ===
+class Rastreador:
+    """Spans por pedido com propagação W3C traceparent.
+
+    A decisão de amostragem é tomada no primeiro servidor (fração
+    `amostragem` dos pedidos sem traceparent) e segue no traceparent para os
+    restantes. Pedidos não amostrados não criam spans filhos nem spans do
+    MongoDB: só propagam o traceparent. Sem exportador o rastreio fica
+    desligado e span()/pedido() não fazem nada.
+    """
+
+    def __init__(self, exportador=None, amostragem=1.0):
+        self.exportador = exportador
+        self.amostragem = amostragem
+        self.ativo = exportador is not None
+
+    @classmethod
+    def do_ambiente(cls, servico):
+        """RASTREIO_FICHEIRO ou RASTREIO_OTLP_URL escolhem o destino; RASTREIO_AMOSTRAGEM a fração amostrada."""
+        exportador = None
+        if os.getenv("RASTREIO_OTLP_URL"):
+            exportador = ExportadorOTLP(servico, os.getenv("RASTREIO_OTLP_URL"))
+        elif os.getenv("RASTREIO_FICHEIRO"):
+            exportador = ExportadorFicheiro(servico, os.getenv("RASTREIO_FICHEIRO"))
+        return cls(exportador, float(os.getenv("RASTREIO_AMOSTRAGEM", "0.05")))
+
+    def atual(self):
+        return _span_atual.get()
+
+    def traceparent(self):
+        span = _span_atual.get()
+        return span.traceparent if span is not None else None
+
+    def iniciar(self, nome, tipo=INTERNO, **atributos):
+        """Span filho do atual sem o tornar atual, para quando o início e o fim estão em callbacks diferentes.
+
+        Devolve None fora de um pedido amostrado.
+        """
+        pai = _span_atual.get()
+        if pai is None or not pai.amostrado:
+            return None
+        return Span(pai.trace_id, pai.span_id, nome, tipo, True, atributos)
+
+    def terminar(self, span):
+        if span is None:
+            return
+        span.fim = time.time_ns()
+        if span.amostrado:
+            self.exportador.adicionar(span)
+
+    @contextmanager
+    def _ativar(self, span):
+        token = _span_atual.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.falhar(e)
+            raise
+        finally:
+            _span_atual.reset(token)
+            self.terminar(span)
+
+    @contextmanager
+    def pedido(self, nome, traceparent=None, tipo=SERVIDOR, **atributos):
+        """Span raiz de um pedido recebido, filho do traceparent de quem chamou (se houver)."""
+        if not self.ativo:
+            yield None
+            return
+        pai = ler_traceparent(traceparent)
+        if pai is None:
+            span = Span(_hex(128), None, nome, tipo, random.random() < self.amostragem, atributos)
+        else:
+            span = Span(pai[0], pai[1], nome, tipo, pai[2], atributos)
+        with self._ativar(span):
+            yield span
+
+    @contextmanager
+    def span(self, nome, tipo=INTERNO, **atributos):
+        """Span filho do span atual; fora de um pedido amostrado não faz nada."""
+        span = self.iniciar(nome, tipo, **atributos)
+        if span is None:
+            yield _span_atual.get()
+            return
+        with self._ativar(span):
+            yield span
+
+    def rastrear(self, nome):
+        """Decorador: um span `nome` por chamada da função."""
+        def decorador(funcao):
+            @functools.wraps(funcao)
+            def envolvida(*args, **kwargs):
+                with self.span(nome):
+                    return funcao(*args, **kwargs)
+            return envolvida
+        return decorador
+
+    def ouvintes_mongo(self):
+        """Para event_listeners do MongoClient; vazio com o rastreio desligado (o pymongo nem cria os eventos)."""
+        return [OuvinteMongo(self)] if self.ativo else []
+
+
+class OuvinteMongo(monitoring.CommandListener):
+    """Um span por comando enviado ao MongoDB (command monitoring do pymongo).
+
+    Os eventos chegam na thread (ou contexto copiado, no Motor) de quem fez
+    o comando, por isso o span atual é o do pedido. Comandos de tarefas de
+    fundo, fora de qualquer pedido, não são rastreados.
+    """
+
+    def __init__(self, rastreador):
+        self.rastreador = rastreador
+        self.pendentes = {}
+
+    def started(self, event):
+        span = self.rastreador.iniciar(f"mongo {event.command_name}", CLIENTE, **{
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name
+        })
+        if span is None:
+            return
+        colecao = event.command.get(event.command_name)
+        if isinstance(colecao, str):
+            span.atributos["db.mongodb.collection"] = colecao
+        self.pendentes[(event.connection_id, event.request_id)] = span
+
+    def succeeded(self, event):
+        span = self.pendentes.pop((event.connection_id, event.request_id), None)
+        self.rastreador.terminar(span)
+
+    def failed(self, event):
+        span = self.pendentes.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.falhar(event.failure.get("errmsg", "falhou"))
+            self.rastreador.terminar(span)
@@ -1,10 +1,16 @@
 import pika
+from rastreio import Rastreador, CONSUMIDOR
 
 # --- Configuração do RabbitMQ ---
 RABBITMQ_HOST = "192.168.2.111"  # IP Server RabbitMQ
 
+# Continua o trace de quem publicou (traceparent nos headers AMQP)
+rastreador = Rastreador.do_ambiente("soap-consumidor")
+
 def callback(ch, method, properties, body):
-    print(f"[x] Mensagem recebida: {body.decode()}")
+    traceparent = (properties.headers or {}).get("traceparent")
+    with rastreador.pedido("consumir produtos_queue", traceparent, CONSUMIDOR, **{"messaging.system": "rabbitmq"}):
+        print(f"[x] Mensagem recebida: {body.decode()}")
 
 def main():
     connection = pika.BlockingConnection(
@@ -2,7 +2,7 @@ from spyne import Application, rpc, ServiceBase, Integer, Unicode, Float, Iterab
 from spyne.protocol.soap import Soap11
 from spyne.server.wsgi import WsgiApplication
 from spyne import ComplexModel
-from pymongo import MongoClient
+from spyne.model.fault import Fault
 import pika
 import os
 import threading
@@ -12,26 +12,49 @@ from jose.utils import base64url_decode
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
 import requests
+from pymongo.errors import OperationFailure
+from admissao import ControloAdmissao, Recusado
+from rastreio import Rastreador, CONSUMIDOR
+from ligacao import LigacaoMongo
+from outbox import Outbox, Relay, DestinoRabbitMQ, evento
+from versoes import primeira_versao, nova_versao
+
+# === Rastreio de pedidos (RASTREIO_FICHEIRO ou RASTREIO_OTLP_URL) ===
+rastreador = Rastreador.do_ambiente("soap")
 
 # === Conexão MongoDB ===
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://192.168.2.110:27017")  #ip
-client = MongoClient(MONGO_URL)
-db = client["catalogo"]
+ligacao = LigacaoMongo.do_ambiente(rastreador, "mongodb://192.168.2.110:27017")  #ip
+client = ligacao.client
+db = ligacao.db
 colecao = db["produtos"]
+# getProdutos pode ler dos secundários
+colecao_leituras = ligacao.leituras(colecao)
+
+def criar_indice_ids():
+    # Garante no servidor um produto por id, também entre escritas concorrentes de serviços diferentes
+    try:
+        colecao.create_index("id", unique=True)
+    except OperationFailure as e:
+        print(f"Não foi possível criar o índice único de 'id' (ids repetidos na coleção?): {e}")
+
 
 # === Configuração RabbitMQ ===
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 
-def publicar_mensagem(mensagem):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
-    channel = connection.channel()
-    channel.queue_declare(queue='produtos_queue', durable=True)
-    channel.basic_publish(exchange='', routing_key='produtos_queue', body=mensagem)
-    connection.close()
+ATRIBUTOS_FILA = {"messaging.system": "rabbitmq", "messaging.destination.name": "produtos_queue"}
+
+# === Eventos de alteração (outbox gravado na mesma transação que a escrita) ===
+outbox = Outbox.do_ambiente(db, "soap", rastreador)
+
+# Os quatro servidores correm este relay; o que tem o arrendamento publica os eventos de todos
+relay_rabbitmq = Relay.do_ambiente(db, DestinoRabbitMQ(RABBITMQ_HOST, rastreador=rastreador), rastreador)
+outbox.ouvintes.append(relay_rabbitmq.acordar)
 
 def consumidor():
     def callback(ch, method, properties, body):
-        print(f"[x] Mensagem recebida no consumidor: {body.decode()}")
+        traceparent = (properties.headers or {}).get("traceparent")
+        with rastreador.pedido("consumir produtos_queue", traceparent, CONSUMIDOR, **ATRIBUTOS_FILA):
+            print(f"[x] Mensagem recebida no consumidor: {body.decode()}")
 
     connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST))
     channel = connection.channel()
@@ -46,7 +69,7 @@ t.start()
 
 # === JWT/Keycloak Config ===
 KEYCLOAK_REALM = "catalogo-produtos"
-KEYCLOAK_URL = "http://192.168.2.122:8080"
+KEYCLOAK_URL = os.getenv("KEYCLOAK_URL", "http://192.168.2.122:8080")
 KEYCLOAK_ISSUER = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}"
 JWKS_URL = f"{KEYCLOAK_ISSUER}/protocol/openid-connect/certs"
 jwks = requests.get(JWKS_URL).json()
@@ -60,6 +83,7 @@ def jwk_to_rsa_key(jwk):
     )
     return public_numbers.public_key(backend=default_backend())
 
+@rastreador.rastrear("validar_token")
 def validar_token(token):
     try:
         header = jwt.get_unverified_header(token)
@@ -79,6 +103,18 @@ def validar_token(token):
         print(f"[JWT inválido] {e}")
         return None
 
+def payload_jwt(ctx):
+    """(payload, erro) do token do pedido; verificado uma só vez, em admitir(), e guardado em ctx.udc["jwt"]."""
+    auth_header = ctx.transport.req_env.get('HTTP_AUTHORIZATION')
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None, "Token ausente ou mal formatado"
+    if ctx.udc is None:
+        ctx.udc = {}
+    if "jwt" not in ctx.udc:
+        ctx.udc["jwt"] = validar_token(auth_header.replace("Bearer", "").strip())
+    payload = ctx.udc["jwt"]
+    return payload, None if payload else "Token inválido ou expirado"
+
 # === SOAP ===
 class ProdutoSOAP(ComplexModel):
     id = Integer
@@ -94,27 +130,20 @@ class ProdutoService(ServiceBase):
 
     @rpc(_returns=Iterable(ProdutoSOAP))
     def getProdutos(ctx):
-        auth_header = ctx.transport.req_env.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return []
-        token = auth_header.replace("Bearer ", "")
-        if not validar_token(token):
+        _, erro = payload_jwt(ctx)
+        if erro:
             return []
 
         produtos = []
-        for p in colecao.find({}, {"_id": 0}):
+        for p in colecao_leituras.find({}, {"_id": 0}):
             produtos.append(ProdutoSOAP(**p))
         return produtos
 
     @rpc(Integer, Unicode, Unicode, Float, Integer, Unicode, Unicode, Unicode, _returns=Unicode)
     def addProduto(ctx, id, nome, marca, preco, stock, tela, bateria, armazenamento):
-        auth_header = ctx.transport.req_env.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return "Token ausente ou mal formatado"
-        token = auth_header.replace("Bearer", "").strip()
-        payload = validar_token(token)
-        if not payload:
-            return "Token inválido ou expirado"
+        payload, erro = payload_jwt(ctx)
+        if erro:
+            return erro
         utilizador = payload.get("preferred_username", "desconhecido")
 
         if colecao.find_one({"id": id}):
@@ -130,61 +159,121 @@ class ProdutoService(ServiceBase):
             "bateria": bateria,
             "armazenamento": armazenamento
         }
-        colecao.insert_one(produto)
+        dados = dict(produto)
+
+        def escrever(sessao, versao):
+            colecao.insert_one(primeira_versao(produto, versao), session=sessao)
+            return None, [evento("novo_produto", [id], dados, utilizador)]
 
-        publicar_mensagem(f"O utilizador {utilizador} adicionou produto: {nome} ({marca})")
+        outbox.gravar(escrever)
 
         return "Produto adicionado com sucesso"
 
     @rpc(Integer, Unicode, Unicode, Float, Integer, Unicode, Unicode, Unicode, _returns=Unicode)
     def editarProduto(ctx, id, nome, marca, preco, stock, tela, bateria, armazenamento):
-        auth_header = ctx.transport.req_env.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return "Token ausente ou mal formatado"
-        token = auth_header.replace("Bearer", "").strip()
-        payload = validar_token(token)
-        if not payload:
-            return "Token inválido ou expirado"
+        payload, erro = payload_jwt(ctx)
+        if erro:
+            return erro
         utilizador = payload.get("preferred_username", "desconhecido")
 
-        resultado = colecao.update_one(
-            {"id": id},
-            {"$set": {
-                "nome": nome,
-                "marca": marca,
-                "preco": preco,
-                "stock": stock,
-                "tela": tela,
-                "bateria": bateria,
-                "armazenamento": armazenamento
-            }}
-        )
-        if resultado.matched_count == 0:
-            return "Produto não encontrado"
+        campos = {
+            "nome": nome,
+            "marca": marca,
+            "preco": preco,
+            "stock": stock,
+            "tela": tela,
+            "bateria": bateria,
+            "armazenamento": armazenamento
+        }
 
-        publicar_mensagem(f"O utilizador {utilizador} atualizou produto: {nome} ({marca})")
+        def escrever(sessao, versao):
+            resultado = colecao.update_one({"id": id}, nova_versao({"$set": campos}, versao), session=sessao)
+            if resultado.matched_count == 0:
+                return False, []
+            return True, [evento("produto_editado", [id], {"id": id, **campos}, utilizador)]
+
+        if not outbox.gravar(escrever):
+            return "Produto não encontrado"
 
         return "Produto atualizado com sucesso"
 
     @rpc(Integer, _returns=Unicode)
     def deleteProduto(ctx, id):
-        auth_header = ctx.transport.req_env.get('HTTP_AUTHORIZATION')
-        if not auth_header or not auth_header.startswith("Bearer "):
-            return "Token ausente ou mal formatado"
-        token = auth_header.replace("Bearer", "").strip()
-        payload = validar_token(token)
-        if not payload:
-            return "Token inválido ou expirado"
+        payload, erro = payload_jwt(ctx)
+        if erro:
+            return erro
         utilizador = payload.get("preferred_username", "desconhecido")
 
-        resultado = colecao.delete_one({"id": id})
-        if resultado.deleted_count == 0:
-            return "Produto não encontrado"
+        def escrever(sessao, versao):
+            resultado = colecao.delete_one({"id": id}, session=sessao)
+            if resultado.deleted_count == 0:
+                return False, []
+            return True, [evento("produto_removido", [id], {"id": id}, utilizador, [id])]
 
-        publicar_mensagem(f"O utilizador {utilizador} removeu o produto com ID: {id}")
+        if not outbox.gravar(escrever):
+            return "Produto não encontrado"
 
         return "Produto removido"
 
+# === Controlo de admissão (taxa por utilizador e vagas por método) ===
+# getProdutos devolve o catálogo inteiro: custa mais e tem menos vagas
+admissao = ControloAdmissao.do_ambiente(pesadas=("getProdutos",))
+
+def admitir(ctx):
+    ctx.udc = {}
+    span = rastreador.atual()
+    if span is not None:
+        span.nome = f"SOAP {ctx.descriptor.name}"
+        span.definir("rpc.method", ctx.descriptor.name)
+    # Sem token válido o próprio método responde com o erro, sem tocar no MongoDB
+    payload, _ = payload_jwt(ctx)
+    if not payload:
+        return
+    try:
+        with rastreador.span("admissao"):
+            ctx.udc["bilhete"] = admissao.entrar(payload.get("preferred_username", "desconhecido"), ctx.descriptor.name)
+    except Recusado as e:
+        # 429 quando é o utilizador que excede a sua taxa, 503 quando é o servidor que está cheio
+        limite = e.motivo == "limite"
+        ctx.transport.resp_code = "429 Too Many Requests" if limite else "503 Service Unavailable"
+        ctx.transport.resp_headers["Retry-After"] = str(e.segundos)
+        raise Fault(
+            faultcode="Client.LimiteExcedido" if limite else "Server.Sobrecarga",
+            faultstring=e.mensagem,
+            detail={"repetir_apos": str(round(e.repetir_apos, 3))}
+        )
+
+def libertar(ctx):
+    if ctx.udc and "bilhete" in ctx.udc:
+        ctx.udc.pop("bilhete").sair()
+
+# A serialização do Spyne corre depois do método: do objeto devolvido até à string XML
+def iniciar_serializacao(ctx):
+    libertar(ctx)
+    if ctx.udc is not None:
+        ctx.udc["serializar"] = rastreador.iniciar("serializar")
+
+def terminar_serializacao(ctx):
+    if ctx.udc and ctx.udc.get("serializar") is not None:
+        rastreador.terminar(ctx.udc.pop("serializar"))
+
+ProdutoService.event_manager.add_listener("method_call", admitir)
+ProdutoService.event_manager.add_listener("method_return_object", iniciar_serializacao)
+ProdutoService.event_manager.add_listener("method_exception_object", libertar)
+ProdutoService.event_manager.add_listener("method_return_string", terminar_serializacao)
+
+def com_rastreio(wsgi_app):
+    """Envolve a aplicação WSGI num span por pedido, filho do traceparent recebido."""
+    def aplicacao(environ, start_response):
+        with rastreador.pedido("SOAP", environ.get("HTTP_TRACEPARENT"), **{"rpc.system": "soap"}) as span:
+            def start_response_rastreado(status, headers, *args):
+                if span is not None:
+                    span.definir("http.status_code", int(status[:3]))
+                return start_response(status, headers, *args)
+            # O corpo é produzido dentro do span (inclui a serialização do Spyne)
+            return list(wsgi_app(environ, start_response_rastreado))
+    return aplicacao
+
 # === Spyne App ===
 app = Application(
     [ProdutoService],
@@ -197,5 +286,10 @@ if __name__ == "__main__":
     from wsgiref.simple_server import make_server
     print("SOAP server a correr em http://localhost:8000")
     wsgi_app = WsgiApplication(app)
-    server = make_server("0.0.0.0", 8000, wsgi_app)
+    criar_indice_ids()
+    relay_rabbitmq.criar_indices()
+    threading.Thread(target=relay_rabbitmq.correr, daemon=True).start()
+    outbox.versoes.criar_indices()
+    threading.Thread(target=outbox.versoes.manter, daemon=True).start()
+    server = make_server("0.0.0.0", 8000, com_rastreio(wsgi_app))
     server.serve_forever()
@@ -1,20 +1,192 @@
-from flask import Flask, request, jsonify
-from flask_graphql import GraphQLView
-from schema import schema
-
-app = Flask(__name__)
-
-app.add_url_rule(
-    "/graphql",
-    view_func=GraphQLView.as_view(
-        "graphql",
-        schema=schema,
-        graphiql=True
-    )
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, HTMLResponse
+from starlette.routing import Route, WebSocketRoute
+from graphql import ExecutionResult, GraphQLError, execute, get_operation_ast
+from graphql.language import OperationType
+from contextlib import asynccontextmanager
+from inspect import isawaitable
+import json
+import math
+import os
+import uvicorn
+from schema import schema, admissao, admitir, payload_jwt, rastreador, criar_indice_ids, iniciar_relay
+from cache_documentos import CacheDocumentos, ErroPedido, resolver_query_persistida
+from protocolo_ws import LigacaoGraphQLWS
+
+# === Cache de documentos parsed/validados ===
+cache_documentos = CacheDocumentos(
+    schema.graphql_schema,
+    int(os.getenv("GRAPHQL_CACHE_DOCUMENTOS", "1000"))
 )
 
+GRAPHIQL_HTML = """<!DOCTYPE html>
+<html>
+<head>
+  <title>GraphiQL</title>
+  <link rel="stylesheet" href="https://unpkg.com/graphiql@2/graphiql.min.css" />
+</head>
+<body style="margin: 0;">
+  <div id="graphiql" style="height: 100vh;"></div>
+  <script src="https://unpkg.com/react@17/umd/react.production.min.js"></script>
+  <script src="https://unpkg.com/react-dom@17/umd/react-dom.production.min.js"></script>
+  <script src="https://unpkg.com/graphiql@2/graphiql.min.js"></script>
+  <script>
+    const fetcher = GraphiQL.createFetcher({ url: window.location.href });
+    ReactDOM.render(React.createElement(GraphiQL, { fetcher }), document.getElementById("graphiql"));
+  </script>
+</body>
+</html>
+"""
+
+def quer_graphiql(request):
+    if "raw" in request.query_params:
+        return False
+    return "text/html" in request.headers.get("accept", "")
+
+async def ler_pedido(request):
+    if request.method == "GET":
+        return dict(request.query_params)
+    content_type = request.headers.get("content-type", "").split(";")[0]
+    if content_type == "application/graphql":
+        return {"query": (await request.body()).decode("utf-8")}
+    if content_type == "application/json":
+        try:
+            data = await request.json()
+        except ValueError:
+            raise ErroPedido(400, "POST body sent invalid JSON.")
+        if not isinstance(data, dict):
+            raise ErroPedido(400, "POST body must be a JSON object.")
+        return data
+    if content_type in ("application/x-www-form-urlencoded", "multipart/form-data"):
+        return dict(await request.form())
+    return {}
+
+def ler_variaveis(variables):
+    if variables and isinstance(variables, str):
+        try:
+            return json.loads(variables)
+        except ValueError:
+            raise ErroPedido(400, "Variables are invalid JSON.")
+    return variables
+
+async def executar(request, data):
+    query = resolver_query_persistida(cache_documentos, data)
+    if not query:
+        raise ErroPedido(400, "Must provide query string.")
+    operation_name = data.get("operationName")
+    span = rastreador.atual()
+    if span is not None and operation_name:
+        span.nome = f"GraphQL {operation_name}"
+
+    try:
+        with rastreador.span("validar_documento"):
+            documento = cache_documentos.documento(query)
+    except GraphQLError as e:
+        raise ErroPedido(400, e.message)
+    if documento.erros:
+        return ExecutionResult(None, documento.erros), 400
+
+    if request.method == "GET":
+        operacao = get_operation_ast(documento.document_ast, operation_name)
+        if operacao and operacao.operation != OperationType.QUERY:
+            raise ErroPedido(405, f"Can only perform a {operacao.operation.value} operation from a POST request.")
+
+    # O contexto é o próprio pedido: extrair_token lê os headers e guarda
+    # nele o payload JWT e o DataLoader deste pedido
+    variaveis = ler_variaveis(data.get("variables"))
+    try:
+        bilhete = await admitir(request, documento.document_ast, operation_name, variaveis)
+    except GraphQLError as e:
+        return ExecutionResult(None, [e]), 200
+    with bilhete:
+        resultado = execute(
+            schema.graphql_schema,
+            documento.document_ast,
+            context_value=request,
+            variable_values=variaveis,
+            operation_name=operation_name
+        )
+        if isawaitable(resultado):
+            resultado = await resultado
+    return resultado, 200
+
+async def graphql_endpoint(request):
+    if request.method == "GET" and quer_graphiql(request):
+        return HTMLResponse(GRAPHIQL_HTML)
+    with rastreador.pedido("GraphQL", request.headers.get("traceparent"), **{"http.method": request.method}) as span:
+        resposta = await responder(request)
+        if span is not None:
+            span.definir("http.status_code", resposta.status_code)
+        return resposta
+
+async def responder(request):
+    try:
+        data = await ler_pedido(request)
+        resultado, status_code = await executar(request, data)
+    except ErroPedido as e:
+        return JSONResponse(e.formatar(), status_code=e.status_code)
+
+    headers = {}
+    recusa = recusa_admissao(resultado)
+    if recusa:
+        status_code, headers["Retry-After"] = recusa
+    with rastreador.span("serializar"):
+        resposta = resultado.formatted
+        if status_code != 200:
+            resposta.pop("data", None)
+        return JSONResponse(resposta, status_code=status_code, headers=headers)
+
+def recusa_admissao(resultado):
+    """(status, Retry-After) quando a operação não foi executada por o controlo de admissão a ter recusado."""
+    erros = resultado.errors or []
+    codigos = [(e.extensions or {}).get("codigo") for e in erros]
+    if not erros or resultado.data is not None or any(c not in ("LIMITE_EXCEDIDO", "SOBRECARGA") for c in codigos):
+        return None
+    # 429 quando é o utilizador que excede a sua taxa, 503 quando é o servidor que está cheio
+    status = 429 if "LIMITE_EXCEDIDO" in codigos else 503
+    repetir_apos = max(e.extensions["repetir_apos"] for e in erros)
+    return status, str(max(1, math.ceil(repetir_apos)))
+
+async def graphql_ws_endpoint(websocket):
+    # Subscriptions (e também queries/mutations) pelos protocolos graphql-ws
+    await LigacaoGraphQLWS(websocket, schema.graphql_schema, cache_documentos, admitir, rastreador).correr()
+
+def com_login(endpoint):
+    # Mesmo token (Keycloak) que as operações GraphQL
+    async def protegido(request):
+        if not payload_jwt(request):
+            return JSONResponse({"errors": [{"message": "Token ausente ou inválido"}]}, status_code=401)
+        return await endpoint(request)
+    return protegido
+
+@com_login
+async def estatisticas_cache(request):
+    return JSONResponse(cache_documentos.estatisticas())
+
+@com_login
+async def estatisticas_admissao(request):
+    return JSONResponse(admissao.estatisticas())
+
+@asynccontextmanager
+async def arranque(app):
+    await criar_indice_ids()
+    iniciar_relay()
+    yield
+
+app = Starlette(lifespan=arranque, routes=[
+    Route("/graphql", graphql_endpoint, methods=["GET", "POST"]),
+    WebSocketRoute("/graphql", graphql_ws_endpoint),
+    Route("/graphql/cache", estatisticas_cache, methods=["GET"]),
+    Route("/graphql/admissao", estatisticas_admissao, methods=["GET"]),
+])
+
 if __name__ == "__main__":
     print("GraphQL server a correr em http://localhost:5001/graphql")
-    
-    # Porta 5001
-    app.run(host="0.0.0.0", port=5001, debug=True)
+
+    # Porta 5001, um processo uvicorn (event loop) por worker
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=5001,
+        workers=int(os.getenv("GRAPHQL_WORKERS", os.cpu_count() or 1))
+    )
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from graphql import parse, validate
+
+
+class ErroPedido(Exception):
+    """Erro que termina o pedido HTTP antes da execução da operação."""
+
+    def __init__(self, status_code, mensagem, codigo=None):
+        super().__init__(mensagem)
+        self.status_code = status_code
+        self.mensagem = mensagem
+        self.codigo = codigo
+
+    def formatar(self):
+        erro = {"message": self.mensagem}
+        if self.codigo:
+            erro["extensions"] = {"code": self.codigo}
+        return {"errors": [erro]}
+
+
+def hash_query(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class DocumentoCacheado:
+    def __init__(self, query, document_ast, erros):
+        self.query = query
+        self.document_ast = document_ast
+        self.erros = erros
+
+
+class CacheDocumentos:
+    """Cache LRU de documentos GraphQL já parsed e validados.
+
+    A chave é o sha256 da query, o mesmo hash usado pelas persisted queries,
+    por isso a mesma cache serve para resolver pedidos que só trazem o hash.
+    """
+
+    def __init__(self, schema, tamanho_maximo=1000):
+        self.schema = schema
+        self.tamanho_maximo = tamanho_maximo
+        self.documentos = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.persistidas_hits = 0
+        self.persistidas_misses = 0
+
+    def _obter(self, chave, persistida=False):
+        """Procura o documento e conta o hit/miss no mesmo lock que o LRU."""
+        with self.lock:
+            documento = self.documentos.get(chave)
+            if documento is not None:
+                self.documentos.move_to_end(chave)
+            if persistida:
+                if documento is None:
+                    self.persistidas_misses += 1
+                else:
+                    self.persistidas_hits += 1
+            elif documento is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return documento
+
+    def _guardar(self, chave, documento):
+        with self.lock:
+            self.documentos[chave] = documento
+            self.documentos.move_to_end(chave)
+            while len(self.documentos) > self.tamanho_maximo:
+                self.documentos.popitem(last=False)
+                self.evictions += 1
+
+    def documento(self, query):
+        """Devolve o documento da query; a GraphQLError de sintaxe propaga-se."""
+        chave = hash_query(query)
+        documento = self._obter(chave)
+        if documento is not None:
+            return documento
+
+        document_ast = parse(query)
+        # Documentos inválidos também ficam em cache para não voltar a validar
+        documento = DocumentoCacheado(query, document_ast, validate(self.schema, document_ast))
+        self._guardar(chave, documento)
+        return documento
+
+    def query_persistida(self, sha256_hash):
+        documento = self._obter(sha256_hash, persistida=True)
+        return documento.query if documento is not None else None
+
+    def estatisticas(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "tamanho": len(self.documentos),
+                "tamanho_maximo": self.tamanho_maximo,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "persistidas_hits": self.persistidas_hits,
+                "persistidas_misses": self.persistidas_misses
+            }
+
+
+# === Automatic Persisted Queries (protocolo Apollo) ===
+def resolver_query_persistida(cache, data):
+    """Devolve a query do pedido, indo buscá-la à cache quando só vem o hash."""
+    query = data.get("query")
+    extensions = data.get("extensions")
+    if not extensions:
+        return query
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise ErroPedido(400, "Extensions are invalid JSON.")
+
+    persistida = extensions.get("persistedQuery")
+    if not persistida:
+        return query
+    if persistida.get("version") != 1:
+        raise ErroPedido(400, "Unsupported persisted query version", "PERSISTED_QUERY_NOT_SUPPORTED")
+
+    sha256_hash = persistida.get("sha256Hash")
+    if query:
+        # Registo: o documento fica em cache sob o hash enviado pelo cliente
+        if hash_query(query) != sha256_hash:
+            raise ErroPedido(400, "provided sha does not match query")
+        return query
+
+    query = cache.query_persistida(sha256_hash)
+    if query is None:
+        # O cliente volta a enviar o pedido com a query completa
+        raise ErroPedido(200, "PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+    return query
@@ -0,0 +1,124 @@
+import asyncio
+import os
+from pymongo.errors import PyMongoError
+
+from outbox import COLECAO_OUTBOX
+
+# Pedir a pre-image nos deletes só funciona em MongoDB >= 6 com
+# changeStreamPreAndPostImages ativo na coleção
+PRE_IMAGES = os.getenv("CHANGE_STREAM_PRE_IMAGES", "0") == "1"
+TAMANHO_FILA = int(os.getenv("GRAPHQL_FILA_SUBSCRICAO", "1000"))
+
+# Marca colocada na fila de um subscritor que ficou para trás
+DESLIGADO = object()
+
+
+def eventos_de_mudanca(mudanca):
+    """Eventos de uma mudança em produtos ou de um evento gravado no outbox; nunca com id nulo."""
+    if mudanca["ns"]["coll"] == COLECAO_OUTBOX:
+        # O delete em produtos só traz o _id: o id do produto vem do evento gravado com a remoção
+        return [{"tipo": "delete", "id": id, "marca": None, "produto": None}
+                for id in mudanca["fullDocument"].get("removidos", [])]
+    produto = mudanca.get("fullDocument") or mudanca.get("fullDocumentBeforeChange")
+    if not produto or produto.get("id") is None:
+        # Update de um produto entretanto removido, ou delete sem pre-image: a remoção chega pelo outbox
+        return []
+    produto = {k: v for k, v in produto.items() if k != "_id"}
+    return [{
+        "tipo": mudanca["operationType"],
+        "id": produto["id"],
+        "marca": produto.get("marca"),
+        "produto": produto if mudanca["operationType"] != "delete" else None
+    }]
+
+
+def pipeline_mudancas(colecao):
+    """As mudanças em produtos e, sem pre-images, os eventos do outbox com produtos removidos."""
+    fontes = [{"ns.coll": colecao.name, "operationType": {"$in": ["insert", "update", "replace", "delete"]}}]
+    if not PRE_IMAGES:
+        fontes.append({
+            "ns.coll": COLECAO_OUTBOX, "operationType": "insert", "fullDocument.removidos.0": {"$exists": True}
+        })
+    return [{"$match": {"$or": fontes}}]
+
+
+class Difusor:
+    """Fonte única de alterações por processo, distribuída por todos os subscritores.
+
+    A fonte é um change stream da base de dados (produtos e outbox), que vê
+    as escritas dos quatro servidores. Se o MongoDB não suportar change
+    streams (instância isolada, sem replica set), as mutations GraphQL deste
+    processo publicam diretamente.
+    """
+
+    def __init__(self, colecao):
+        self.colecao = colecao
+        self.subscritores = set()
+        # Funções chamadas com cada evento, além das subscrições (ex.: vocabulário de pesquisa)
+        self.ouvintes = []
+        self.tarefa = None
+        self.change_stream_ativo = False
+        self.change_stream_indisponivel = False
+
+    def iniciar(self):
+        if self.change_stream_indisponivel:
+            return
+        if self.tarefa is None or self.tarefa.done():
+            self.tarefa = asyncio.get_running_loop().create_task(self._seguir_change_stream())
+
+    async def _seguir_change_stream(self):
+        opcoes = {"full_document": "updateLookup"}
+        if PRE_IMAGES:
+            opcoes["full_document_before_change"] = "whenAvailable"
+        try:
+            async with self.colecao.database.watch(pipeline_mudancas(self.colecao), **opcoes) as stream:
+                self.change_stream_ativo = True
+                print("[Subscrições] A seguir o change stream de produtos")
+                async for mudanca in stream:
+                    for evento in eventos_de_mudanca(mudanca):
+                        self.publicar(evento)
+        except PyMongoError as e:
+            # Falhar logo à partida significa que o servidor não suporta change streams;
+            # uma falha a meio volta a ser tentada na próxima subscrição
+            if not self.change_stream_ativo:
+                self.change_stream_indisponivel = True
+            print(f"[Subscrições] Change stream indisponível, só alterações locais: {e}")
+        finally:
+            self.change_stream_ativo = False
+
+    def publicar(self, evento):
+        for ouvinte in self.ouvintes:
+            ouvinte(evento)
+        for fila in list(self.subscritores):
+            try:
+                fila.put_nowait(evento)
+            except asyncio.QueueFull:
+                # Um cliente lento não pode fazer crescer a memória sem limite
+                self.subscritores.discard(fila)
+                fila.get_nowait()
+                fila.put_nowait(DESLIGADO)
+
+    def publicar_local(self, tipo, id, produto=None):
+        # Com o change stream ativo a alteração já chega por lá
+        if self.change_stream_ativo:
+            return
+        self.publicar({
+            "tipo": tipo,
+            "id": id,
+            "marca": produto.get("marca") if produto else None,
+            "produto": produto
+        })
+
+    async def subscrever(self, filtro):
+        self.iniciar()
+        fila = asyncio.Queue(maxsize=TAMANHO_FILA)
+        self.subscritores.add(fila)
+        try:
+            while True:
+                evento = await fila.get()
+                if evento is DESLIGADO:
+                    raise Exception("Subscrição terminada: cliente demasiado lento")
+                if filtro(evento):
+                    yield evento
+        finally:
+            self.subscritores.discard(fila)
@@ -0,0 +1,191 @@
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# Cópia partilhada com servera/rest/estatisticas.py (cada serviço tem o seu contexto Docker)
+
+# Coleção materializada com uma linha por marca
+COLECAO_ESTATISTICAS = "estatisticas_marca"
+# Arrendamento de quem agrega e escritas por agregar vistas pelos outros processos
+COLECAO_CONTROLO = "estatisticas_controlo"
+CONTROLO = "agregador"
+
+
+def pipeline_estatisticas(limiar_stock_baixo, atualizado_em):
+    """Agrega os produtos por marca e grava o resultado com $merge.
+
+    A data vem do servidor da aplicação (não $$NOW) para que as marcas que
+    deixaram de existir possam ser apagadas com o mesmo valor. Uma linha só
+    é substituída por outra mais recente: se duas agregações se sobrepõem
+    (arrendamento perdido a meio), o delete de filtro_obsoletas de uma não
+    apaga as linhas que a outra acabou de gravar.
+    """
+    return [
+        {"$group": {
+            "_id": "$marca",
+            "produtos": {"$sum": 1},
+            "stock_total": {"$sum": "$stock"},
+            "preco_min": {"$min": "$preco"},
+            "preco_medio": {"$avg": "$preco"},
+            "preco_max": {"$max": "$preco"},
+            "stock_baixo": {"$sum": {"$cond": [{"$lte": ["$stock", limiar_stock_baixo]}, 1, 0]}}
+        }},
+        {"$set": {"marca": "$_id", "limiar_stock_baixo": limiar_stock_baixo, "atualizado_em": atualizado_em}},
+        {"$merge": {
+            "into": COLECAO_ESTATISTICAS,
+            "whenMatched": [{"$replaceWith": {
+                "$cond": [{"$gte": ["$$new.atualizado_em", "$atualizado_em"]}, "$$new", "$$ROOT"]
+            }}],
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+
+def filtro_obsoletas(atualizado_em):
+    return {"atualizado_em": {"$lt": atualizado_em}}
+
+
+def totais(marcas):
+    """Totais do catálogo calculados a partir das linhas por marca, sem tocar nos produtos."""
+    produtos = sum(m["produtos"] for m in marcas)
+    precos_min = [m["preco_min"] for m in marcas if m.get("preco_min") is not None]
+    precos_max = [m["preco_max"] for m in marcas if m.get("preco_max") is not None]
+    return {
+        "marcas": len(marcas),
+        "produtos": produtos,
+        "stock_total": sum(m["stock_total"] for m in marcas),
+        "preco_min": min(precos_min) if precos_min else None,
+        "preco_medio": sum(m["preco_medio"] * m["produtos"] for m in marcas if m.get("preco_medio") is not None) / produtos
+        if produtos else None,
+        "preco_max": max(precos_max) if precos_max else None,
+        "stock_baixo": sum(m["stock_baixo"] for m in marcas)
+    }
+
+
+class EstadoEstatisticas:
+    """Quando refazer a agregação: depois de escritas (agrupadas) ou quando fica velha.
+
+    marcar() é chamado em cada escrita; o ciclo de atualização junta todas
+    as escritas de um intervalo numa só agregação. `idade_maxima` apanha as
+    escritas de outros servidores quando não há change stream.
+    """
+
+    def __init__(self, idade_maxima):
+        self.idade_maxima = idade_maxima
+        self.suja = True
+        self.atualizada_em = None
+
+    def marcar(self):
+        self.suja = True
+
+    def precisa_atualizar(self):
+        return self.suja or self.atualizada_em is None or time.monotonic() - self.atualizada_em > self.idade_maxima
+
+    def iniciar_atualizacao(self):
+        # Limpa antes de agregar: uma escrita durante a agregação volta a sujar
+        self.suja = False
+        return datetime.now(timezone.utc)
+
+    def concluir_atualizacao(self):
+        self.atualizada_em = time.monotonic()
+
+
+class Agregador:
+    """Escolhe um só processo, entre todos os servidores REST e GraphQL, para refazer a agregação.
+
+    Cada processo corre ciclo() a cada intervalo. Quem tem o arrendamento
+    (renovado no documento de controlo, como o dos relays do outbox) agrega
+    quando o seu EstadoEstatisticas o pede; os outros não agregam e só
+    deixam no controlo a marca `suja` quando viram escritas, que o líder
+    apanha ao renovar o arrendamento. Assim há uma agregação por intervalo
+    no sistema inteiro, e não uma por processo.
+    """
+
+    def __init__(self, controlo, estado, arrendamento=10.0):
+        self.controlo = controlo
+        self.estado = estado
+        self.arrendamento = arrendamento
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lider = False
+        self.ja_agregado = False
+
+    @classmethod
+    def do_ambiente(cls, db, estado):
+        """ESTATISTICAS_ARRENDAMENTO: segundos de liderança sem renovar."""
+        return cls(db[COLECAO_CONTROLO], estado, float(os.getenv("ESTATISTICAS_ARRENDAMENTO", "10")))
+
+    def _liderar(self):
+        agora = datetime.now(timezone.utc)
+        # A renovação limpa a marca `suja`; o documento anterior diz se estava posta
+        return (
+            {"_id": CONTROLO, "$or": [{"ate": {"$lt": agora}}, {"dono": self.dono}]},
+            {"$set": {"dono": self.dono, "ate": agora + timedelta(seconds=self.arrendamento), "suja": False}}
+        )
+
+    def _liderou(self, anterior):
+        self.lider = True
+        if anterior is None or anterior.get("suja"):
+            self.estado.marcar()
+        return self.estado.precisa_atualizar()
+
+    def _passar_escritas(self):
+        # Limpa antes de gravar: uma escrita entretanto volta a sujar
+        self.lider = False
+        suja, self.estado.suja = self.estado.suja, False
+        return suja
+
+    # === Servidores síncronos (pymongo) ===
+    def ciclo(self, agregar):
+        """Agrega com agregar() se este processo for o líder e houver motivo; senão passa as escritas ao líder."""
+        filtro, atualizacao = self._liderar()
+        try:
+            anterior = self.controlo.find_one_and_update(filtro, atualizacao, upsert=True)
+        except DuplicateKeyError:
+            if self._passar_escritas():
+                try:
+                    self.controlo.update_one({"_id": CONTROLO}, {"$set": {"suja": True}})
+                except PyMongoError:
+                    self.estado.marcar()
+                    raise
+            return
+        if self._liderou(anterior):
+            agregar()
+            self.controlo.update_one({"_id": CONTROLO}, {"$set": {"agregado_em": datetime.now(timezone.utc)}})
+
+    def agregado(self):
+        """False enquanto nenhum processo tiver agregado (coleção materializada ainda por preencher)."""
+        if not self.ja_agregado:
+            self.ja_agregado = self.controlo.find_one({"_id": CONTROLO, "agregado_em": {"$ne": None}}) is not None
+        return self.ja_agregado
+
+    # === Servidor assíncrono (Motor) ===
+    async def ciclo_async(self, agregar):
+        """Como ciclo(), com `agregar` uma função async."""
+        filtro, atualizacao = self._liderar()
+        try:
+            anterior = await self.controlo.find_one_and_update(filtro, atualizacao, upsert=True)
+        except DuplicateKeyError:
+            if self._passar_escritas():
+                try:
+                    await self.controlo.update_one({"_id": CONTROLO}, {"$set": {"suja": True}})
+                except PyMongoError:
+                    self.estado.marcar()
+                    raise
+            return
+        if self._liderou(anterior):
+            await agregar()
+            await self.controlo.update_one({"_id": CONTROLO}, {"$set": {"agregado_em": datetime.now(timezone.utc)}})
+
+    async def agregado_async(self):
+        if not self.ja_agregado:
+            documento = await self.controlo.find_one({"_id": CONTROLO, "agregado_em": {"$ne": None}})
+            self.ja_agregado = documento is not None
+        return self.ja_agregado
+
+
+def linha_publica(linha):
+    return {k: v for k, v in linha.items() if k not in ("_id", "atualizado_em")}
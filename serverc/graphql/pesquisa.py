@@ -0,0 +1,126 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+# Cópia partilhada com servera/rest/pesquisa.py (cada serviço tem o seu contexto Docker)
+
+# === Índice de texto do MongoDB ===
+# Só pode existir um índice de texto por coleção; com default_language "none"
+# não há stemming nem stop words, e a versão 3 ignora acentos e maiúsculas
+CAMPOS_TEXTO = ["nome", "marca", "caracteristicas.tela", "caracteristicas.bateria", "caracteristicas.armazenamento"]
+ESPEC_INDICE = [(campo, "text") for campo in CAMPOS_TEXTO]
+OPCOES_INDICE = {
+    "name": "pesquisa_texto",
+    "weights": {"nome": 10, "marca": 5},
+    "default_language": "none"
+}
+
+# Prefixos mais curtos dariam demasiadas sugestões para serem úteis
+PREFIXO_MINIMO = 2
+# Termos considerados por prefixo antes de ordenar por frequência
+CANDIDATOS_MAXIMOS = 2000
+
+
+def normalizar(texto):
+    decomposto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def tokens(texto):
+    return re.findall(r"\w+", normalizar(texto))
+
+
+def valor(produto, campo):
+    for parte in campo.split("."):
+        if not isinstance(produto, dict):
+            return None
+        produto = produto.get(parte)
+    return produto
+
+
+def termos_produto(produto):
+    """Termos de um produto para o vocabulário; números soltos (ids, "128") não sugerem nada."""
+    termos = set()
+    for campo in CAMPOS_TEXTO:
+        texto = valor(produto, campo)
+        if isinstance(texto, str):
+            termos.update(t for t in tokens(texto) if not t.isdigit())
+    return termos
+
+
+def consulta_texto(termos):
+    """Filtro $text para uma lista de termos (o $text faz OU entre eles)."""
+    return {"$text": {"$search": " ".join(termos)}}
+
+
+PROJECAO_RELEVANCIA = {"_id": 0, "relevancia": {"$meta": "textScore"}}
+ORDEM_RELEVANCIA = [("relevancia", {"$meta": "textScore"})]
+
+
+class Vocabulario:
+    """Termos do catálogo, ordenados, para completar prefixos por pesquisa binária.
+
+    Guarda só os termos distintos e quantos produtos os usam, não os produtos,
+    por isso cresce com o vocabulário e não com o catálogo. Entre
+    reconstruções só lhe são acrescentados os produtos criados: sem os termos
+    antigos de cada produto, uma edição contaria os termos outra vez. Edições
+    e remoções ficam para a reconstrução periódica.
+    """
+
+    def __init__(self):
+        self.frequencias = Counter()
+        self.ordenados = []
+        self.lock = threading.Lock()
+        self.construido_em = None
+
+    def adicionar(self, produto):
+        """Conta os termos de um produto novo (nunca de uma edição)."""
+        with self.lock:
+            for termo in termos_produto(produto):
+                if termo not in self.frequencias:
+                    bisect.insort(self.ordenados, termo)
+                self.frequencias[termo] += 1
+
+    def substituir(self, frequencias):
+        ordenados = sorted(frequencias)
+        with self.lock:
+            self.frequencias = frequencias
+            self.ordenados = ordenados
+            self.construido_em = time.monotonic()
+
+    def desatualizado(self, intervalo):
+        return self.construido_em is None or time.monotonic() - self.construido_em > intervalo
+
+    def completar(self, prefixo, limite=5):
+        prefixo = normalizar(prefixo)
+        if len(prefixo) < PREFIXO_MINIMO:
+            return []
+        with self.lock:
+            inicio = bisect.bisect_left(self.ordenados, prefixo)
+            candidatos = []
+            for termo in self.ordenados[inicio:inicio + CANDIDATOS_MAXIMOS]:
+                if not termo.startswith(prefixo):
+                    break
+                candidatos.append((self.frequencias[termo], termo))
+        candidatos.sort(key=lambda c: (-c[0], c[1]))
+        return [termo for _, termo in candidatos[:limite]]
+
+
+def contar_termos(produtos):
+    frequencias = Counter()
+    for produto in produtos:
+        frequencias.update(termos_produto(produto))
+    return frequencias
+
+
+def termos_pesquisa(vocabulario, texto, autocompletar, sugestoes=5):
+    """Termos para o $text e as sugestões usadas para completar a última palavra."""
+    termos = tokens(texto)
+    if not autocompletar or not termos:
+        return termos, []
+    completados = vocabulario.completar(termos[-1], sugestoes)
+    # Sem sugestões (vocabulário ainda vazio, prefixo curto) pesquisa-se a palavra como está
+    return termos[:-1] + (completados or termos[-1:]), completados
@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+from graphql import GraphQLError, execute, subscribe, get_operation_ast
+from graphql.language import OperationType
+from inspect import isawaitable
+from starlette.datastructures import Headers
+from starlette.websockets import WebSocketDisconnect
+from cache_documentos import ErroPedido, resolver_query_persistida
+
+# graphql-transport-ws é o protocolo atual (biblioteca graphql-ws);
+# graphql-ws é o protocolo antigo do subscriptions-transport-ws, ainda usado por muitos clientes
+PROTOCOLO_NOVO = "graphql-transport-ws"
+PROTOCOLO_ANTIGO = "graphql-ws"
+TEMPO_CONNECTION_INIT = 10
+
+
+def headers_ligacao(websocket, payload):
+    """Headers do handshake completados com o payload do connection_init (ex.: Authorization)."""
+    headers = dict(websocket.headers)
+    for chave, valor in (payload or {}).items():
+        if isinstance(valor, str):
+            headers[chave.lower()] = valor
+    return Headers(headers=headers)
+
+
+class ContextoWebSocket:
+    """Contexto de uma operação da ligação, só com os headers da ligação.
+
+    Um por operação, como um pedido HTTP: o DataLoader e o JWT verificado
+    (incluindo o `exp`) não duram o tempo de vida do socket.
+    """
+
+    def __init__(self, websocket, headers):
+        self.headers = headers
+        self.websocket = websocket
+
+
+class LigacaoGraphQLWS:
+    def __init__(self, websocket, schema, cache_documentos, admitir=None, rastreador=None):
+        self.websocket = websocket
+        self.schema = schema
+        # admitir(contexto, documento, operation_name, variaveis) -> bilhete, antes de cada query ou mutation
+        self.admitir = admitir
+        self.rastreador = rastreador
+        self.cache_documentos = cache_documentos
+        self.operacoes = {}
+        self.protocolo = None
+        self.headers = None
+
+    def _tipo(self, novo, antigo):
+        return novo if self.protocolo == PROTOCOLO_NOVO else antigo
+
+    async def enviar(self, mensagem):
+        await self.websocket.send_json(mensagem)
+
+    async def enviar_erro(self, id, erros):
+        if self.protocolo == PROTOCOLO_NOVO:
+            await self.enviar({"type": "error", "id": id, "payload": [e.formatted for e in erros]})
+        else:
+            await self.enviar({"type": "error", "id": id, "payload": erros[0].formatted})
+
+    async def enviar_resultado(self, id, resultado):
+        await self.enviar({"type": self._tipo("next", "data"), "id": id, "payload": resultado.formatted})
+
+    async def correr(self):
+        pedidos = self.websocket.scope.get("subprotocols", [])
+        if PROTOCOLO_NOVO in pedidos:
+            self.protocolo = PROTOCOLO_NOVO
+        elif PROTOCOLO_ANTIGO in pedidos:
+            self.protocolo = PROTOCOLO_ANTIGO
+        else:
+            await self.websocket.close(code=4406)
+            return
+        await self.websocket.accept(subprotocol=self.protocolo)
+
+        try:
+            mensagem = await asyncio.wait_for(self.websocket.receive_json(), TEMPO_CONNECTION_INIT)
+            if mensagem.get("type") != "connection_init":
+                await self.websocket.close(code=4400)
+                return
+            self.headers = headers_ligacao(self.websocket, mensagem.get("payload"))
+            await self.enviar({"type": "connection_ack"})
+            if self.protocolo == PROTOCOLO_ANTIGO:
+                await self.enviar({"type": "ka"})
+
+            while True:
+                mensagem = await self.websocket.receive_json()
+                tipo = mensagem.get("type")
+                if tipo in ("subscribe", "start"):
+                    await self.iniciar_operacao(mensagem.get("id"), mensagem.get("payload") or {})
+                elif tipo in ("complete", "stop"):
+                    self.parar_operacao(mensagem.get("id"))
+                elif tipo == "ping":
+                    await self.enviar({"type": "pong"})
+                elif tipo == "connection_terminate":
+                    break
+        except (WebSocketDisconnect, asyncio.TimeoutError):
+            pass
+        finally:
+            for id in list(self.operacoes):
+                self.parar_operacao(id)
+
+    async def iniciar_operacao(self, id, payload):
+        if id in self.operacoes:
+            await self.websocket.close(code=4409)
+            return
+        try:
+            query = resolver_query_persistida(self.cache_documentos, payload)
+            if not query:
+                raise ErroPedido(400, "Must provide query string.")
+            documento = self.cache_documentos.documento(query)
+        except ErroPedido as e:
+            await self.enviar_erro(id, [GraphQLError(e.mensagem)])
+            return
+        except GraphQLError as e:
+            await self.enviar_erro(id, [e])
+            return
+        if documento.erros:
+            await self.enviar_erro(id, documento.erros)
+            return
+
+        self.operacoes[id] = asyncio.get_running_loop().create_task(
+            self.executar_operacao(id, documento, payload)
+        )
+
+    async def executar_rastreado(self, contexto, documento, operation_name, argumentos):
+        """Query ou mutation pela ligação; o traceparent vem dos headers do handshake.
+
+        As subscriptions não têm span: ficam abertas enquanto a ligação durar.
+        """
+        if self.rastreador is None:
+            pedido = contextlib.nullcontext()
+        else:
+            pedido = self.rastreador.pedido(
+                f"GraphQL {operation_name}" if operation_name else "GraphQL",
+                self.headers.get("traceparent"),
+                **{"graphql.transporte": "websocket"}
+            )
+        with pedido:
+            bilhete = contextlib.nullcontext()
+            if self.admitir is not None:
+                bilhete = await self.admitir(
+                    contexto, documento.document_ast, operation_name, argumentos["variable_values"]
+                )
+            with bilhete:
+                resultado = execute(self.schema, documento.document_ast, **argumentos)
+                if isawaitable(resultado):
+                    resultado = await resultado
+            return resultado
+
+    async def executar_operacao(self, id, documento, payload):
+        operation_name = payload.get("operationName")
+        contexto = ContextoWebSocket(self.websocket, self.headers)
+        argumentos = dict(
+            context_value=contexto,
+            variable_values=payload.get("variables"),
+            operation_name=operation_name
+        )
+        operacao = get_operation_ast(documento.document_ast, operation_name)
+        try:
+            if operacao and operacao.operation == OperationType.SUBSCRIPTION:
+                resultado = await subscribe(self.schema, documento.document_ast, **argumentos)
+                if hasattr(resultado, "__aiter__"):
+                    try:
+                        async for evento in resultado:
+                            await self.enviar_resultado(id, evento)
+                    finally:
+                        await resultado.aclose()
+                elif resultado.errors:
+                    await self.enviar_erro(id, resultado.errors)
+                    return
+            else:
+                resultado = await self.executar_rastreado(contexto, documento, operation_name, argumentos)
+                await self.enviar_resultado(id, resultado)
+            await self.enviar({"type": "complete", "id": id})
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            # Erros da fonte de eventos (ex.: token inválido) terminam só esta operação
+            erro = e if isinstance(e, GraphQLError) else GraphQLError(str(e))
+            await self.enviar_erro(id, [erro])
+        finally:
+            self.operacoes.pop(id, None)
+
+    def parar_operacao(self, id):
+        tarefa = self.operacoes.pop(id, None)
+        if tarefa:
+            tarefa.cancel()
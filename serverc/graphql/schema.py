@@ -1,6 +1,8 @@
 import graphene
-from pymongo import MongoClient
-from jsonschema import validate, ValidationError
+from motor.motor_asyncio import AsyncIOMotorClient
+from jsonschema import validate, ValidationError, Draft7Validator
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError, PyMongoError, OperationFailure
 import json
 import os
 from jose import jwt
@@ -9,20 +11,156 @@ from jose.utils import base64url_decode
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
 import requests
+import base64
+import re
+from aiodataloader import DataLoader
+from difusor import Difusor
+from pesquisa import (Vocabulario, ESPEC_INDICE, OPCOES_INDICE, PROJECAO_RELEVANCIA, ORDEM_RELEVANCIA,
+                      termos_produto, consulta_texto, termos_pesquisa)
+from estatisticas import (COLECAO_ESTATISTICAS, EstadoEstatisticas, Agregador, pipeline_estatisticas,
+                          filtro_obsoletas, totais, linha_publica)
+from admissao import ControloAdmissao, Recusado, BILHETE_NULO
+from rastreio import Rastreador
+from ligacao import LigacaoMongo
+from outbox import Outbox, Relay, DestinoRabbitMQ, evento, eventos_lote
+from versoes import primeira_versao, nova_versao
+from collections import Counter
+from graphql import GraphQLError, get_operation_ast
+from graphql.language import (OperationType, FieldNode, InlineFragmentNode, FragmentSpreadNode,
+                              FragmentDefinitionNode, VariableNode, NullValueNode)
+import asyncio
+import threading
+
+# === Rastreio de pedidos (RASTREIO_FICHEIRO ou RASTREIO_OTLP_URL) ===
+rastreador = Rastreador.do_ambiente("graphql")
+# Span para a validação dos produtos, só em pedidos amostrados
+validate = rastreador.rastrear("validar_schema")(validate)
 
 # === MongoDB Connection ===
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://192.168.2.110:27017")
-client = MongoClient(MONGO_URL)
-db = client["catalogo"]
+# O Motor corre o pymongo num executor com o contexto copiado, por isso os
+# spans dos comandos ficam debaixo do pedido certo
+ligacao = LigacaoMongo.do_ambiente(rastreador, "mongodb://192.168.2.110:27017", AsyncIOMotorClient)
+client = ligacao.client
+db = ligacao.db
 colecao = db["produtos"]
+# produtos, pesquisar e o vocabulário podem ler dos secundários; o loader por
+# id fica no primário para as mutações verem o que acabaram de escrever
+colecao_leituras = ligacao.leituras(colecao)
+
+async def criar_indice_ids():
+    # Garante no servidor um produto por id, também entre escritas concorrentes de serviços diferentes
+    try:
+        await colecao.create_index("id", unique=True)
+    except OperationFailure as e:
+        print(f"Não foi possível criar o índice único de 'id' (ids repetidos na coleção?): {e}")
+
+# Fonte única de alterações deste processo para as subscrições
+difusor = Difusor(colecao)
+
+# === Eventos de alteração (outbox gravado na mesma transação que a escrita) ===
+# Publicados pelo Seguidor do REST (Socket.IO) e pelo relay RabbitMQ dos quatro servidores
+outbox = Outbox.do_ambiente(db, "graphql", rastreador)
+
+# O relay é síncrono (pymongo e pika): corre numa thread com a sua própria ligação,
+# e só o que tem o arrendamento (de todos os workers e servidores) publica
+relay_rabbitmq = Relay.do_ambiente(
+    LigacaoMongo.do_ambiente(rastreador, "mongodb://192.168.2.110:27017").db,
+    DestinoRabbitMQ.do_ambiente(rastreador),
+    rastreador
+)
+outbox.ouvintes.append(relay_rabbitmq.acordar)
+
+def iniciar_relay():
+    # Os índices também são criados na thread, para não bloquear o event loop
+    def correr():
+        relay_rabbitmq.criar_indices()
+        relay_rabbitmq.correr()
+    threading.Thread(target=correr, daemon=True).start()
+
+def utilizador(payload):
+    return payload.get("preferred_username", "desconhecido")
+
+# === Pesquisa de texto e autocompletar ===
+vocabulario = Vocabulario()
+INTERVALO_VOCABULARIO = float(os.getenv("GRAPHQL_VOCABULARIO_INTERVALO", "300"))
+PESQUISA_LIMITE_MAXIMO = 100
+_tarefa_vocabulario = None
+
+def _ouvir_alteracao(evento):
+    # Edições e remoções ficam para a reconstrução periódica
+    if evento["tipo"] == "insert" and evento.get("produto"):
+        vocabulario.adicionar(evento["produto"])
+
+difusor.ouvintes.append(_ouvir_alteracao)
+
+async def _reconstruir_vocabulario():
+    try:
+        await colecao.create_index(ESPEC_INDICE, **OPCOES_INDICE)
+    except PyMongoError as e:
+        print(f"[Pesquisa] Não foi possível criar o índice de texto: {e}")
+    try:
+        frequencias = Counter()
+        # Percorre o cursor em vez de carregar o catálogo inteiro em memória
+        async for produto in colecao_leituras.find({}, {"_id": 0, "nome": 1, "marca": 1, "caracteristicas": 1}):
+            frequencias.update(termos_produto(produto))
+        vocabulario.substituir(frequencias)
+        print(f"[Pesquisa] Vocabulário com {len(vocabulario.frequencias)} termos")
+    except PyMongoError as e:
+        print(f"[Pesquisa] Erro ao construir o vocabulário: {e}")
+
+def iniciar_pesquisa():
+    """Reconstrói o vocabulário em segundo plano quando está desatualizado."""
+    global _tarefa_vocabulario
+    # O change stream do difusor mantém o vocabulário entre reconstruções
+    difusor.iniciar()
+    if vocabulario.desatualizado(INTERVALO_VOCABULARIO) and (_tarefa_vocabulario is None or _tarefa_vocabulario.done()):
+        _tarefa_vocabulario = asyncio.get_running_loop().create_task(_reconstruir_vocabulario())
+
+# === Estatísticas por marca (coleção materializada) ===
+colecao_estatisticas = db[COLECAO_ESTATISTICAS]
+estado_estatisticas = EstadoEstatisticas(float(os.getenv("ESTATISTICAS_IDADE_MAXIMA", "60")))
+# Só um processo (REST ou GraphQL, de todos os workers) agrega de cada vez
+agregador = Agregador.do_ambiente(db, estado_estatisticas)
+INTERVALO_ESTATISTICAS = float(os.getenv("ESTATISTICAS_INTERVALO", "2"))
+LIMIAR_STOCK_BAIXO = int(os.getenv("ESTATISTICAS_STOCK_BAIXO", "5"))
+_tarefa_estatisticas = None
+
+difusor.ouvintes.append(lambda evento: estado_estatisticas.marcar())
+
+async def atualizar_estatisticas():
+    atualizado_em = estado_estatisticas.iniciar_atualizacao()
+    try:
+        await colecao.aggregate(pipeline_estatisticas(LIMIAR_STOCK_BAIXO, atualizado_em)).to_list(length=None)
+        # Marcas sem produtos não aparecem no $group: apagar as que ficaram por atualizar
+        await colecao_estatisticas.delete_many(filtro_obsoletas(atualizado_em))
+    except PyMongoError:
+        estado_estatisticas.marcar()
+        raise
+    estado_estatisticas.concluir_atualizacao()
+
+async def _manter_estatisticas():
+    while True:
+        try:
+            await agregador.ciclo_async(atualizar_estatisticas)
+        except PyMongoError as e:
+            print(f"[Estatísticas] Erro ao atualizar: {e}")
+        await asyncio.sleep(INTERVALO_ESTATISTICAS)
+
+def iniciar_estatisticas():
+    global _tarefa_estatisticas
+    difusor.iniciar()
+    if _tarefa_estatisticas is None or _tarefa_estatisticas.done():
+        _tarefa_estatisticas = asyncio.get_running_loop().create_task(_manter_estatisticas())
 
 # === JSON Schema ===
 with open("schema.json") as f:
     schema_json = json.load(f)
+# Validador compilado uma vez para as mutations em lote
+validador = Draft7Validator(schema_json)
 
 # === Keycloak Config ===
 KEYCLOAK_REALM = "catalogo-produtos"
-KEYCLOAK_URL = "http://192.168.2.122:8080"
+KEYCLOAK_URL = os.getenv("KEYCLOAK_URL", "http://192.168.2.122:8080")
 KEYCLOAK_ISSUER = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}"
 JWKS_URL = f"{KEYCLOAK_ISSUER}/protocol/openid-connect/certs"
 jwks = requests.get(JWKS_URL).json()
@@ -36,6 +174,7 @@ def jwk_to_rsa_key(jwk):
     )
     return public_numbers.public_key(backend=default_backend())
 
+@rastreador.rastrear("validar_token")
 def validar_token(token):
     try:
         header = jwt.get_unverified_header(token)
@@ -55,12 +194,82 @@ def validar_token(token):
         print(f"[JWT inválido] {e}")
         return None
 
-def extrair_token(info):
-    auth = info.context.headers.get("Authorization")
+def payload_jwt(contexto):
+    # O token é verificado uma única vez por pedido, mesmo com vários campos
+    if hasattr(contexto, "jwt_payload"):
+        return contexto.jwt_payload
+    auth = contexto.headers.get("Authorization")
     if not auth or not auth.startswith("Bearer "):
-        return None
-    token = auth.replace("Bearer ", "")
-    return validar_token(token)
+        payload = None
+    else:
+        payload = validar_token(auth.replace("Bearer ", ""))
+    contexto.jwt_payload = payload
+    return payload
+
+def extrair_token(info):
+    return payload_jwt(info.context)
+
+# === Controlo de admissão (taxa por utilizador e vagas por operação) ===
+# `produtos` sem `first` e as mutations em lote tocam no catálogo inteiro
+admissao = ControloAdmissao.do_ambiente(
+    pesadas=("produtos", "adicionarProdutos", "editarProdutos", "removerProdutos")
+)
+
+def _campos_de_topo(selecoes, fragmentos):
+    for selecao in selecoes:
+        if isinstance(selecao, FieldNode):
+            yield selecao
+        elif isinstance(selecao, InlineFragmentNode):
+            yield from _campos_de_topo(selecao.selection_set.selections, fragmentos)
+        elif isinstance(selecao, FragmentSpreadNode) and selecao.name.value in fragmentos:
+            yield from _campos_de_topo(fragmentos[selecao.name.value].selection_set.selections, fragmentos)
+
+def _limitado(campo, variaveis):
+    for argumento in campo.arguments:
+        if argumento.name.value == "first":
+            if isinstance(argumento.value, VariableNode):
+                return variaveis.get(argumento.value.name.value) is not None
+            return not isinstance(argumento.value, NullValueNode)
+    return False
+
+def operacao_admissao(documento, operacao, variaveis):
+    """Nome com que a operação é admitida: o do seu campo de topo mais caro, ou None se só tiver introspeção."""
+    fragmentos = {d.name.value: d for d in documento.definitions if isinstance(d, FragmentDefinitionNode)}
+    nomes = []
+    for campo in _campos_de_topo(operacao.selection_set.selections, fragmentos):
+        nome = campo.name.value
+        if nome.startswith("__"):
+            continue
+        # Com `first` a listagem é limitada e conta como uma operação normal
+        if nome == "produtos" and _limitado(campo, variaveis or {}):
+            nome = "produtos(first)"
+        nomes.append(nome)
+    return max(nomes, key=lambda nome: admissao.custos.get(nome, 1), default=None)
+
+async def admitir(contexto, documento, operation_name, variaveis):
+    """Admite uma query ou mutation inteira antes de a executar; devolve o bilhete a libertar no fim.
+
+    Uma operação paga uma vez, pelo campo de topo mais caro: vários campos
+    (ou aliases de `produto`, que o DataLoader junta numa só leitura) não
+    ocupam várias vagas. As subscriptions não entram: a ligação fica
+    aberta, mas só consome quando há alterações. Sem token válido passa, e
+    os resolvers respondem com o erro de autenticação.
+    """
+    operacao = get_operation_ast(documento, operation_name)
+    if operacao is None or operacao.operation == OperationType.SUBSCRIPTION:
+        return BILHETE_NULO
+    nome = operacao_admissao(documento, operacao, variaveis)
+    payload = payload_jwt(contexto)
+    if nome is None or not payload:
+        return BILHETE_NULO
+    try:
+        with rastreador.span("admissao", operacao=nome):
+            return await admissao.entrar_async(payload.get("preferred_username", "desconhecido"), nome)
+    except Recusado as e:
+        raise GraphQLError(e.mensagem, extensions={
+            "codigo": "LIMITE_EXCEDIDO" if e.motivo == "limite" else "SOBRECARGA",
+            "repetir_apos": round(e.repetir_apos, 3)
+        })
 
 # === GraphQL Tipos ===
 class CaracteristicasType(graphene.ObjectType):
@@ -75,15 +284,243 @@ class ProdutoType(graphene.ObjectType):
     preco = graphene.Float()
     stock = graphene.Int()
     caracteristicas = graphene.Field(CaracteristicasType)
+    cursor = graphene.String()
+    relevancia = graphene.Float(description="Só preenchido em pesquisar")
+
+    def resolve_cursor(root, info):
+        return root.get("_cursor")
+
+class EstatisticaMarcaType(graphene.ObjectType):
+    marca = graphene.String()
+    produtos = graphene.Int()
+    stock_total = graphene.Int()
+    preco_min = graphene.Float()
+    preco_medio = graphene.Float()
+    preco_max = graphene.Float()
+    stock_baixo = graphene.Int()
+
+class EstatisticasType(graphene.ObjectType):
+    totais = graphene.Field(EstatisticaMarcaType)
+    marcas = graphene.List(EstatisticaMarcaType)
+
+# === Filtros, ordenação e paginação ===
+class CampoOrdenacao(graphene.Enum):
+    ID = "id"
+    NOME = "nome"
+    MARCA = "marca"
+    PRECO = "preco"
+    STOCK = "stock"
+
+class Ordem(graphene.Enum):
+    ASC = 1
+    DESC = -1
+
+class FiltroProdutos(graphene.InputObjectType):
+    ids = graphene.List(graphene.NonNull(graphene.Int))
+    nome = graphene.String()
+    marca = graphene.String()
+    preco_min = graphene.Float()
+    preco_max = graphene.Float()
+    stock_min = graphene.Int()
+    stock_max = graphene.Int()
+
+# Campos GraphQL de ProdutoType -> caminho no documento MongoDB
+CAMPOS_MONGO = {
+    "id": "id",
+    "nome": "nome",
+    "marca": "marca",
+    "preco": "preco",
+    "stock": "stock",
+    "caracteristicas": "caracteristicas",
+}
+
+def _selecoes(info):
+    for no in info.field_nodes:
+        if no.selection_set:
+            yield from _expandir(no.selection_set.selections, info)
+
+def _expandir(selecoes, info):
+    for sel in selecoes:
+        tipo = type(sel).__name__
+        if tipo == "FragmentSpreadNode":
+            yield from _expandir(info.fragments[sel.name.value].selection_set.selections, info)
+        elif tipo == "InlineFragmentNode":
+            yield from _expandir(sel.selection_set.selections, info)
+        else:
+            yield sel
+
+def projecao_selecionada(info):
+    """Constrói a projeção MongoDB a partir dos campos pedidos na query."""
+    projecao = {"_id": 0}
+    for sel in _selecoes(info):
+        nome = sel.name.value
+        if nome == "cursor":
+            projecao["id"] = 1
+        elif nome == "caracteristicas" and sel.selection_set:
+            subcampos = [sub.name.value for sub in _expandir(sel.selection_set.selections, info)
+                         if sub.name.value != "__typename"]
+            # Só __typename: o subdocumento tem de vir para o objeto não sair a null
+            if not subcampos:
+                projecao["caracteristicas"] = 1
+            for sub in subcampos:
+                projecao[f"caracteristicas.{sub}"] = 1
+        elif nome in CAMPOS_MONGO:
+            projecao[CAMPOS_MONGO[nome]] = 1
+    if len(projecao) == 1:
+        projecao["id"] = 1
+    return projecao
+
+def construir_filtro(filtro):
+    query = {}
+    if not filtro:
+        return query
+    if filtro.get("ids") is not None:
+        query["id"] = {"$in": list(filtro["ids"])}
+    if filtro.get("nome"):
+        query["nome"] = {"$regex": re.escape(filtro["nome"]), "$options": "i"}
+    if filtro.get("marca"):
+        query["marca"] = filtro["marca"]
+    for campo, minimo, maximo in (("preco", "preco_min", "preco_max"), ("stock", "stock_min", "stock_max")):
+        limites = {}
+        if filtro.get(minimo) is not None:
+            limites["$gte"] = filtro[minimo]
+        if filtro.get(maximo) is not None:
+            limites["$lte"] = filtro[maximo]
+        if limites:
+            query[campo] = limites
+    return query
+
+def codificar_cursor(valor, id):
+    return base64.urlsafe_b64encode(json.dumps([valor, id]).encode("utf-8")).decode("ascii")
+
+def descodificar_cursor(cursor):
+    try:
+        valor, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return valor, id
+    except (ValueError, TypeError):
+        raise Exception("Cursor inválido")
+
+def condicao_apos(cursor, campo, ordem):
+    # Paginação por chave (keyset): continua a seguir ao par (campo, id) do cursor
+    valor, id = descodificar_cursor(cursor)
+    op = "$gt" if ordem == 1 else "$lt"
+    if campo == "id":
+        return {"id": {op: id}}
+    return {"$or": [{campo: {op: valor}}, {campo: valor, "id": {op: id}}]}
+
+# === DataLoader ===
+class ProdutoLoader(DataLoader):
+    """Agrupa todos os pedidos por id de uma operação numa só query $in."""
+
+    async def batch_load_fn(self, ids):
+        produtos = {p["id"]: p async for p in colecao.find({"id": {"$in": list(ids)}}, {"_id": 0})}
+        return [produtos.get(id) for id in ids]
+
+def obter_loader(info):
+    # Um loader por pedido: a memoização nunca atravessa pedidos diferentes
+    contexto = info.context
+    loader = getattr(contexto, "produto_loader", None)
+    if loader is None:
+        loader = ProdutoLoader()
+        contexto.produto_loader = loader
+    return loader
 
 class Query(graphene.ObjectType):
-    produtos = graphene.List(ProdutoType)
+    produtos = graphene.List(
+        ProdutoType,
+        filtro=FiltroProdutos(),
+        ordenar_por=CampoOrdenacao(default_value=CampoOrdenacao.ID.value),
+        ordem=Ordem(default_value=Ordem.ASC.value),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
 
-    def resolve_produtos(root, info):
+    async def resolve_produtos(root, info, filtro=None, ordenar_por="id", ordem=1, first=None, after=None):
         payload = extrair_token(info)
         if not payload:
             raise Exception("Token inválido ou ausente")
-        return list(colecao.find({}, {"_id": 0}))
+        if first is not None and first < 0:
+            raise Exception("'first' não pode ser negativo")
+
+        # Os argumentos enum chegam como membro do enum
+        campo = getattr(ordenar_por, "value", ordenar_por)
+        ordem = getattr(ordem, "value", ordem)
+
+        query = construir_filtro(filtro)
+        if after:
+            query = {"$and": [query, condicao_apos(after, campo, ordem)]} if query else condicao_apos(after, campo, ordem)
+
+        projecao = projecao_selecionada(info)
+        pede_cursor = any(sel.name.value == "cursor" for sel in _selecoes(info))
+        if pede_cursor:
+            projecao[campo] = 1
+        if first == 0:
+            return []
+
+        cursor_mongo = colecao_leituras.find(query, projecao).sort([(campo, ordem), ("id", ordem)])
+        if first is not None:
+            cursor_mongo = cursor_mongo.limit(first)
+
+        produtos = await cursor_mongo.to_list(length=None)
+        if pede_cursor:
+            for p in produtos:
+                p["_cursor"] = codificar_cursor(p.get(campo), p.get("id"))
+        return produtos
+
+    produto = graphene.Field(ProdutoType, id=graphene.Int(required=True))
+    produtos_por_ids = graphene.List(ProdutoType, ids=graphene.List(graphene.NonNull(graphene.Int), required=True))
+
+    def resolve_produto(root, info, id):
+        if not extrair_token(info):
+            raise Exception("Token inválido ou ausente")
+        return obter_loader(info).load(id)
+
+    def resolve_produtos_por_ids(root, info, ids):
+        if not extrair_token(info):
+            raise Exception("Token inválido ou ausente")
+        return obter_loader(info).load_many(ids)
+
+    pesquisar = graphene.List(
+        ProdutoType,
+        texto=graphene.String(required=True),
+        autocompletar=graphene.Boolean(default_value=False),
+        limite=graphene.Int(default_value=20)
+    )
+    sugestoes = graphene.List(graphene.String, prefixo=graphene.String(required=True), limite=graphene.Int(default_value=5))
+
+    async def resolve_pesquisar(root, info, texto, autocompletar=False, limite=20):
+        if not extrair_token(info):
+            raise Exception("Token inválido ou ausente")
+        if not 0 < limite <= PESQUISA_LIMITE_MAXIMO:
+            raise Exception(f"'limite' tem de estar entre 1 e {PESQUISA_LIMITE_MAXIMO}")
+        iniciar_pesquisa()
+        termos, _ = termos_pesquisa(vocabulario, texto, autocompletar)
+        if not termos:
+            return []
+        projecao = {**projecao_selecionada(info), **PROJECAO_RELEVANCIA}
+        try:
+            cursor_mongo = colecao_leituras.find(consulta_texto(termos), projecao).sort(ORDEM_RELEVANCIA).limit(limite)
+            return await cursor_mongo.to_list(length=None)
+        except OperationFailure as e:
+            raise Exception(f"Pesquisa indisponível: {e}")
+
+    estatisticas = graphene.Field(EstatisticasType, marca=graphene.String())
+
+    async def resolve_estatisticas(root, info, marca=None):
+        if not extrair_token(info):
+            raise Exception("Token inválido ou ausente")
+        iniciar_estatisticas()
+        if not await agregador.agregado_async():
+            await atualizar_estatisticas()
+        filtro = {"marca": marca} if marca is not None else {}
+        linhas = [linha_publica(l) for l in await colecao_estatisticas.find(filtro).sort("marca", 1).to_list(length=None)]
+        return {"totais": totais(linhas), "marcas": linhas}
+
+    def resolve_sugestoes(root, info, prefixo, limite=5):
+        if not extrair_token(info):
+            raise Exception("Token inválido ou ausente")
+        iniciar_pesquisa()
+        return vocabulario.completar(prefixo, max(0, min(limite, PESQUISA_LIMITE_MAXIMO)))
 
 # === Mutations ===
 
@@ -101,7 +538,7 @@ class AdicionarProduto(graphene.Mutation):
     ok = graphene.Boolean()
     mensagem = graphene.String()
 
-    def mutate(self, info, id, nome, marca, preco, stock, tela, bateria, armazenamento):
+    async def mutate(self, info, id, nome, marca, preco, stock, tela, bateria, armazenamento):
         payload = extrair_token(info)
         if not payload:
             return AdicionarProduto(ok=False, mensagem="Token inválido ou ausente")
@@ -124,10 +561,18 @@ class AdicionarProduto(graphene.Mutation):
         except ValidationError as e:
             return AdicionarProduto(ok=False, mensagem=f"Erro: {e.message}")
 
-        if colecao.find_one({"id": id}):
+        if await colecao.find_one({"id": id}):
             return AdicionarProduto(ok=False, mensagem="ID já existe.")
 
-        colecao.insert_one(produto)
+        dados = dict(produto)
+
+        async def escrever(sessao, versao):
+            await colecao.insert_one(primeira_versao(produto, versao), session=sessao)
+            return None, [evento("novo_produto", [id], dados, utilizador(payload))]
+
+        await outbox.gravar_async(escrever)
+        produto.pop("_id", None)
+        difusor.publicar_local("insert", id, produto)
         return AdicionarProduto(ok=True, mensagem="Produto adicionado com sucesso")
 
 class EditarProduto(graphene.Mutation):
@@ -144,7 +589,7 @@ class EditarProduto(graphene.Mutation):
     ok = graphene.Boolean()
     mensagem = graphene.String()
 
-    def mutate(self, info, id, nome, marca, preco, stock, tela, bateria, armazenamento):
+    async def mutate(self, info, id, nome, marca, preco, stock, tela, bateria, armazenamento):
         payload = extrair_token(info)
         if not payload:
             return EditarProduto(ok=False, mensagem="Token inválido ou ausente")
@@ -167,10 +612,16 @@ class EditarProduto(graphene.Mutation):
         except ValidationError as e:
             return EditarProduto(ok=False, mensagem=f"Erro: {e.message}")
 
-        resultado = colecao.update_one({"id": id}, {"$set": produto})
-        if resultado.matched_count == 0:
+        async def escrever(sessao, versao):
+            resultado = await colecao.update_one({"id": id}, nova_versao({"$set": produto}, versao), session=sessao)
+            if resultado.matched_count == 0:
+                return False, []
+            return True, [evento("produto_editado", [id], produto, utilizador(payload))]
+
+        if not await outbox.gravar_async(escrever):
             return EditarProduto(ok=False, mensagem="Produto não encontrado.")
 
+        difusor.publicar_local("update", id, produto)
         return EditarProduto(ok=True, mensagem="Produto atualizado com sucesso")
 
 class RemoverProduto(graphene.Mutation):
@@ -180,20 +631,306 @@ class RemoverProduto(graphene.Mutation):
     ok = graphene.Boolean()
     mensagem = graphene.String()
 
-    def mutate(self, info, id):
+    async def mutate(self, info, id):
         payload = extrair_token(info)
         if not payload:
             return RemoverProduto(ok=False, mensagem="Token inválido ou ausente")
 
-        resultado = colecao.delete_one({"id": id})
-        if resultado.deleted_count == 0:
+        async def escrever(sessao, versao):
+            resultado = await colecao.delete_one({"id": id}, session=sessao)
+            if resultado.deleted_count == 0:
+                return False, []
+            return True, [evento("produto_removido", [id], {"id": id}, utilizador(payload), [id])]
+
+        if not await outbox.gravar_async(escrever):
             return RemoverProduto(ok=False, mensagem="Produto não encontrado.")
+        difusor.publicar_local("delete", id)
         return RemoverProduto(ok=True, mensagem="Produto removido com sucesso")
 
+# === Mutations em lote ===
+class ProdutoInput(graphene.InputObjectType):
+    id = graphene.Int(required=True)
+    nome = graphene.String(required=True)
+    marca = graphene.String(required=True)
+    preco = graphene.Float(required=True)
+    stock = graphene.Int(required=True)
+    tela = graphene.String(required=True)
+    bateria = graphene.String(required=True)
+    armazenamento = graphene.String(required=True)
+
+class ResultadoItem(graphene.ObjectType):
+    id = graphene.Int()
+    ok = graphene.Boolean()
+    mensagem = graphene.String()
+
+def produto_de_input(item):
+    return {
+        "id": item.id,
+        "nome": item.nome,
+        "marca": item.marca,
+        "preco": item.preco,
+        "stock": item.stock,
+        "caracteristicas": {
+            "tela": item.tela,
+            "bateria": item.bateria,
+            "armazenamento": item.armazenamento
+        }
+    }
+
+# Mesmo limite das operações em lote do REST
+BATCH_MAXIMO = int(os.getenv("GRAPHQL_BATCH_MAXIMO", "10000"))
+
+def lote_excedido(n):
+    return f"Máximo de {BATCH_MAXIMO} produtos por pedido" if n > BATCH_MAXIMO else None
+
+@rastreador.rastrear("validar_schema")
+def validar_lote(itens):
+    """Valida todos os itens numa passagem; devolve (válidos, resultados de erro)."""
+    validos, erros = [], {}
+    vistos = set()
+    for posicao, item in enumerate(itens):
+        produto = produto_de_input(item)
+        erro = next(validador.iter_errors(produto), None)
+        if erro:
+            erros[posicao] = ResultadoItem(id=item.id, ok=False, mensagem=f"Erro: {erro.message}")
+        elif item.id in vistos:
+            erros[posicao] = ResultadoItem(id=item.id, ok=False, mensagem="ID repetido no lote.")
+        else:
+            vistos.add(item.id)
+            validos.append((posicao, produto))
+    return validos, erros
+
+async def escrever_lote(operacoes, rejeitadas, sessao=None):
+    """bulk_write não ordenado das operações não rejeitadas; devolve o resultado, os inseridos e as falhas.
+
+    Numa transação um erro de escrita anula o lote inteiro: as operações que
+    falharam passam para `rejeitadas` e a BulkWriteError segue, para
+    gravar_lote() repetir a transação sem elas.
+    """
+    pendentes = [indice for indice in range(len(operacoes)) if indice not in rejeitadas]
+    erros = {}
+    try:
+        resultado = await colecao.bulk_write([operacoes[i] for i in pendentes], ordered=False, session=sessao)
+        detalhes = resultado.bulk_api_result
+    except BulkWriteError as e:
+        detalhes = e.details
+        erros = {pendentes[erro["index"]]: erro["errmsg"] for erro in detalhes.get("writeErrors", [])}
+        if sessao is not None:
+            rejeitadas.update(erros)
+            raise
+    inseridos = {pendentes[u["index"]] for u in detalhes.get("upserted", [])}
+    return detalhes, inseridos, {**rejeitadas, **erros}
+
+async def gravar_lote(escrever, rejeitadas, total):
+    """outbox.gravar_async(escrever), repetido sem as operações rejeitadas; None se foram todas rejeitadas."""
+    while len(rejeitadas) < total:
+        antes = len(rejeitadas)
+        try:
+            return await outbox.gravar_async(escrever)
+        except BulkWriteError:
+            if len(rejeitadas) == antes:
+                raise
+    return None
+
+class LoteIncompleto(Exception):
+    """Nem todas as remoções do lote acertaram: anula a transação para repetir com leitura."""
+
+async def ids_existentes(ids, sessao=None):
+    return {p["id"] async for p in colecao.find({"id": {"$in": list(ids)}}, {"_id": 0, "id": 1}, session=sessao)}
+
+def ordenar_resultados(total, resultados):
+    return [resultados[posicao] for posicao in range(total)]
+
+class AdicionarProdutos(graphene.Mutation):
+    class Arguments:
+        produtos = graphene.List(graphene.NonNull(ProdutoInput), required=True)
+
+    ok = graphene.Boolean()
+    mensagem = graphene.String()
+    resultados = graphene.List(ResultadoItem)
+
+    async def mutate(self, info, produtos):
+        payload = extrair_token(info)
+        if not payload:
+            return AdicionarProdutos(ok=False, mensagem="Token inválido ou ausente")
+        excedido = lote_excedido(len(produtos))
+        if excedido:
+            return AdicionarProdutos(ok=False, mensagem=excedido)
+
+        validos, resultados = validar_lote(produtos)
+        if validos:
+            rejeitadas = {}
+
+            async def escrever(sessao, versao):
+                # $setOnInsert com upsert insere só os ids que ainda não existem,
+                # sem ler a coleção antes da escrita
+                operacoes = [UpdateOne({"id": p["id"]}, {"$setOnInsert": primeira_versao(p, versao)}, upsert=True)
+                             for _, p in validos]
+                _, inseridos, erros_escrita = await escrever_lote(operacoes, rejeitadas, sessao)
+                criados = [p for indice, (_, p) in enumerate(validos)
+                           if indice in inseridos and indice not in erros_escrita]
+                return (erros_escrita, inseridos), eventos_lote({"criados": criados}, utilizador(payload))
+
+            gravado = await gravar_lote(escrever, rejeitadas, len(validos))
+            erros_escrita, inseridos = gravado if gravado is not None else (rejeitadas, set())
+            for indice, (posicao, produto) in enumerate(validos):
+                if indice in erros_escrita:
+                    resultados[posicao] = ResultadoItem(id=produto["id"], ok=False, mensagem=erros_escrita[indice])
+                elif indice in inseridos:
+                    resultados[posicao] = ResultadoItem(id=produto["id"], ok=True, mensagem="Produto adicionado com sucesso")
+                    difusor.publicar_local("insert", produto["id"], produto)
+                else:
+                    resultados[posicao] = ResultadoItem(id=produto["id"], ok=False, mensagem="ID já existe.")
+
+        resultados = ordenar_resultados(len(produtos), resultados)
+        adicionados = sum(1 for r in resultados if r.ok)
+        return AdicionarProdutos(
+            ok=adicionados == len(produtos),
+            mensagem=f"{adicionados} de {len(produtos)} produtos adicionados",
+            resultados=resultados
+        )
+
+class EditarProdutos(graphene.Mutation):
+    class Arguments:
+        produtos = graphene.List(graphene.NonNull(ProdutoInput), required=True)
+
+    ok = graphene.Boolean()
+    mensagem = graphene.String()
+    resultados = graphene.List(ResultadoItem)
+
+    async def mutate(self, info, produtos):
+        payload = extrair_token(info)
+        if not payload:
+            return EditarProdutos(ok=False, mensagem="Token inválido ou ausente")
+        excedido = lote_excedido(len(produtos))
+        if excedido:
+            return EditarProdutos(ok=False, mensagem=excedido)
+
+        validos, resultados = validar_lote(produtos)
+        if validos:
+            rejeitadas = {}
+
+            async def escrever(sessao, versao):
+                operacoes = [UpdateOne({"id": p["id"]}, nova_versao({"$set": p}, versao)) for _, p in validos]
+                detalhes, _, falhas = await escrever_lote(operacoes, rejeitadas, sessao)
+                # O bulk_write só dá o total de documentos encontrados; com todos encontrados não há nada a ler
+                if detalhes["nMatched"] + len(falhas) < len(operacoes):
+                    existentes = await ids_existentes((p["id"] for _, p in validos), sessao)
+                    for indice, (_, p) in enumerate(validos):
+                        if indice not in falhas and p["id"] not in existentes:
+                            falhas[indice] = "Produto não encontrado."
+                editados = [p for indice, (_, p) in enumerate(validos) if indice not in falhas]
+                return falhas, eventos_lote({"editados": editados}, utilizador(payload))
+
+            falhas = await gravar_lote(escrever, rejeitadas, len(validos))
+            if falhas is None:
+                falhas = rejeitadas
+            for indice, (posicao, produto) in enumerate(validos):
+                if indice in falhas:
+                    resultados[posicao] = ResultadoItem(id=produto["id"], ok=False, mensagem=falhas[indice])
+                else:
+                    resultados[posicao] = ResultadoItem(id=produto["id"], ok=True, mensagem="Produto atualizado com sucesso")
+                    difusor.publicar_local("update", produto["id"], produto)
+
+        resultados = ordenar_resultados(len(produtos), resultados)
+        atualizados = sum(1 for r in resultados if r.ok)
+        return EditarProdutos(
+            ok=atualizados == len(produtos),
+            mensagem=f"{atualizados} de {len(produtos)} produtos atualizados",
+            resultados=resultados
+        )
+
+class RemoverProdutos(graphene.Mutation):
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.Int), required=True)
+
+    ok = graphene.Boolean()
+    mensagem = graphene.String()
+    resultados = graphene.List(ResultadoItem)
+
+    async def mutate(self, info, ids):
+        payload = extrair_token(info)
+        if not payload:
+            return RemoverProdutos(ok=False, mensagem="Token inválido ou ausente")
+        excedido = lote_excedido(len(ids))
+        if excedido:
+            return RemoverProdutos(ok=False, mensagem=excedido)
+
+        unicos = list(dict.fromkeys(ids))
+        operacoes = [DeleteOne({"id": id}) for id in unicos]
+
+        async def escrever(sessao, versao, ler_antes):
+            # Sem transação não se pode anular e repetir: lê-se antes de remover
+            if ler_antes or sessao is None:
+                removidos = await ids_existentes(unicos, sessao)
+                await colecao.delete_many({"id": {"$in": list(removidos)}}, session=sessao)
+            else:
+                resultado = await colecao.bulk_write(operacoes, ordered=False, session=sessao)
+                # O bulk_write só dá o total removido; se faltar algum não se sabe qual
+                if resultado.deleted_count < len(operacoes):
+                    raise LoteIncompleto()
+                removidos = set(unicos)
+            return removidos, eventos_lote({"removidos": sorted(removidos)}, utilizador(payload))
+
+        existentes = set()
+        if operacoes:
+            try:
+                existentes = await outbox.gravar_async(lambda sessao, versao: escrever(sessao, versao, False))
+            except LoteIncompleto:
+                existentes = await outbox.gravar_async(lambda sessao, versao: escrever(sessao, versao, True))
+            for id in existentes:
+                difusor.publicar_local("delete", id)
+
+        resultados = [
+            ResultadoItem(id=id, ok=True, mensagem="Produto removido com sucesso") if id in existentes
+            else ResultadoItem(id=id, ok=False, mensagem="Produto não encontrado.")
+            for id in ids
+        ]
+        return RemoverProdutos(
+            ok=len(existentes) == len(unicos),
+            mensagem=f"{len(existentes)} de {len(unicos)} produtos removidos",
+            resultados=resultados
+        )
+
 # === Schema ===
 class Mutation(graphene.ObjectType):
     adicionar_produto = AdicionarProduto.Field()
     editar_produto = EditarProduto.Field()
     remover_produto = RemoverProduto.Field()
+    adicionar_produtos = AdicionarProdutos.Field()
+    editar_produtos = EditarProdutos.Field()
+    remover_produtos = RemoverProdutos.Field()
+
+# === Subscriptions ===
+class TipoAlteracao(graphene.Enum):
+    INSERT = "insert"
+    UPDATE = "update"
+    REPLACE = "replace"
+    DELETE = "delete"
+
+class AlteracaoProduto(graphene.ObjectType):
+    tipo = graphene.Field(TipoAlteracao)
+    id = graphene.Int()
+    produto = graphene.Field(ProdutoType)
+
+class Subscription(graphene.ObjectType):
+    produto_alterado = graphene.Field(AlteracaoProduto, id=graphene.Int(), marca=graphene.String())
+
+    async def subscribe_produto_alterado(root, info, id=None, marca=None):
+        if not extrair_token(info):
+            raise Exception("Token inválido ou ausente")
+
+        def filtro(evento):
+            if id is not None and evento["id"] != id:
+                return False
+            if marca is not None and evento["marca"] != marca:
+                return False
+            return True
+
+        async for evento in difusor.subscrever(filtro):
+            yield evento
+
+    def resolve_produto_alterado(root, info, id=None, marca=None):
+        return root
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
@@ -0,0 +1,71 @@
+import os
+
+from pymongo import MongoClient
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+# Cópia partilhada com servera/rest/ligacao.py, serverb/soap/ligacao.py e
+# serverc/graphql/ligacao.py (cada serviço tem o seu contexto Docker)
+
+# Variável de ambiente -> opção do MongoClient; as que não estão definidas ficam com o valor do driver
+OPCOES_AMBIENTE = {
+    "MONGO_POOL_MAXIMO": "maxPoolSize",
+    "MONGO_POOL_MINIMO": "minPoolSize",
+    "MONGO_POOL_ESPERA_MS": "waitQueueTimeoutMS",
+    "MONGO_POOL_INATIVA_MS": "maxIdleTimeMS",
+    "MONGO_TIMEOUT_LIGACAO_MS": "connectTimeoutMS",
+    "MONGO_TIMEOUT_SOCKET_MS": "socketTimeoutMS",
+    "MONGO_TIMEOUT_SELECAO_MS": "serverSelectionTimeoutMS",
+}
+# O servidor recusa maxStalenessSeconds abaixo de 90s
+ATRASO_MINIMO = 90
+
+
+def opcoes_ambiente():
+    """Pool, timeouts e compressão (MONGO_COMPRESSAO=zstd,snappy,zlib) lidos do ambiente."""
+    opcoes = {opcao: int(os.environ[nome]) for nome, opcao in OPCOES_AMBIENTE.items() if os.getenv(nome)}
+    if os.getenv("MONGO_COMPRESSAO"):
+        opcoes["compressors"] = os.environ["MONGO_COMPRESSAO"]
+    return opcoes
+
+
+class LigacaoMongo:
+    """Cliente MongoDB do serviço, com as leituras pesadas encaminhadas para os secundários.
+
+    `db` lê e escreve no primário: escritas e leituras que têm de ver a
+    escrita acabada de fazer. leituras() devolve a coleção com read
+    preference secondaryPreferred limitada a `atraso_maximo` segundos de
+    atraso: secundários mais atrasados são ignorados e, sem nenhum
+    disponível, lê-se do primário. Num mongod sem replica set vai tudo ao
+    mesmo servidor.
+
+    Escritas e leituras são repetidas uma vez depois de um erro de rede ou
+    de uma troca de primário (retryWrites/retryReads, explícitos para não
+    dependerem do url), à espera que o novo primário seja eleito.
+    """
+
+    def __init__(self, url, nome_db="catalogo", classe=MongoClient, secundarios=True,
+                 atraso_maximo=ATRASO_MINIMO, **opcoes):
+        if secundarios and atraso_maximo < ATRASO_MINIMO:
+            raise ValueError(f"O atraso máximo dos secundários tem de ser pelo menos {ATRASO_MINIMO}s")
+        opcoes.setdefault("retryWrites", True)
+        opcoes.setdefault("retryReads", True)
+        self.client = classe(url, **opcoes)
+        self.db = self.client[nome_db]
+        self.secundarios = secundarios
+        self.preferencia = SecondaryPreferred(max_staleness=atraso_maximo) if secundarios else Primary()
+
+    @classmethod
+    def do_ambiente(cls, rastreador, url_omissao, classe=MongoClient):
+        """MONGO_URL, as opções de opcoes_ambiente(), MONGO_LEITURAS=secundarios|primario e MONGO_ATRASO_MAXIMO."""
+        return cls(
+            os.getenv("MONGO_URL", url_omissao),
+            classe=classe,
+            secundarios=os.getenv("MONGO_LEITURAS", "secundarios") != "primario",
+            atraso_maximo=int(os.getenv("MONGO_ATRASO_MAXIMO", str(ATRASO_MINIMO))),
+            event_listeners=rastreador.ouvintes_mongo(),
+            **opcoes_ambiente()
+        )
+
+    def leituras(self, colecao):
+        """A mesma coleção, para leituras que toleram até `atraso_maximo` segundos de atraso."""
+        return colecao.with_options(read_preference=self.preferencia)
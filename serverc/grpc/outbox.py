@@ -0,0 +1,546 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId, Timestamp
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
+from rastreio import PRODUTOR
+from versoes import Versoes, ids_removidos
+
+try:
+    import pika
+except ImportError:
+    pika = None
+
+# Cópia partilhada com servera/rest/outbox.py, serverb/soap/outbox.py e
+# serverc/graphql/outbox.py (cada serviço tem o seu contexto Docker)
+
+COLECAO_OUTBOX = "outbox"
+COLECAO_RELAYS = "outbox_relays"
+# Destinos de cada evento; cada destino é servido pelo seu relay (o Socket.IO tem um Seguidor por processo)
+DESTINOS = ("rabbitmq",)
+# Eventos já entregues a todos os destinos ficam um dia para consulta
+RETENCAO_ENTREGUES = 24 * 3600
+LOTE_RELAY = 500
+# Escritas em lote dão um evento por cada N produtos (um documento tem no máximo 16 MB)
+PRODUTOS_POR_EVENTO = 1000
+# Espera entre tentativas de um evento que falhou: 0.5 s, 1 s, 2 s, ... até este máximo
+ESPERA_MAXIMA = 60
+# IllegalOperation: pedir uma transação a uma instância isolada (sem replica set)
+SEM_TRANSACOES = 20
+# Change stream pedido a uma instância isolada
+SEM_REPLICA_SET = 40573
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def evento(tipo, produtos, dados, utilizador=None, removidos=()):
+    """Evento para Outbox.gravar(); `produtos` são os ids afetados, `tipo` é também o evento Socket.IO.
+
+    `removidos` são os ids de `produtos` que deixaram de existir.
+    """
+    return {"tipo": tipo, "produtos": list(produtos), "dados": dados, "utilizador": utilizador,
+            "removidos": list(removidos)}
+
+
+def em_partes(itens, tamanho=PRODUTOS_POR_EVENTO):
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+
+def eventos_lote(alteracoes, utilizador=None):
+    """Eventos produtos_alterados de um lote {"criados": [...], "editados": [...], "removidos": [ids]}.
+
+    Um só evento nos lotes normais; acima de PRODUTOS_POR_EVENTO produtos, um por cada parte.
+    """
+    itens = [("criados", p["id"], p) for p in alteracoes.get("criados", [])]
+    itens += [("editados", p["id"], p) for p in alteracoes.get("editados", [])]
+    itens += [("removidos", produto_id, produto_id) for produto_id in alteracoes.get("removidos", [])]
+    eventos = []
+    for parte in em_partes(itens):
+        dados = {"criados": [], "editados": [], "removidos": []}
+        for chave, _, item in parte:
+            dados[chave].append(item)
+        eventos.append(evento(
+            "produtos_alterados", [produto_id for _, produto_id, _ in parte], dados, utilizador, dados["removidos"]
+        ))
+    return eventos
+
+
+def corpo_evento(documento):
+    """Mensagem JSON publicada nos brokers; `id` permite aos consumidores descartar repetições."""
+    criado_em = documento["criado_em"]
+    if criado_em.tzinfo is None:
+        # O pymongo devolve datas sem fuso (em UTC)
+        criado_em = criado_em.replace(tzinfo=timezone.utc)
+    return json.dumps({
+        "id": str(documento["_id"]),
+        "tipo": documento["tipo"],
+        "produtos": documento["produtos"],
+        "dados": documento["dados"],
+        "utilizador": documento.get("utilizador"),
+        "origem": documento["origem"],
+        "criado_em": criado_em.isoformat()
+    })
+
+
+class Outbox:
+    """Eventos de alteração gravados na mesma transação que a escrita que os causa.
+
+    gravar(escrever) corre escrever(sessao, versao), que faz a escrita com essa
+    sessão e devolve (resultado, eventos); os eventos entram na coleção
+    outbox na mesma transação, pelo que ou ficam a escrita e os eventos ou
+    nenhum dos dois. A publicação fica para os relays, fora do pedido.
+
+    Cada evento leva em `ordem` um Timestamp vazio que o servidor preenche
+    na inserção (tem de ser o segundo campo, logo depois do `_id`). A
+    inserção vem depois da escrita e duas escritas ao mesmo produto não
+    podem sobrepor-se numa transação, por isso em cada produto a ordem de
+    `ordem` é a ordem dos commits.
+
+    Para a sincronização incremental, escrever recebe também a versão da
+    escrita (ver Versoes), que grava nos produtos com primeira_versao() ou
+    nova_versao(); os ids em `removidos` dos eventos ficam guardados com ela.
+
+    Sem replica set não há transações: a escrita e os eventos são gravados
+    um a seguir ao outro, e uma falha entre os dois perde o evento.
+    """
+
+    def __init__(self, db, origem, destinos=DESTINOS, rastreador=None, versoes=None):
+        self.client = db.client
+        self.colecao = db[COLECAO_OUTBOX]
+        self.origem = origem
+        self.destinos = list(destinos)
+        self.rastreador = rastreador
+        self.versoes = versoes if versoes is not None else Versoes(db)
+        # None até à primeira escrita: só aí se sabe se o servidor aceita transações
+        self.transacoes = None
+        # Funções chamadas depois de cada gravação (ex.: acordar o relay local)
+        self.ouvintes = []
+
+    @classmethod
+    def do_ambiente(cls, db, origem, rastreador=None):
+        """OUTBOX_DESTINOS (separados por vírgulas) escolhe os destinos de cada evento."""
+        destinos = [d.strip() for d in os.getenv("OUTBOX_DESTINOS", ",".join(DESTINOS)).split(",") if d.strip()]
+        return cls(db, origem, destinos, rastreador, Versoes.do_ambiente(db))
+
+    def _documentos(self, eventos):
+        agora = _agora()
+        # O relay publica cada evento como filho do pedido que fez a escrita
+        traceparent = self.rastreador.traceparent() if self.rastreador is not None else None
+        return [{
+            "_id": ObjectId(),
+            "ordem": Timestamp(0, 0),
+            **e,
+            "origem": self.origem,
+            "criado_em": agora,
+            "traceparent": traceparent,
+            "destinos": list(self.destinos),
+            "proxima": {destino: agora for destino in self.destinos}
+        } for e in eventos]
+
+    def _sem_transacoes(self, e):
+        if e.code != SEM_TRANSACOES or self.transacoes:
+            return False
+        self.transacoes = False
+        print(f"[Outbox] Sem transações ({e}); escrita e evento gravados em separado")
+        return True
+
+    def _avisar(self):
+        for ouvinte in self.ouvintes:
+            ouvinte()
+
+    # === Servidores síncronos (pymongo) ===
+    def _escrever(self, escrever, sessao):
+        versao = self.versoes.reservar(sessao)
+        try:
+            resultado, eventos = escrever(sessao, versao)
+            if eventos:
+                self.colecao.insert_many(self._documentos(eventos), session=sessao)
+                self.versoes.remover(ids_removidos(eventos), versao, sessao)
+        finally:
+            if sessao is None:
+                self.versoes.libertar(versao)
+        return resultado
+
+    def gravar(self, escrever):
+        """Corre escrever(sessao, versao) -> (resultado, eventos) numa transação e devolve o resultado.
+
+        escrever pode ser repetida (conflitos transitórios), por isso não deve
+        ter efeitos fora do MongoDB; as exceções que levantar anulam a transação.
+        """
+        if self.transacoes is not False:
+            try:
+                with self.client.start_session() as sessao:
+                    resultado = sessao.with_transaction(lambda s: self._escrever(escrever, s))
+                self.transacoes = True
+                self._avisar()
+                return resultado
+            except OperationFailure as e:
+                if not self._sem_transacoes(e):
+                    raise
+        resultado = self._escrever(escrever, None)
+        self._avisar()
+        return resultado
+
+    # === Servidor assíncrono (Motor) ===
+    async def _escrever_async(self, escrever, sessao):
+        versao = await self.versoes.reservar_async(sessao)
+        try:
+            resultado, eventos = await escrever(sessao, versao)
+            if eventos:
+                await self.colecao.insert_many(self._documentos(eventos), session=sessao)
+                await self.versoes.remover_async(ids_removidos(eventos), versao, sessao)
+        finally:
+            if sessao is None:
+                await self.versoes.libertar_async(versao)
+        return resultado
+
+    async def gravar_async(self, escrever):
+        """Como gravar(), com `escrever` uma função async."""
+        if self.transacoes is not False:
+            try:
+                async with await self.client.start_session() as sessao:
+                    resultado = await sessao.with_transaction(lambda s: self._escrever_async(escrever, s))
+                self.transacoes = True
+                self._avisar()
+                return resultado
+            except OperationFailure as e:
+                if not self._sem_transacoes(e):
+                    raise
+        resultado = await self._escrever_async(escrever, None)
+        self._avisar()
+        return resultado
+
+
+# === Relays ===
+class Destino:
+    """Para onde um relay publica; publicar() levanta exceção se o evento não ficou entregue."""
+
+    nome = None
+
+    def publicar(self, documento):
+        raise NotImplementedError
+
+
+def publicar_rastreado(destino, documento, rastreador=None):
+    """destino.publicar(documento), num span produtor filho do pedido que gravou o evento."""
+    if rastreador is None:
+        destino.publicar(documento)
+        return
+    with rastreador.pedido(f"publicar {destino.nome}", documento.get("traceparent"), PRODUTOR, **{
+        "messaging.system": destino.nome,
+        "messaging.operation": "publish",
+        "messaging.message.id": str(documento["_id"])
+    }):
+        destino.publicar(documento)
+
+
+class DestinoRabbitMQ(Destino):
+    """produtos_queue, com mensagens persistentes e confirmação do broker.
+
+    A ligação fica aberta entre lotes e só é refeita depois de uma falha;
+    basic_publish só volta quando o RabbitMQ aceitou a mensagem, por isso um
+    evento só é marcado como entregue depois de estar na fila. Entre lotes
+    ninguém processa os heartbeats da BlockingConnection, por isso ficam
+    desligados (heartbeat=0): uma ligação morta só se nota ao publicar, e
+    aí é refeita.
+    """
+
+    nome = "rabbitmq"
+
+    def __init__(self, host, fila="produtos_queue", rastreador=None):
+        self.host = host
+        self.fila = fila
+        self.rastreador = rastreador
+        self.ligacao = None
+        self.canal = None
+
+    @classmethod
+    def do_ambiente(cls, rastreador=None):
+        return cls(os.getenv("RABBITMQ_HOST", "rabbitmq"), rastreador=rastreador)
+
+    def _canal(self):
+        if self.canal is None or self.canal.is_closed:
+            self.ligacao = pika.BlockingConnection(pika.ConnectionParameters(host=self.host, heartbeat=0))
+            self.canal = self.ligacao.channel()
+            self.canal.queue_declare(queue=self.fila, durable=True)
+            self.canal.confirm_delivery()
+        return self.canal
+
+    def publicar(self, documento):
+        # O traceparent segue nos headers AMQP para o consumidor continuar o mesmo trace
+        traceparent = self.rastreador.traceparent() if self.rastreador is not None else None
+        propriedades = pika.BasicProperties(
+            content_type="application/json",
+            delivery_mode=2,
+            message_id=str(documento["_id"]),
+            headers={"traceparent": traceparent} if traceparent else None
+        )
+        try:
+            self._canal().basic_publish(exchange='', routing_key=self.fila, body=corpo_evento(documento),
+                                        properties=propriedades, mandatory=True)
+        except Exception:
+            self.fechar()
+            raise
+
+    def fechar(self):
+        try:
+            if self.ligacao is not None and self.ligacao.is_open:
+                self.ligacao.close()
+        except Exception:
+            pass
+        self.ligacao = self.canal = None
+
+
+class Relay:
+    """Publica os eventos do outbox num destino, em lotes, por ordem de `ordem`.
+
+    Só um relay por destino está ativo de cada vez (arrendamento renovado em
+    outbox_relays), por isso o mesmo relay pode correr em vários processos;
+    o líder que não consegue publicar larga o arrendamento, para outro
+    processo que chegue ao destino o poder tomar. Um evento que falha volta
+    a ser tentado com espera crescente e, até ser entregue, retém os eventos
+    seguintes dos mesmos produtos; os outros produtos continuam. A entrega é pelo menos uma vez: se o relay parar
+    entre publicar e marcar o lote, esses eventos são publicados de novo.
+    """
+
+    def __init__(self, db, destino, intervalo=0.5, arrendamento=10.0, rastreador=None):
+        self.colecao = db[COLECAO_OUTBOX]
+        self.relays = db[COLECAO_RELAYS]
+        self.destino = destino
+        self.nome = destino.nome
+        self.intervalo = intervalo
+        self.arrendamento = arrendamento
+        self.rastreador = rastreador
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.acordado = threading.Event()
+        self.lider = False
+        self.contagens = {"publicados": 0, "falhas": 0, "lotes": 0}
+
+    @classmethod
+    def do_ambiente(cls, db, destino, rastreador=None):
+        """OUTBOX_INTERVALO: espera entre lotes sem escritas locais; OUTBOX_ARRENDAMENTO: duração da liderança."""
+        return cls(
+            db,
+            destino,
+            intervalo=float(os.getenv("OUTBOX_INTERVALO", "0.5")),
+            arrendamento=float(os.getenv("OUTBOX_ARRENDAMENTO", "10")),
+            rastreador=rastreador
+        )
+
+    def criar_indices(self):
+        self.colecao.create_index([("destinos", 1), ("ordem", 1)])
+        self.colecao.create_index("entregue_em", expireAfterSeconds=RETENCAO_ENTREGUES)
+
+    def acordar(self):
+        self.acordado.set()
+
+    def _liderar(self):
+        agora = _agora()
+        try:
+            self.relays.find_one_and_update(
+                {"_id": self.nome, "$or": [{"ate": {"$lt": agora}}, {"dono": self.dono}]},
+                {"$set": {"dono": self.dono, "ate": agora + timedelta(seconds=self.arrendamento)}},
+                upsert=True
+            )
+            self.lider = True
+        except DuplicateKeyError:
+            # Outro processo tem o arrendamento em vigor
+            self.lider = False
+        return self.lider
+
+    def _largar(self):
+        # O MongoDB guarda milissegundos: `ate` já no passado, para outro processo o tomar logo a seguir
+        self.relays.update_one(
+            {"_id": self.nome, "dono": self.dono}, {"$set": {"ate": _agora() - timedelta(seconds=self.arrendamento)}}
+        )
+        self.lider = False
+
+    def publicar_lote(self):
+        """Publica até LOTE_RELAY eventos prontos; devolve quantos publicou."""
+        agora = _agora()
+        proxima = f"proxima.{self.nome}"
+        # Produtos com um evento à espera de nova tentativa: os seguintes ficam para depois
+        retidos = set()
+        for documento in self.colecao.find({"destinos": self.nome, proxima: {"$gt": agora}}, {"produtos": 1}):
+            retidos.update(documento["produtos"])
+        filtro = {"destinos": self.nome, proxima: {"$lte": agora}}
+        if retidos:
+            filtro["produtos"] = {"$nin": list(retidos)}
+        lote = list(self.colecao.find(filtro).sort([("ordem", 1), ("_id", 1)]).limit(LOTE_RELAY))
+
+        entregues = []
+        try:
+            for documento in lote:
+                self._publicar(documento)
+                entregues.append(documento["_id"])
+        except Exception as e:
+            # Destino provavelmente em baixo: o resto do lote fica para o próximo ciclo
+            self._falhou(lote[len(entregues)], e)
+            self._largar()
+        finally:
+            self._marcar(entregues)
+        self.contagens["lotes"] += 1
+        return len(entregues)
+
+    def _publicar(self, documento):
+        publicar_rastreado(self.destino, documento, self.rastreador)
+
+    def _falhou(self, documento, erro):
+        tentativas = documento.get("tentativas", {}).get(self.nome, 0) + 1
+        espera = min(ESPERA_MAXIMA, 0.5 * 2 ** (tentativas - 1))
+        self.colecao.update_one({"_id": documento["_id"]}, {
+            "$set": {f"proxima.{self.nome}": _agora() + timedelta(seconds=espera), f"erros.{self.nome}": str(erro)},
+            "$inc": {f"tentativas.{self.nome}": 1}
+        })
+        self.contagens["falhas"] += 1
+        print(f"[Outbox] {self.nome}: evento {documento['_id']} falhou ({erro}), nova tentativa em {espera:g}s")
+
+    def _marcar(self, entregues):
+        if not entregues:
+            return
+        self.colecao.update_many({"_id": {"$in": entregues}}, {"$pull": {"destinos": self.nome}})
+        # Entregue a todos os destinos: o índice TTL apaga-o ao fim da retenção
+        self.colecao.update_many(
+            {"_id": {"$in": entregues}, "destinos": {"$size": 0}},
+            {"$set": {"entregue_em": _agora()}}
+        )
+        self.contagens["publicados"] += len(entregues)
+
+    def correr(self):
+        """Ciclo do relay, numa thread (ou green thread do eventlet) própria."""
+        while True:
+            publicados = 0
+            try:
+                if self._liderar():
+                    publicados = self.publicar_lote()
+            except PyMongoError as e:
+                print(f"[Outbox] Relay {self.nome}: {e}")
+            # Lote cheio: há mais eventos prontos, seguir sem esperar
+            if publicados < LOTE_RELAY:
+                self.acordado.wait(self.intervalo)
+                self.acordado.clear()
+
+    def estatisticas(self):
+        return {
+            **self.contagens,
+            "destino": self.nome,
+            "lider": self.lider,
+            "pendentes": self.colecao.count_documents({"destinos": self.nome})
+        }
+
+
+class Seguidor:
+    """Publica todos os eventos do outbox num destino local, em cada processo.
+
+    Para destinos que só chegam aos clientes ligados ao próprio processo
+    (Socket.IO): não há arrendamento nem nada marcado nos eventos, cada
+    processo publica tudo aos seus clientes. Segue um change stream das
+    inserções no outbox, que dá os eventos pela ordem dos commits. Sem
+    replica set lê por `ordem` e relê `janela` segundos para trás, porque
+    uma inserção pode ficar visível depois de outra com `ordem` maior; os
+    já publicados são ignorados. Só publica os eventos gravados depois de
+    arrancar, e no máximo uma vez; um evento que falha é repetido, com
+    espera crescente, antes de passar ao seguinte.
+    """
+
+    def __init__(self, db, destino, intervalo=0.5, janela=5, rastreador=None):
+        self.colecao = db[COLECAO_OUTBOX]
+        self.destino = destino
+        self.nome = destino.nome
+        self.intervalo = intervalo
+        self.janela = janela
+        self.rastreador = rastreador
+        self.acordado = threading.Event()
+        self.modo = None
+        self.retoma = None
+        self.contagens = {"publicados": 0, "falhas": 0}
+
+    @classmethod
+    def do_ambiente(cls, db, destino, rastreador=None):
+        """OUTBOX_INTERVALO: espera entre leituras sem change stream; OUTBOX_JANELA: segundos relidos para trás."""
+        return cls(
+            db,
+            destino,
+            intervalo=float(os.getenv("OUTBOX_INTERVALO", "0.5")),
+            janela=int(os.getenv("OUTBOX_JANELA", "5")),
+            rastreador=rastreador
+        )
+
+    def criar_indices(self):
+        self.colecao.create_index("ordem")
+
+    def acordar(self):
+        self.acordado.set()
+
+    def _entregar(self, documento):
+        """Publica o documento, repetindo até conseguir: os seguintes esperam, para manter a ordem."""
+        tentativas = 0
+        while True:
+            try:
+                publicar_rastreado(self.destino, documento, self.rastreador)
+                self.contagens["publicados"] += 1
+                return
+            except Exception as e:
+                tentativas += 1
+                espera = min(ESPERA_MAXIMA, 0.5 * 2 ** (tentativas - 1))
+                self.contagens["falhas"] += 1
+                print(f"[Outbox] {self.nome}: evento {documento['_id']} falhou ({e}), nova tentativa em {espera:g}s")
+                time.sleep(espera)
+
+    def _seguir(self):
+        opcoes = {"resume_after": self.retoma} if self.retoma is not None else {}
+        with self.colecao.watch([{"$match": {"operationType": "insert"}}], **opcoes) as stream:
+            self.modo = "change_stream"
+            for mudanca in stream:
+                # Só avança depois de entregue: um reinício do stream retoma neste evento
+                self._entregar(mudanca["fullDocument"])
+                self.retoma = mudanca["_id"]
+
+    def _sondar(self):
+        self.modo = "leitura"
+        ultimo = self.colecao.find_one({}, {"ordem": 1}, sort=[("ordem", -1)])
+        recente = ultimo["ordem"] if ultimo is not None else Timestamp(0, 0)
+        # Os eventos que já estavam gravados ao arrancar não são publicados
+        desde = Timestamp(max(recente.time - self.janela, 0), 0)
+        publicados = {d["_id"]: d["ordem"] for d in self.colecao.find({"ordem": {"$gt": desde}}, {"ordem": 1})}
+        while True:
+            try:
+                desde = Timestamp(max(recente.time - self.janela, 0), 0)
+                for documento in self.colecao.find({"ordem": {"$gt": desde}}).sort([("ordem", 1), ("_id", 1)]):
+                    if documento["_id"] in publicados:
+                        continue
+                    self._entregar(documento)
+                    publicados[documento["_id"]] = documento["ordem"]
+                    recente = max(recente, documento["ordem"])
+                # Fora da janela já não volta a aparecer
+                publicados = {i: ordem for i, ordem in publicados.items() if ordem > desde}
+            except PyMongoError as e:
+                print(f"[Outbox] Seguidor {self.nome}: {e}")
+            self.acordado.wait(self.intervalo)
+            self.acordado.clear()
+
+    def correr(self):
+        """Ciclo do seguidor, numa thread (ou green thread do eventlet) própria."""
+        while True:
+            try:
+                self._seguir()
+            except OperationFailure as e:
+                if e.code == SEM_REPLICA_SET:
+                    self._sondar()
+                print(f"[Outbox] Seguidor {self.nome}: {e}")
+            except PyMongoError as e:
+                print(f"[Outbox] Seguidor {self.nome}: {e}")
+            self.acordado.wait(self.intervalo)
+            self.acordado.clear()
+
+    def estatisticas(self):
+        return {**self.contagens, "destino": self.nome, "modo": self.modo}
@@ -25,7 +25,7 @@ _sym_db = _symbol_database.Default()
 from google.protobuf import empty_pb2 as google_dot_protobuf_dot_empty__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0eprodutos.proto\x12\x08\x63\x61talogo\x1a\x1bgoogle/protobuf/empty.proto\"\x86\x01\n\x07Produto\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x0c\n\x04nome\x18\x02 \x01(\t\x12\r\n\x05marca\x18\x03 \x01(\t\x12\r\n\x05preco\x18\x04 \x01(\x02\x12\r\n\x05stock\x18\x05 \x01(\x05\x12\x0c\n\x04tela\x18\x06 \x01(\t\x12\x0f\n\x07\x62\x61teria\x18\x07 \x01(\t\x12\x15\n\rarmazenamento\x18\x08 \x01(\t\"\x17\n\tProdutoId\x12\n\n\x02id\x18\x01 \x01(\x05\"4\n\x0fProdutoResponse\x12\x0f\n\x07sucesso\x18\x01 \x01(\x08\x12\x10\n\x08mensagem\x18\x02 \x01(\t\"4\n\rListaProdutos\x12#\n\x08produtos\x18\x01 \x03(\x0b\x32\x11.catalogo.Produto2\xdb\x02\n\x0eProdutoService\x12\x41\n\x0eListarProdutos\x12\x16.google.protobuf.Empty\x1a\x17.catalogo.ListaProdutos\x12@\n\x10\x41\x64icionarProduto\x12\x11.catalogo.Produto\x1a\x19.catalogo.ProdutoResponse\x12=\n\rEditarProduto\x12\x11.catalogo.Produto\x1a\x19.catalogo.ProdutoResponse\x12@\n\x0eRemoverProduto\x12\x13.catalogo.ProdutoId\x1a\x19.catalogo.ProdutoResponse\x12\x43\n\x14ListarProdutosStream\x12\x16.google.protobuf.Empty\x1a\x11.catalogo.Produto0\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0eprodutos.proto\x12\x08\x63\x61talogo\x1a\x1bgoogle/protobuf/empty.proto\"\x96\x01\n\x07Produto\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x0c\n\x04nome\x18\x02 \x01(\t\x12\r\n\x05marca\x18\x03 \x01(\t\x12\r\n\x05preco\x18\x04 \x01(\x02\x12\r\n\x05stock\x18\x05 \x01(\x05\x12\x0c\n\x04tela\x18\x06 \x01(\t\x12\x0f\n\x07\x62\x61teria\x18\x07 \x01(\t\x12\x15\n\rarmazenamento\x18\x08 \x01(\t\x12\x0e\n\x06versao\x18\t \x01(\x03\"\x17\n\tProdutoId\x12\n\n\x02id\x18\x01 \x01(\x05\"4\n\x0fProdutoResponse\x12\x0f\n\x07sucesso\x18\x01 \x01(\x08\x12\x10\n\x08mensagem\x18\x02 \x01(\t\"4\n\rListaProdutos\x12#\n\x08produtos\x18\x01 \x03(\x0b\x32\x11.catalogo.Produto\"(\n\x0b\x41justeStock\x12\n\n\x02id\x18\x01 \x01(\x05\x12\r\n\x05\x64\x65lta\x18\x02 \x01(\x05\"^\n\x0eResultadoStock\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x0f\n\x07sucesso\x18\x02 \x01(\x08\x12\x10\n\x08mensagem\x18\x03 \x01(\t\x12\r\n\x05stock\x18\x04 \x01(\x05\x12\x0e\n\x06\x63odigo\x18\x05 \x01(\t\"6\n\x0c\x41justesStock\x12&\n\x07\x61justes\x18\x01 \x03(\x0b\x32\x15.catalogo.AjusteStock\"?\n\x0fResultadosStock\x12,\n\nresultados\x18\x01 \x03(\x0b\x32\x18.catalogo.ResultadoStock\"-\n\x0bItemReserva\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x12\n\nquantidade\x18\x02 \x01(\x05\"K\n\rPedidoReserva\x12$\n\x05itens\x18\x01 \x03(\x0b\x32\x15.catalogo.ItemReserva\x12\x14\n\x0cttl_segundos\x18\x02 \x01(\x05\"\xa5\x01\n\x07Reserva\x12\x0f\n\x07sucesso\x18\x01 \x01(\x08\x12\x10\n\x08mensagem\x18\x02 \x01(\t\x12\n\n\x02id\x18\x03 \x01(\t\x12\x0e\n\x06\x65stado\x18\x04 \x01(\t\x12$\n\x05itens\x18\x05 \x03(\x0b\x32\x15.catalogo.ItemReserva\x12\x11\n\texpira_em\x18\x06 \x01(\x03\x12\x0e\n\x06\x63odigo\x18\x07 \x01(\t\x12\x12\n\nproduto_id\x18\x08 \x01(\x05\"\x17\n\tReservaId\x12\n\n\x02id\x18\x01 \x01(\t\"1\n\x10PedidoAlteracoes\x12\r\n\x05\x64\x65sde\x18\x01 \x01(\x03\x12\x0e\n\x06limite\x18\x02 \x01(\x05\"c\n\nAlteracoes\x12#\n\x08produtos\x18\x01 \x03(\x0b\x32\x11.catalogo.Produto\x12\x11\n\tremovidos\x18\x02 \x03(\x05\x12\x0f\n\x07proximo\x18\x03 \x01(\x03\x12\x0c\n\x04mais\x18\x04 \x01(\x08\x32\xdd\x05\n\x0eProdutoService\x12\x41\n\x0eListarProdutos\x12\x16.google.protobuf.Empty\x1a\x17.catalogo.ListaProdutos\x12@\n\x10\x41\x64icionarProduto\x12\x11.catalogo.Produto\x1a\x19.catalogo.ProdutoResponse\x12=\n\rEditarProduto\x12\x11.catalogo.Produto\x1a\x19.catalogo.ProdutoResponse\x12@\n\x0eRemoverProduto\x12\x13.catalogo.ProdutoId\x1a\x19.catalogo.ProdutoResponse\x12\x43\n\x14ListarProdutosStream\x12\x16.google.protobuf.Empty\x1a\x11.catalogo.Produto0\x01\x12?\n\x0c\x41justarStock\x12\x15.catalogo.AjusteStock\x1a\x18.catalogo.ResultadoStock\x12\x45\n\x10\x41justarStockLote\x12\x16.catalogo.AjustesStock\x1a\x19.catalogo.ResultadosStock\x12;\n\rReservarStock\x12\x17.catalogo.PedidoReserva\x1a\x11.catalogo.Reserva\x12:\n\x10\x43onfirmarReserva\x12\x13.catalogo.ReservaId\x1a\x11.catalogo.Reserva\x12\x39\n\x0f\x43\x61ncelarReserva\x12\x13.catalogo.ReservaId\x1a\x11.catalogo.Reserva\x12\x44\n\x10ListarAlteracoes\x12\x1a.catalogo.PedidoAlteracoes\x1a\x14.catalogo.Alteracoesb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -33,13 +33,33 @@ _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'produtos_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
   _globals['_PRODUTO']._serialized_start=58
-  _globals['_PRODUTO']._serialized_end=192
-  _globals['_PRODUTOID']._serialized_start=194
-  _globals['_PRODUTOID']._serialized_end=217
-  _globals['_PRODUTORESPONSE']._serialized_start=219
-  _globals['_PRODUTORESPONSE']._serialized_end=271
-  _globals['_LISTAPRODUTOS']._serialized_start=273
-  _globals['_LISTAPRODUTOS']._serialized_end=325
-  _globals['_PRODUTOSERVICE']._serialized_start=328
-  _globals['_PRODUTOSERVICE']._serialized_end=675
+  _globals['_PRODUTO']._serialized_end=208
+  _globals['_PRODUTOID']._serialized_start=210
+  _globals['_PRODUTOID']._serialized_end=233
+  _globals['_PRODUTORESPONSE']._serialized_start=235
+  _globals['_PRODUTORESPONSE']._serialized_end=287
+  _globals['_LISTAPRODUTOS']._serialized_start=289
+  _globals['_LISTAPRODUTOS']._serialized_end=341
+  _globals['_AJUSTESTOCK']._serialized_start=343
+  _globals['_AJUSTESTOCK']._serialized_end=383
+  _globals['_RESULTADOSTOCK']._serialized_start=385
+  _globals['_RESULTADOSTOCK']._serialized_end=479
+  _globals['_AJUSTESSTOCK']._serialized_start=481
+  _globals['_AJUSTESSTOCK']._serialized_end=535
+  _globals['_RESULTADOSSTOCK']._serialized_start=537
+  _globals['_RESULTADOSSTOCK']._serialized_end=600
+  _globals['_ITEMRESERVA']._serialized_start=602
+  _globals['_ITEMRESERVA']._serialized_end=647
+  _globals['_PEDIDORESERVA']._serialized_start=649
+  _globals['_PEDIDORESERVA']._serialized_end=724
+  _globals['_RESERVA']._serialized_start=727
+  _globals['_RESERVA']._serialized_end=892
+  _globals['_RESERVAID']._serialized_start=894
+  _globals['_RESERVAID']._serialized_end=917
+  _globals['_PEDIDOALTERACOES']._serialized_start=919
+  _globals['_PEDIDOALTERACOES']._serialized_end=968
+  _globals['_ALTERACOES']._serialized_start=970
+  _globals['_ALTERACOES']._serialized_end=1069
+  _globals['_PRODUTOSERVICE']._serialized_start=1072
+  _globals['_PRODUTOSERVICE']._serialized_end=1805
 # @@protoc_insertion_point(module_scope)
@@ -60,6 +60,36 @@ class ProdutoServiceStub(object):
                 request_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
                 response_deserializer=produtos__pb2.Produto.FromString,
                 _registered_method=True)
+        self.AjustarStock = channel.unary_unary(
+                '/catalogo.ProdutoService/AjustarStock',
+                request_serializer=produtos__pb2.AjusteStock.SerializeToString,
+                response_deserializer=produtos__pb2.ResultadoStock.FromString,
+                _registered_method=True)
+        self.AjustarStockLote = channel.unary_unary(
+                '/catalogo.ProdutoService/AjustarStockLote',
+                request_serializer=produtos__pb2.AjustesStock.SerializeToString,
+                response_deserializer=produtos__pb2.ResultadosStock.FromString,
+                _registered_method=True)
+        self.ReservarStock = channel.unary_unary(
+                '/catalogo.ProdutoService/ReservarStock',
+                request_serializer=produtos__pb2.PedidoReserva.SerializeToString,
+                response_deserializer=produtos__pb2.Reserva.FromString,
+                _registered_method=True)
+        self.ConfirmarReserva = channel.unary_unary(
+                '/catalogo.ProdutoService/ConfirmarReserva',
+                request_serializer=produtos__pb2.ReservaId.SerializeToString,
+                response_deserializer=produtos__pb2.Reserva.FromString,
+                _registered_method=True)
+        self.CancelarReserva = channel.unary_unary(
+                '/catalogo.ProdutoService/CancelarReserva',
+                request_serializer=produtos__pb2.ReservaId.SerializeToString,
+                response_deserializer=produtos__pb2.Reserva.FromString,
+                _registered_method=True)
+        self.ListarAlteracoes = channel.unary_unary(
+                '/catalogo.ProdutoService/ListarAlteracoes',
+                request_serializer=produtos__pb2.PedidoAlteracoes.SerializeToString,
+                response_deserializer=produtos__pb2.Alteracoes.FromString,
+                _registered_method=True)
 
 
 class ProdutoServiceServicer(object):
@@ -95,6 +125,43 @@ class ProdutoServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def AjustarStock(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def AjustarStockLote(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReservarStock(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ConfirmarReserva(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CancelarReserva(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListarAlteracoes(self, request, context):
+        """FAILED_PRECONDITION se as remoções depois de `desde` já foram apagadas (ressincronizar com desde=0)
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ProdutoServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -123,6 +190,36 @@ def add_ProdutoServiceServicer_to_server(servicer, server):
                     request_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
                     response_serializer=produtos__pb2.Produto.SerializeToString,
             ),
+            'AjustarStock': grpc.unary_unary_rpc_method_handler(
+                    servicer.AjustarStock,
+                    request_deserializer=produtos__pb2.AjusteStock.FromString,
+                    response_serializer=produtos__pb2.ResultadoStock.SerializeToString,
+            ),
+            'AjustarStockLote': grpc.unary_unary_rpc_method_handler(
+                    servicer.AjustarStockLote,
+                    request_deserializer=produtos__pb2.AjustesStock.FromString,
+                    response_serializer=produtos__pb2.ResultadosStock.SerializeToString,
+            ),
+            'ReservarStock': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReservarStock,
+                    request_deserializer=produtos__pb2.PedidoReserva.FromString,
+                    response_serializer=produtos__pb2.Reserva.SerializeToString,
+            ),
+            'ConfirmarReserva': grpc.unary_unary_rpc_method_handler(
+                    servicer.ConfirmarReserva,
+                    request_deserializer=produtos__pb2.ReservaId.FromString,
+                    response_serializer=produtos__pb2.Reserva.SerializeToString,
+            ),
+            'CancelarReserva': grpc.unary_unary_rpc_method_handler(
+                    servicer.CancelarReserva,
+                    request_deserializer=produtos__pb2.ReservaId.FromString,
+                    response_serializer=produtos__pb2.Reserva.SerializeToString,
+            ),
+            'ListarAlteracoes': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListarAlteracoes,
+                    request_deserializer=produtos__pb2.PedidoAlteracoes.FromString,
+                    response_serializer=produtos__pb2.Alteracoes.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'catalogo.ProdutoService', rpc_method_handlers)
@@ -268,3 +365,165 @@ class ProdutoService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def AjustarStock(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/catalogo.ProdutoService/AjustarStock',
+            produtos__pb2.AjusteStock.SerializeToString,
+            produtos__pb2.ResultadoStock.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def AjustarStockLote(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/catalogo.ProdutoService/AjustarStockLote',
+            produtos__pb2.AjustesStock.SerializeToString,
+            produtos__pb2.ResultadosStock.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReservarStock(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/catalogo.ProdutoService/ReservarStock',
+            produtos__pb2.PedidoReserva.SerializeToString,
+            produtos__pb2.Reserva.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ConfirmarReserva(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/catalogo.ProdutoService/ConfirmarReserva',
+            produtos__pb2.ReservaId.SerializeToString,
+            produtos__pb2.Reserva.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CancelarReserva(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/catalogo.ProdutoService/CancelarReserva',
+            produtos__pb2.ReservaId.SerializeToString,
+            produtos__pb2.Reserva.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ListarAlteracoes(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/catalogo.ProdutoService/ListarAlteracoes',
+            produtos__pb2.PedidoAlteracoes.SerializeToString,
+            produtos__pb2.Alteracoes.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
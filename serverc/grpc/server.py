@@ -1,7 +1,7 @@
 import grpc
 from concurrent import futures
 import time
-from pymongo import MongoClient
+from datetime import timezone
 from google.protobuf import empty_pb2
 import os
 import produtos_pb2
@@ -12,16 +12,59 @@ from jose.utils import base64url_decode
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
 import requests
+import threading
+from pymongo.errors import OperationFailure
+from stock import GestorStock, ErroStock
+from admissao import ControloAdmissao, Recusado
+from rastreio import Rastreador
+from ligacao import LigacaoMongo
+from outbox import Outbox, Relay, DestinoRabbitMQ, evento
+from versoes import VersaoExpirada, LIMITE_ALTERACOES, primeira_versao, nova_versao
+
+# === Rastreio de pedidos (RASTREIO_FICHEIRO ou RASTREIO_OTLP_URL) ===
+rastreador = Rastreador.do_ambiente("grpc")
 
 # === MongoDB ===
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://192.168.2.110:27017")
-client = MongoClient(MONGO_URL)
-db = client["catalogo"]
+ligacao = LigacaoMongo.do_ambiente(rastreador, "mongodb://192.168.2.110:27017")
+client = ligacao.client
+db = ligacao.db
 colecao = db["produtos"]
+# ListarProdutos e ListarProdutosStream podem ler dos secundários
+colecao_leituras = ligacao.leituras(colecao)
+
+def criar_indice_ids():
+    # Garante no servidor um produto por id, também entre escritas concorrentes de serviços diferentes
+    try:
+        colecao.create_index("id", unique=True)
+    except OperationFailure as e:
+        print(f"Não foi possível criar o índice único de 'id' (ids repetidos na coleção?): {e}")
+
+
+# === Eventos de alteração (outbox gravado na mesma transação que a escrita) ===
+# Publicados pelo Seguidor do REST (Socket.IO) e pelo relay RabbitMQ dos quatro servidores
+outbox = Outbox.do_ambiente(db, "grpc", rastreador)
+# Só o relay com o arrendamento publica; este toma-o se o dos outros servidores parar
+relay_rabbitmq = Relay.do_ambiente(db, DestinoRabbitMQ.do_ambiente(rastreador), rastreador)
+outbox.ouvintes.append(relay_rabbitmq.acordar)
+
+# === Sincronização incremental (versão global gravada em cada escrita) ===
+versoes = outbox.versoes
+
+# === Stock e reservas ===
+gestor_stock = GestorStock(colecao, db["reservas"], outbox)
+RESERVA_TTL = int(os.getenv("RESERVA_TTL", "900"))
+RESERVA_TTL_MAXIMO = int(os.getenv("RESERVA_TTL_MAXIMO", "86400"))
+INTERVALO_EXPIRACAO = float(os.getenv("RESERVA_INTERVALO_EXPIRACAO", "5"))
+# Ajustes por AjustarStockLote (em transações de AJUSTES_POR_TRANSACAO ajustes)
+BATCH_MAXIMO = int(os.getenv("GRPC_BATCH_MAXIMO", "10000"))
+
+# === Controlo de admissão (taxa por utilizador e vagas por RPC) ===
+# As listagens devolvem o catálogo inteiro: custam mais e têm menos vagas
+admissao = ControloAdmissao.do_ambiente(pesadas=("ListarProdutos", "ListarProdutosStream"))
 
 # === Keycloak JWT Config ===
 KEYCLOAK_REALM = "catalogo-produtos"
-KEYCLOAK_URL = "http://192.168.2.122:8080"
+KEYCLOAK_URL = os.getenv("KEYCLOAK_URL", "http://192.168.2.122:8080")
 KEYCLOAK_ISSUER = f"{KEYCLOAK_URL}/realms/{KEYCLOAK_REALM}"
 JWKS_URL = f"{KEYCLOAK_ISSUER}/protocol/openid-connect/certs"
 jwks = requests.get(JWKS_URL).json()
@@ -35,6 +78,7 @@ def jwk_to_rsa_key(jwk):
     )
     return public_numbers.public_key(backend=default_backend())
 
+@rastreador.rastrear("validar_token")
 def validar_token(token):
     try:
         header = jwt.get_unverified_header(token)
@@ -54,7 +98,7 @@ def validar_token(token):
         print(f"[JWT inválido] {e}")
         return None
 
-def obter_payload_jwt(context):
+def obter_payload_jwt(context, operacao):
     metadata = dict(context.invocation_metadata())
     auth = metadata.get("authorization")
     if not auth or not auth.startswith("Bearer "):
@@ -63,30 +107,112 @@ def obter_payload_jwt(context):
     payload = validar_token(token)
     if not payload:
         context.abort(grpc.StatusCode.UNAUTHENTICATED, "Token inválido ou expirado")
+    try:
+        with rastreador.span("admissao"):
+            bilhete = admissao.entrar(payload.get("preferred_username", "desconhecido"), operacao)
+    except Recusado as e:
+        context.set_trailing_metadata((("retry-after", str(e.segundos)), ("motivo", e.motivo)))
+        context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, e.mensagem)
+    # A vaga fica ocupada até a chamada terminar, incluindo as streams
+    context.add_callback(bilhete.sair)
     return payload
 
+def reserva_para_proto(reserva, mensagem):
+    return produtos_pb2.Reserva(
+        sucesso=True,
+        mensagem=mensagem,
+        id=str(reserva["_id"]),
+        estado=reserva["estado"],
+        itens=[produtos_pb2.ItemReserva(id=i["id"], quantidade=i["quantidade"]) for i in reserva["itens"]],
+        expira_em=int(reserva["expira_em"].replace(tzinfo=timezone.utc).timestamp())
+    )
+
+def produto_para_proto(p):
+    caracteristicas = p.get("caracteristicas", {})
+    return produtos_pb2.Produto(
+        id=p["id"],
+        nome=p["nome"],
+        marca=p["marca"],
+        preco=p["preco"],
+        stock=p["stock"],
+        tela=caracteristicas.get("tela", "n/a"),
+        bateria=caracteristicas.get("bateria", "n/a"),
+        armazenamento=caracteristicas.get("armazenamento", "n/a"),
+        versao=p.get("versao", 0)
+    )
+
+def falha_reserva(e):
+    return produtos_pb2.Reserva(sucesso=False, mensagem=e.mensagem, codigo=e.codigo, produto_id=e.produto_id or 0)
+
+class InterceptorRastreio(grpc.ServerInterceptor):
+    """Um span por RPC, filho do traceparent recebido nos metadados."""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or not rastreador.ativo:
+            return handler
+        metodo = handler_call_details.method.rsplit("/", 1)[-1]
+        traceparent = dict(handler_call_details.invocation_metadata).get("traceparent")
+
+        def abrir():
+            return rastreador.pedido(f"gRPC {metodo}", traceparent, **{"rpc.system": "grpc", "rpc.method": metodo})
+
+        if handler.unary_unary:
+            def unario(request, context):
+                with abrir() as span:
+                    try:
+                        return handler.unary_unary(request, context)
+                    finally:
+                        registar_estado(span, context)
+            return handler._replace(unary_unary=unario)
+        if handler.unary_stream:
+            def stream(request, context):
+                # O span cobre a stream inteira, não só a criação do gerador
+                with abrir() as span:
+                    try:
+                        yield from handler.unary_stream(request, context)
+                    finally:
+                        registar_estado(span, context)
+            return handler._replace(unary_stream=stream)
+        return handler
+
+def registar_estado(span, context):
+    codigo = context.code()
+    if span is None or codigo is None:
+        return
+    span.definir("rpc.grpc.status_code", codigo.value[0])
+    if codigo != grpc.StatusCode.OK:
+        detalhes = context.details()
+        # Algumas versões do grpcio devolvem os detalhes em bytes
+        if isinstance(detalhes, bytes):
+            detalhes = detalhes.decode("utf-8", "replace")
+        span.falhar(detalhes or codigo.name)
+
 class ProdutoService(produtos_pb2_grpc.ProdutoServiceServicer):
 
     def ListarProdutos(self, request, context):
-        obter_payload_jwt(context)  # Verifica token
+        obter_payload_jwt(context, "ListarProdutos")  # Verifica token
+        produtos = list(colecao_leituras.find({}, {"_id": 0}))
         resposta = produtos_pb2.ListaProdutos()
-        for p in colecao.find({}, {"_id": 0}):
-            produto = produtos_pb2.Produto(
-                id=p["id"],
-                nome=p["nome"],
-                marca=p["marca"],
-                preco=p["preco"],
-                stock=p["stock"],
-                tela=p.get("caracteristicas", {}).get("tela", "n/a"),
-                bateria=p.get("caracteristicas", {}).get("bateria", "n/a"),
-                armazenamento=p.get("caracteristicas", {}).get("armazenamento", "n/a")
-            )
-            resposta.produtos.append(produto)
+        with rastreador.span("serializar", produtos=len(produtos)):
+            for p in produtos:
+                produto = produtos_pb2.Produto(
+                    id=p["id"],
+                    nome=p["nome"],
+                    marca=p["marca"],
+                    preco=p["preco"],
+                    stock=p["stock"],
+                    tela=p.get("caracteristicas", {}).get("tela", "n/a"),
+                    bateria=p.get("caracteristicas", {}).get("bateria", "n/a"),
+                    armazenamento=p.get("caracteristicas", {}).get("armazenamento", "n/a"),
+                    versao=p.get("versao", 0)
+                )
+                resposta.produtos.append(produto)
         return resposta
 
     def ListarProdutosStream(self, request, context):
-        obter_payload_jwt(context)
-        for p in colecao.find({}, {"_id": 0}):
+        obter_payload_jwt(context, "ListarProdutosStream")
+        for p in colecao_leituras.find({}, {"_id": 0}):
             yield produtos_pb2.Produto(
                 id=p["id"],
                 nome=p["nome"],
@@ -95,11 +221,12 @@ class ProdutoService(produtos_pb2_grpc.ProdutoServiceServicer):
                 stock=p["stock"],
                 tela=p.get("caracteristicas", {}).get("tela", "n/a"),
                 bateria=p.get("caracteristicas", {}).get("bateria", "n/a"),
-                armazenamento=p.get("caracteristicas", {}).get("armazenamento", "n/a")
+                armazenamento=p.get("caracteristicas", {}).get("armazenamento", "n/a"),
+                versao=p.get("versao", 0)
             )
 
     def AdicionarProduto(self, request, context):
-        payload = obter_payload_jwt(context)
+        payload = obter_payload_jwt(context, "AdicionarProduto")
         utilizador = payload.get("preferred_username", "desconhecido")
 
         if colecao.find_one({"id": request.id}):
@@ -117,49 +244,145 @@ class ProdutoService(produtos_pb2_grpc.ProdutoServiceServicer):
                 "armazenamento": request.armazenamento
             }
         }
-        colecao.insert_one(produto)
+        dados = dict(produto)
+
+        def escrever(sessao, versao):
+            colecao.insert_one(primeira_versao(produto, versao), session=sessao)
+            return None, [evento("novo_produto", [request.id], dados, utilizador)]
+
+        outbox.gravar(escrever)
         print(f"{utilizador} adicionou o produto {request.nome} via gRPC")
         return produtos_pb2.ProdutoResponse(sucesso=True, mensagem="Produto adicionado com sucesso.")
 
     def EditarProduto(self, request, context):
-        payload = obter_payload_jwt(context)
+        payload = obter_payload_jwt(context, "EditarProduto")
         utilizador = payload.get("preferred_username", "desconhecido")
 
-        resultado = colecao.update_one(
-            {"id": request.id},
-            {"$set": {
-                "nome": request.nome,
-                "marca": request.marca,
-                "preco": request.preco,
-                "stock": request.stock,
-                "caracteristicas": {
-                    "tela": request.tela,
-                    "bateria": request.bateria,
-                    "armazenamento": request.armazenamento
-                }
-            }}
-        )
-        if resultado.matched_count == 0:
+        campos = {
+            "nome": request.nome,
+            "marca": request.marca,
+            "preco": request.preco,
+            "stock": request.stock,
+            "caracteristicas": {
+                "tela": request.tela,
+                "bateria": request.bateria,
+                "armazenamento": request.armazenamento
+            }
+        }
+
+        def escrever(sessao, versao):
+            resultado = colecao.update_one({"id": request.id}, nova_versao({"$set": campos}, versao), session=sessao)
+            if resultado.matched_count == 0:
+                return False, []
+            return True, [evento("produto_editado", [request.id], {"id": request.id, **campos}, utilizador)]
+
+        if not outbox.gravar(escrever):
             return produtos_pb2.ProdutoResponse(sucesso=False, mensagem="Produto não encontrado.")
         print(f"{utilizador} editou o produto {request.id} via gRPC")
         return produtos_pb2.ProdutoResponse(sucesso=True, mensagem="Produto editado com sucesso.")
 
     def RemoverProduto(self, request, context):
-        payload = obter_payload_jwt(context)
+        payload = obter_payload_jwt(context, "RemoverProduto")
         utilizador = payload.get("preferred_username", "desconhecido")
 
-        resultado = colecao.delete_one({"id": request.id})
-        if resultado.deleted_count == 0:
+        def escrever(sessao, versao):
+            resultado = colecao.delete_one({"id": request.id}, session=sessao)
+            if resultado.deleted_count == 0:
+                return False, []
+            return True, [evento("produto_removido", [request.id], {"id": request.id}, utilizador, [request.id])]
+
+        if not outbox.gravar(escrever):
             return produtos_pb2.ProdutoResponse(sucesso=False, mensagem="Produto não encontrado.")
         print(f"{utilizador} removeu o produto {request.id} via gRPC")
         return produtos_pb2.ProdutoResponse(sucesso=True, mensagem="Produto removido com sucesso.")
 
+    def AjustarStock(self, request, context):
+        obter_payload_jwt(context, "AjustarStock")
+        try:
+            stock = gestor_stock.ajustar(request.id, request.delta)
+        except ErroStock as e:
+            return produtos_pb2.ResultadoStock(id=request.id, sucesso=False, mensagem=e.mensagem, codigo=e.codigo)
+        return produtos_pb2.ResultadoStock(id=request.id, sucesso=True, mensagem="Stock atualizado.", stock=stock)
+
+    def AjustarStockLote(self, request, context):
+        obter_payload_jwt(context, "AjustarStockLote")
+        if len(request.ajustes) > BATCH_MAXIMO:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"Máximo de {BATCH_MAXIMO} ajustes por pedido")
+        resultados = gestor_stock.ajustar_lote([(a.id, a.delta) for a in request.ajustes])
+        resposta = produtos_pb2.ResultadosStock()
+        for r in resultados:
+            resposta.resultados.append(produtos_pb2.ResultadoStock(
+                id=r["id"],
+                sucesso=r["ok"],
+                mensagem=r.get("mensagem", "Stock atualizado."),
+                stock=r.get("stock", 0),
+                codigo=r.get("codigo", "")
+            ))
+        return resposta
+
+    def ReservarStock(self, request, context):
+        payload = obter_payload_jwt(context, "ReservarStock")
+        ttl = request.ttl_segundos or RESERVA_TTL
+        if not request.itens or not 0 < ttl <= RESERVA_TTL_MAXIMO:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"São precisos itens e um ttl entre 1 e {RESERVA_TTL_MAXIMO} segundos")
+        try:
+            reserva = gestor_stock.reservar(
+                [(i.id, i.quantidade) for i in request.itens],
+                ttl,
+                payload.get("preferred_username")
+            )
+        except ErroStock as e:
+            return falha_reserva(e)
+        return reserva_para_proto(reserva, "Reserva criada.")
+
+    def ConfirmarReserva(self, request, context):
+        payload = obter_payload_jwt(context, "ConfirmarReserva")
+        try:
+            reserva = gestor_stock.confirmar(request.id, payload.get("preferred_username"))
+            return reserva_para_proto(reserva, "Reserva confirmada.")
+        except ErroStock as e:
+            return falha_reserva(e)
+
+    def CancelarReserva(self, request, context):
+        payload = obter_payload_jwt(context, "CancelarReserva")
+        try:
+            reserva = gestor_stock.cancelar(request.id, payload.get("preferred_username"))
+            return reserva_para_proto(reserva, "Reserva cancelada.")
+        except ErroStock as e:
+            return falha_reserva(e)
+
+    def ListarAlteracoes(self, request, context):
+        obter_payload_jwt(context, "ListarAlteracoes")
+        limite = request.limite or 1000
+        if not 0 < limite <= LIMITE_ALTERACOES:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"'limite' tem de estar entre 1 e {LIMITE_ALTERACOES}")
+        if request.desde < 0:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "'desde' tem de ser uma versão devolvida em 'proximo'")
+        try:
+            alteracoes = versoes.alteracoes(request.desde, limite)
+        except VersaoExpirada as e:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, str(e))
+        return produtos_pb2.Alteracoes(
+            produtos=[produto_para_proto(p) for p in alteracoes["produtos"]],
+            removidos=alteracoes["removidos"],
+            proximo=alteracoes["proximo"],
+            mais=alteracoes["mais"]
+        )
+
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), interceptors=[InterceptorRastreio()])
     produtos_pb2_grpc.add_ProdutoServiceServicer_to_server(ProdutoService(), server)
     server.add_insecure_port('[::]:50051')
     print("gRPC server a correr em http://localhost:50051")
     server.start()
+    criar_indice_ids()
+    gestor_stock.criar_indices()
+    threading.Thread(target=gestor_stock.seguir_expiracoes, args=(INTERVALO_EXPIRACAO,), daemon=True).start()
+    relay_rabbitmq.criar_indices()
+    threading.Thread(target=relay_rabbitmq.correr, daemon=True).start()
+    versoes.criar_indices()
+    threading.Thread(target=versoes.manter, daemon=True).start()
     try:
         while True:
             time.sleep(86400)
@@ -0,0 +1,288 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+from outbox import evento, em_partes
+from versoes import nova_versao
+
+# Cópia partilhada com servera/rest/stock.py (cada serviço tem o seu contexto Docker)
+
+# Reservas terminadas (confirmadas, canceladas ou expiradas) ficam um dia para consulta
+RETENCAO_RESERVAS = 24 * 3600
+# ajustar_lote() corre os ajustes em transações de no máximo N, para não passar o limite de duração
+AJUSTES_POR_TRANSACAO = 500
+
+
+class ErroStock(Exception):
+    """Operação de stock recusada; `codigo` é nao_encontrado, insuficiente ou reserva_invalida."""
+
+    def __init__(self, codigo, mensagem, produto_id=None):
+        super().__init__(mensagem)
+        self.codigo = codigo
+        self.mensagem = mensagem
+        self.produto_id = produto_id
+
+
+class AjusteFalhado(Exception):
+    """Um $inc condicional do bulk_write não acertou: anula a transação para repetir ajuste a ajuste."""
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def evento_stock(alterados, utilizador=None):
+    return evento("stock_alterado", [a["id"] for a in alterados], alterados, utilizador)
+
+
+class GestorStock:
+    """Alterações de stock sem ler-modificar-escrever.
+
+    Cada alteração é um único $inc condicional (stock >= quantidade), num
+    find_one_and_update ou num bulk_write, pelo que pedidos concorrentes
+    sobre o mesmo produto nunca se sobrepõem nem deixam o stock negativo.
+    As reservas descontam o stock logo que são criadas e devolvem-no se
+    forem canceladas ou expirarem sem confirmação. Cada alteração grava o seu
+    evento stock_alterado no outbox, na mesma transação.
+    """
+
+    def __init__(self, colecao, reservas, outbox):
+        self.colecao = colecao
+        self.reservas = reservas
+        self.outbox = outbox
+
+    def criar_indices(self):
+        self.reservas.create_index([("estado", 1), ("expira_em", 1)])
+        self.reservas.create_index("terminada_em", expireAfterSeconds=RETENCAO_RESERVAS)
+
+    def _falha(self, produto_id, quantidade, sessao=None):
+        # Só no caminho de erro: distinguir produto inexistente de stock insuficiente
+        produto = self.colecao.find_one({"id": produto_id}, {"_id": 0, "stock": 1}, session=sessao)
+        if produto is None:
+            return ErroStock("nao_encontrado", f"Produto {produto_id} não encontrado", produto_id)
+        return ErroStock(
+            "insuficiente",
+            f"Stock insuficiente para o produto {produto_id} ({produto.get('stock', 0)} < {quantidade})",
+            produto_id
+        )
+
+    @staticmethod
+    def _filtro(produto_id, delta):
+        filtro = {"id": produto_id}
+        if delta < 0:
+            filtro["stock"] = {"$gte": -delta}
+        return filtro
+
+    def _somar(self, produto_id, delta, sessao, versao):
+        """Novo stock, ou None se o produto não existir ou o stock não chegar."""
+        produto = self.colecao.find_one_and_update(
+            self._filtro(produto_id, delta),
+            nova_versao({"$inc": {"stock": delta}}, versao),
+            projection={"_id": 0, "stock": 1},
+            return_document=ReturnDocument.AFTER,
+            session=sessao
+        )
+        return produto["stock"] if produto is not None else None
+
+    def ajustar(self, produto_id, delta):
+        """Soma `delta` ao stock; devolve o novo stock ou levanta ErroStock."""
+        def escrever(sessao, versao):
+            stock = self._somar(produto_id, delta, sessao, versao)
+            if stock is None:
+                return None, []
+            return stock, [evento_stock([{"id": produto_id, "stock": stock}])]
+
+        stock = self.outbox.gravar(escrever)
+        if stock is None:
+            raise self._falha(produto_id, -delta)
+        return stock
+
+    def ajustar_lote(self, ajustes):
+        """Aplica [(id, delta), ...] de forma independente; devolve um resultado por ajuste.
+
+        Os ajustes que falham (stock insuficiente) não são erros de escrita,
+        por isso cada parte de AJUSTES_POR_TRANSACAO ajustes e o seu evento
+        cabem numa só transação.
+        """
+        resultados = []
+        for parte in em_partes(ajustes, AJUSTES_POR_TRANSACAO):
+            try:
+                resultados += self.outbox.gravar(
+                    lambda sessao, versao, parte=parte: self._ajustar_parte(parte, sessao, versao, True)
+                )
+            except AjusteFalhado:
+                resultados += self.outbox.gravar(
+                    lambda sessao, versao, parte=parte: self._ajustar_parte(parte, sessao, versao, False)
+                )
+        return resultados
+
+    def _ajustar_parte(self, ajustes, sessao, versao, em_bulk):
+        # O bulk_write só diz quantos acertaram: sem transação para anular, vai-se ajuste a ajuste
+        if em_bulk and sessao is not None:
+            resultados = self._ajustar_em_bulk(ajustes, sessao, versao)
+        else:
+            resultados = []
+            for produto_id, delta in ajustes:
+                stock = self._somar(produto_id, delta, sessao, versao)
+                if stock is not None:
+                    resultados.append({"id": produto_id, "ok": True, "stock": stock})
+                else:
+                    e = self._falha(produto_id, -delta, sessao)
+                    resultados.append({"id": produto_id, "ok": False, "codigo": e.codigo, "mensagem": e.mensagem})
+        alterados = [{"id": r["id"], "stock": r["stock"]} for r in resultados if r["ok"]]
+        return resultados, [evento_stock(parte) for parte in em_partes(alterados)]
+
+    def _ajustar_em_bulk(self, ajustes, sessao, versao):
+        """Um bulk_write ordenado de $inc condicionais e uma leitura do stock resultante.
+
+        Levanta AjusteFalhado se algum não acertar, para a transação ser
+        anulada e repetida ajuste a ajuste.
+        """
+        resultado = self.colecao.bulk_write([
+            UpdateOne(self._filtro(produto_id, delta), nova_versao({"$inc": {"stock": delta}}, versao))
+            for produto_id, delta in ajustes
+        ], session=sessao)
+        if resultado.matched_count < len(ajustes):
+            raise AjusteFalhado()
+        stock = {p["id"]: p["stock"] for p in self.colecao.find(
+            {"id": {"$in": list({produto_id for produto_id, _ in ajustes})}},
+            {"_id": 0, "id": 1, "stock": 1},
+            session=sessao
+        )}
+        # Com ids repetidos, o stock depois de cada ajuste é o final menos os deltas seguintes
+        resultados = []
+        for produto_id, delta in reversed(ajustes):
+            resultados.append({"id": produto_id, "ok": True, "stock": stock[produto_id]})
+            stock[produto_id] -= delta
+        resultados.reverse()
+        return resultados
+
+    def reservar(self, itens, ttl, utilizador=None):
+        """Reserva [(id, quantidade), ...] por `ttl` segundos; tudo ou nada."""
+        quantidades = Counter()
+        for produto_id, quantidade in itens:
+            if quantidade <= 0:
+                raise ErroStock("reserva_invalida", "As quantidades têm de ser positivas", produto_id)
+            quantidades[produto_id] += quantidade
+
+        def escrever(sessao, versao):
+            # Ordem fixa dos ids para que reservas concorrentes disputem os produtos pela mesma ordem
+            alterados = []
+            try:
+                for produto_id in sorted(quantidades):
+                    stock = self._somar(produto_id, -quantidades[produto_id], sessao, versao)
+                    if stock is None:
+                        raise self._falha(produto_id, quantidades[produto_id], sessao)
+                    alterados.append({"id": produto_id, "stock": stock})
+            except ErroStock:
+                # Numa transação o abort desfaz os descontos; sem transações devolvem-se aqui
+                if sessao is None:
+                    self._devolver({a["id"]: quantidades[a["id"]] for a in alterados}, versao)
+                raise
+
+            reserva = {
+                "_id": ObjectId(),
+                "estado": "ativa",
+                "itens": [
+                    {"id": produto_id, "quantidade": quantidades[produto_id]} for produto_id in sorted(quantidades)
+                ],
+                "utilizador": utilizador,
+                "criada_em": _agora(),
+                "expira_em": _agora() + timedelta(seconds=ttl)
+            }
+            try:
+                self.reservas.insert_one(reserva, session=sessao)
+            except PyMongoError:
+                if sessao is None:
+                    self._devolver(quantidades, versao)
+                raise
+            return reserva, [evento_stock(alterados, utilizador)]
+
+        return self.outbox.gravar(escrever)
+
+    def _devolver(self, quantidades, versao, sessao=None):
+        """Repõe o stock de {id: quantidade}; devolve os produtos alterados com o stock resultante."""
+        alterados = []
+        for produto_id, quantidade in quantidades.items():
+            stock = self._somar(produto_id, quantidade, sessao, versao)
+            if stock is not None:
+                alterados.append({"id": produto_id, "stock": stock})
+        return alterados
+
+    def _terminar(self, reserva_id, estado, filtro_extra=None, sessao=None):
+        try:
+            filtro = {"_id": ObjectId(reserva_id), "estado": "ativa"}
+        except (InvalidId, TypeError):
+            raise ErroStock("reserva_invalida", "Identificador de reserva inválido")
+        filtro.update(filtro_extra or {})
+        # A transição de estado é atómica: só um pedido (ou o expirador) ganha
+        return self.reservas.find_one_and_update(
+            filtro,
+            {"$set": {"estado": estado, "terminada_em": _agora()}},
+            return_document=ReturnDocument.AFTER,
+            session=sessao
+        )
+
+    def _terminar_e_devolver(self, reserva_id, estado, filtro_extra=None):
+        """Termina a reserva e devolve o seu stock, com o evento, numa só transação."""
+        def escrever(sessao, versao):
+            reserva = self._terminar(reserva_id, estado, filtro_extra, sessao)
+            if reserva is None:
+                return None, []
+            alterados = self._devolver({item["id"]: item["quantidade"] for item in reserva["itens"]}, versao, sessao)
+            return reserva, [evento_stock(alterados)] if alterados else []
+
+        return self.outbox.gravar(escrever)
+
+    def confirmar(self, reserva_id, utilizador=None):
+        """Só quem criou a reserva a pode confirmar; a de outro utilizador conta como inexistente."""
+        reserva = self._terminar(
+            reserva_id, "confirmada", {"utilizador": utilizador, "expira_em": {"$gt": _agora()}}
+        )
+        if reserva is None:
+            raise ErroStock("reserva_invalida", "Reserva inexistente, expirada ou já terminada")
+        return reserva
+
+    def cancelar(self, reserva_id, utilizador=None):
+        """Como confirmar(): só quem criou a reserva a pode cancelar."""
+        reserva = self._terminar_e_devolver(reserva_id, "cancelada", {"utilizador": utilizador})
+        if reserva is None:
+            raise ErroStock("reserva_invalida", "Reserva inexistente ou já terminada")
+        return reserva
+
+    def expirar_reservas(self):
+        """Devolve o stock das reservas ativas com prazo ultrapassado; devolve quantas expiraram."""
+        expiradas = 0
+        for reserva in self.reservas.find({"estado": "ativa", "expira_em": {"$lte": _agora()}}, {"_id": 1}):
+            if self._terminar_e_devolver(reserva["_id"], "expirada", {"expira_em": {"$lte": _agora()}}) is not None:
+                expiradas += 1
+        return expiradas
+
+    def seguir_expiracoes(self, intervalo, dormir=time.sleep):
+        """Ciclo de expiração; `dormir` permite usar o sleep do eventlet."""
+        while True:
+            try:
+                expiradas = self.expirar_reservas()
+                if expiradas:
+                    print(f"[Stock] {expiradas} reserva(s) expirada(s), stock devolvido")
+            except PyMongoError as e:
+                print(f"[Stock] Erro ao expirar reservas: {e}")
+            dormir(intervalo)
+
+
+def reserva_publica(reserva):
+    expira_em = reserva["expira_em"]
+    if expira_em.tzinfo is None:
+        # O pymongo devolve datas sem fuso (em UTC)
+        expira_em = expira_em.replace(tzinfo=timezone.utc)
+    return {
+        "reserva": str(reserva["_id"]),
+        "estado": reserva["estado"],
+        "itens": reserva["itens"],
+        "expira_em": expira_em.isoformat()
+    }
@@ -0,0 +1,259 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from pymongo.read_preferences import Primary
+
+# Cópia partilhada com servera/rest/versoes.py, serverb/soap/versoes.py e
+# serverc/graphql/versoes.py (cada serviço tem o seu contexto Docker)
+
+COLECAO_CONTADORES = "contadores"
+COLECAO_REMOVIDOS = "produtos_removidos"
+COLECAO_MARCAS = "versoes_marcas"
+# Documento em `contadores` com a última versão e, sem transações, as versões ainda por gravar
+CONTADOR = "versao"
+# Remoções guardadas por omissão (VERSOES_RETENCAO)
+RETENCAO = 7 * 24 * 3600
+# O índice TTL só apaga as remoções RETENCAO + MARGEM segundos depois; a margem cobre a duração de uma escrita
+MARGEM = 3600
+# Sem transações, uma versão reservada há mais do que isto já não segura o token (escrita abandonada)
+PENDENTE_MAXIMO = 300
+LIMITE_ALTERACOES = 10000
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def _utc(data):
+    # O pymongo devolve datas sem fuso (em UTC)
+    return data.replace(tzinfo=timezone.utc) if data.tzinfo is None else data
+
+
+def primeira_versao(produto, versao):
+    """O produto a inserir, com a versão da escrita."""
+    return {**produto, "versao": versao}
+
+
+def nova_versao(atualizacao, versao):
+    """A mesma atualização, a gravar também a versão da escrita no produto."""
+    return {**atualizacao, "$set": {**atualizacao.get("$set", {}), "versao": versao}}
+
+
+def ids_removidos(eventos):
+    return list(dict.fromkeys(produto_id for e in eventos for produto_id in e.get("removidos", ())))
+
+
+class VersaoExpirada(Exception):
+    """As remoções posteriores à versão pedida já foram apagadas: é preciso ressincronizar do zero."""
+
+
+class Versoes:
+    """Versão de alteração global, para sincronização incremental.
+
+    Cada escrita do Outbox reserva uma versão do contador `versao` antes de
+    escrever e grava-a nos produtos que altera, na mesma escrita; os
+    removidos ficam em produtos_removidos com a mesma versão, apagados pelo
+    índice TTL ao fim de `retencao` segundos. alteracoes(desde) lê pelo
+    índice em `versao` o que mudou depois de `desde`.
+
+    Com transações o contador sobe dentro da transação: duas escritas não
+    podem ambas alterá-lo, por isso as versões ficam pela ordem dos commits
+    e o token é o valor do contador. Sem transações a versão é reservada
+    antes de escrever e fica em `pendentes` até a escrita acabar; o token
+    fica abaixo da menor versão pendente.
+
+    As marcas (valor do contador, instante) gravadas por manter() dizem até
+    que versão as remoções já podem ter sido apagadas.
+    """
+
+    def __init__(self, db, retencao=RETENCAO, intervalo=60.0):
+        # No primário, para verem as escritas que o contador já conta
+        self.produtos = db["produtos"].with_options(read_preference=Primary())
+        self.removidos = db[COLECAO_REMOVIDOS]
+        self.contadores = db[COLECAO_CONTADORES]
+        self.marcas = db[COLECAO_MARCAS]
+        self.retencao = retencao
+        self.intervalo = intervalo
+        # Último valor do contador visto por este processo: palpite para a próxima reserva sem transações
+        self.ultima = 0
+
+    @classmethod
+    def do_ambiente(cls, db):
+        """VERSOES_RETENCAO: segundos que as remoções ficam guardadas; VERSOES_INTERVALO: entre marcas."""
+        return cls(
+            db,
+            retencao=float(os.getenv("VERSOES_RETENCAO", str(RETENCAO))),
+            intervalo=float(os.getenv("VERSOES_INTERVALO", "60"))
+        )
+
+    def criar_indices(self):
+        self.produtos.create_index("versao")
+        self.removidos.create_index("id", unique=True)
+        self.removidos.create_index("versao")
+        self.removidos.create_index("removido_em", expireAfterSeconds=int(self.retencao + MARGEM))
+        self.marcas.create_index("em", expireAfterSeconds=int(2 * self.retencao))
+
+    @staticmethod
+    def _tombstones(ids, versao):
+        agora = _agora()
+        return [UpdateOne({"id": produto_id}, {"$set": {"versao": versao, "removido_em": agora}}, upsert=True)
+                for produto_id in ids]
+
+    # === Servidores síncronos (pymongo) ===
+    def reservar(self, sessao=None):
+        """Versão da escrita; sem sessão fica pendente até libertar()."""
+        if sessao is not None:
+            contador = self.contadores.find_one_and_update(
+                {"_id": CONTADOR}, {"$inc": {"valor": 1}},
+                upsert=True, return_document=ReturnDocument.AFTER, session=sessao
+            )
+            return contador["valor"]
+        while True:
+            # Compare-and-set: o valor e a versão pendente mudam juntos, numa só atualização
+            versao = self.ultima + 1
+            if self.contadores.find_one_and_update(
+                {"_id": CONTADOR, "valor": self.ultima},
+                {"$set": {"valor": versao}, "$push": {"pendentes": {"versao": versao, "em": _agora()}}}
+            ) is not None:
+                self.ultima = versao
+                return versao
+            contador = self.contadores.find_one({"_id": CONTADOR}, {"valor": 1})
+            if contador is None:
+                try:
+                    self.contadores.insert_one({"_id": CONTADOR, "valor": 0})
+                except DuplicateKeyError:
+                    pass
+                self.ultima = 0
+            else:
+                self.ultima = contador["valor"]
+
+    def libertar(self, versao):
+        self.contadores.update_one({"_id": CONTADOR}, {"$pull": {"pendentes": {"versao": versao}}})
+
+    def remover(self, ids, versao, sessao=None):
+        """Guarda as remoções de `ids` com a versão da escrita."""
+        if ids:
+            self.removidos.bulk_write(self._tombstones(ids, versao), ordered=False, session=sessao)
+
+    def _token(self, contador):
+        limite = _agora() - timedelta(seconds=PENDENTE_MAXIMO)
+        abertas = [p["versao"] for p in contador.get("pendentes", []) if _utc(p["em"]) > limite]
+        return min(abertas) - 1 if abertas else contador.get("valor", 0)
+
+    def _verificar(self, desde, valor):
+        if desde > valor:
+            raise VersaoExpirada(f"Versão {desde} posterior à atual ({valor}); ressincronizar com desde=0")
+        limite = _agora() - timedelta(seconds=self.retencao)
+        # Sem marcas mais antigas que a retenção, nenhuma remoção pode ter sido apagada
+        if self.marcas.find_one({"em": {"$lt": limite}}, {"_id": 1}) is None:
+            return
+        marca = self.marcas.find_one({"em": {"$gte": limite}}, sort=[("em", 1)])
+        # Sem marcas recentes não se sabe até onde foi apagado: só o valor atual é seguro
+        apagado_ate = marca["valor"] if marca is not None else valor
+        if desde < apagado_ate:
+            raise VersaoExpirada(f"Versão {desde} anterior às remoções guardadas; ressincronizar com desde=0")
+
+    def alteracoes(self, desde=0, limite=1000):
+        """Produtos alterados e ids removidos depois de `desde` (0: o catálogo inteiro), por ordem de versão.
+
+        Devolve {"produtos", "removidos", "proximo", "mais"}; `proximo` é o
+        `desde` do pedido seguinte e `mais` indica que há mais para ler já.
+        Os produtos de uma mesma escrita não são partidos, por isso a página
+        pode passar de `limite`. Levanta VersaoExpirada.
+        """
+        contador = self.contadores.find_one({"_id": CONTADOR}) or {}
+        token = self._token(contador)
+        if desde <= 0:
+            # O token é lido antes do catálogo: o que mudar entretanto volta a vir no pedido seguinte
+            return {"produtos": list(self.produtos.find({}, {"_id": 0})), "removidos": [], "proximo": token,
+                    "mais": False}
+        self._verificar(desde, contador.get("valor", 0))
+
+        filtro = {"versao": {"$gt": desde, "$lte": token}}
+        # limite + 1 de cada lado chega para saber onde acaba a página
+        produtos = list(self.produtos.find(filtro, {"_id": 0}).sort("versao", 1).limit(limite + 1))
+        removidos = list(
+            self.removidos.find(filtro, {"_id": 0, "id": 1, "versao": 1}).sort("versao", 1).limit(limite + 1)
+        )
+        pagina = sorted([(p["versao"], False, p) for p in produtos] + [(r["versao"], True, r) for r in removidos],
+                        key=lambda item: item[0])
+        mais = len(pagina) > limite
+        if not mais:
+            proximo = max(desde, token)
+        elif pagina[0][0] < pagina[limite][0]:
+            # Só as versões completas: a da primeira alteração que ficou de fora vem no pedido seguinte
+            pagina = [item for item in pagina if item[0] < pagina[limite][0]]
+            proximo = pagina[-1][0]
+        else:
+            # Uma só escrita com mais de `limite` produtos: vai inteira
+            proximo = pagina[0][0]
+            mais = proximo < token
+            pagina = [(proximo, False, p) for p in self.produtos.find({"versao": proximo}, {"_id": 0})]
+            pagina += [(proximo, True, r) for r in self.removidos.find({"versao": proximo}, {"_id": 0, "id": 1})]
+
+        versoes_vivos = {d["id"]: versao for versao, removido, d in pagina if not removido}
+        return {
+            "produtos": [d for _, removido, d in pagina if not removido],
+            # Uma remoção seguida de nova inserção do mesmo id já não conta
+            "removidos": [d["id"] for versao, removido, d in pagina
+                          if removido and versoes_vivos.get(d["id"], 0) < versao],
+            "proximo": proximo,
+            "mais": mais
+        }
+
+    def marcar(self):
+        # O instante é lido antes do contador: as versões reservadas antes dele ficam todas até `valor`
+        agora = _agora()
+        contador = self.contadores.find_one({"_id": CONTADOR}, {"valor": 1}) or {}
+        self.marcas.insert_one({"em": agora, "valor": contador.get("valor", 0)})
+        # Versões pendentes de escritas que nunca acabaram (processo terminado a meio)
+        self.contadores.update_one(
+            {"_id": CONTADOR},
+            {"$pull": {"pendentes": {"em": {"$lte": agora - timedelta(seconds=PENDENTE_MAXIMO)}}}}
+        )
+
+    def manter(self, dormir=time.sleep):
+        """Ciclo das marcas; pode correr em vários processos. `dormir` permite usar o sleep do eventlet."""
+        while True:
+            try:
+                self.marcar()
+            except PyMongoError as e:
+                print(f"[Versões] Erro ao marcar: {e}")
+            dormir(self.intervalo)
+
+    # === Servidor assíncrono (Motor) ===
+    async def reservar_async(self, sessao=None):
+        """Como reservar(), no Motor."""
+        if sessao is not None:
+            contador = await self.contadores.find_one_and_update(
+                {"_id": CONTADOR}, {"$inc": {"valor": 1}},
+                upsert=True, return_document=ReturnDocument.AFTER, session=sessao
+            )
+            return contador["valor"]
+        while True:
+            versao = self.ultima + 1
+            if await self.contadores.find_one_and_update(
+                {"_id": CONTADOR, "valor": self.ultima},
+                {"$set": {"valor": versao}, "$push": {"pendentes": {"versao": versao, "em": _agora()}}}
+            ) is not None:
+                self.ultima = versao
+                return versao
+            contador = await self.contadores.find_one({"_id": CONTADOR}, {"valor": 1})
+            if contador is None:
+                try:
+                    await self.contadores.insert_one({"_id": CONTADOR, "valor": 0})
+                except DuplicateKeyError:
+                    pass
+                self.ultima = 0
+            else:
+                self.ultima = contador["valor"]
+
+    async def libertar_async(self, versao):
+        await self.contadores.update_one({"_id": CONTADOR}, {"$pull": {"pendentes": {"versao": versao}}})
+
+    async def remover_async(self, ids, versao, sessao=None):
+        if ids:
+            await self.removidos.bulk_write(self._tombstones(ids, versao), ordered=False, session=sessao)
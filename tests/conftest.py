@@ -0,0 +1,81 @@
+"""Fixtures partilhadas pelos testes.
+
+Os módulos partilhados (stock, outbox, versoes, admissao, ...) são iguais
+nos quatro serviços: os testes importam a cópia de servera/rest.
+
+Os testes com MongoDB usam MONGO_TESTE_URL (mongod isolado) e
+MONGO_TESTE_RS_URL (replica set), ou arrancam um mongod temporário com o
+`mongod` do PATH (ou MONGOD); sem nenhum dos dois são ignorados. As bases
+de dados dos testes têm nomes aleatórios e são apagadas no fim.
+
+    pip install -r tests/requirements.txt
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import uuid
+
+import pytest
+from pymongo import MongoClient
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RAIZ, "servera", "rest"))
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+MONGOD = os.getenv("MONGOD", "mongod")
+
+
+def _arrancar(classe, variavel):
+    url = os.getenv(variavel)
+    if url:
+        yield url
+        return
+    if shutil.which(MONGOD) is None:
+        pytest.skip(f"sem {variavel} nem '{MONGOD}' no PATH")
+    mongo = classe(MONGOD)
+    mongo.iniciar()
+    try:
+        yield mongo.url
+    finally:
+        mongo.parar()
+
+
+@pytest.fixture(scope="session")
+def mongo_url():
+    """mongod isolado (sem transações nem change streams), como no docker-compose."""
+    from ambiente import MongoLocal
+    yield from _arrancar(MongoLocal, "MONGO_TESTE_URL")
+
+
+@pytest.fixture(scope="session")
+def replica_set_url():
+    """Replica set local de três membros (ReplicaSetLocal), com transações e change streams."""
+    from ambiente import ReplicaSetLocal
+    yield from _arrancar(ReplicaSetLocal, "MONGO_TESTE_RS_URL")
+
+
+def _base_temporaria(url):
+    cliente = MongoClient(url)
+    nome = f"teste_{uuid.uuid4().hex[:12]}"
+    try:
+        yield cliente[nome]
+    finally:
+        cliente.drop_database(nome)
+        cliente.close()
+
+
+@pytest.fixture
+def db(mongo_url):
+    yield from _base_temporaria(mongo_url)
+
+
+@pytest.fixture
+def db_rs(replica_set_url):
+    yield from _base_temporaria(replica_set_url)
+
+
+@pytest.fixture(params=["isolado", "replica_set"])
+def db_qualquer(request):
+    """Corre o teste nas duas implantações: sem transações e com transações."""
+    return request.getfixturevalue("db" if request.param == "isolado" else "db_rs")
@@ -0,0 +1,149 @@
+import asyncio
+import threading
+
+import pytest
+
+import admissao
+from admissao import ControloAdmissao, Recusado, BILHETE_NULO
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def __call__(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(admissao.time, "monotonic", relogio)
+    return relogio
+
+
+def entrar(controlo, utilizador="ana", operacao="listar"):
+    controlo.entrar(utilizador, operacao).sair()
+
+
+def test_balde_admite_a_rajada_e_recusa_o_seguinte(relogio):
+    controlo = ControloAdmissao(taxa=10, rajada=5)
+    for _ in range(5):
+        entrar(controlo)
+    with pytest.raises(Recusado) as e:
+        entrar(controlo)
+    assert e.value.motivo == "limite"
+    assert e.value.repetir_apos == pytest.approx(0.1)
+    assert e.value.segundos == 1
+    assert controlo.estatisticas()["limite"] == 1
+
+
+def test_balde_enche_a_taxa_configurada_ate_a_rajada(relogio):
+    controlo = ControloAdmissao(taxa=10, rajada=5)
+    for _ in range(5):
+        entrar(controlo)
+    relogio.agora += 0.35
+    for _ in range(3):
+        entrar(controlo)
+    with pytest.raises(Recusado):
+        entrar(controlo)
+    # Parado muito tempo, o balde não passa da rajada
+    relogio.agora += 3600
+    for _ in range(5):
+        entrar(controlo)
+    with pytest.raises(Recusado):
+        entrar(controlo)
+
+
+def test_operacoes_pesadas_custam_mais_e_nunca_mais_que_a_rajada(relogio):
+    controlo = ControloAdmissao(taxa=1, rajada=10, custos={"catalogo": 6, "enorme": 50})
+    entrar(controlo, operacao="catalogo")
+    with pytest.raises(Recusado) as e:
+        entrar(controlo, operacao="catalogo")
+    assert e.value.repetir_apos == pytest.approx(2)
+    for _ in range(4):
+        entrar(controlo)
+    # Custo acima da rajada conta como a rajada: admitido com o balde cheio
+    relogio.agora += 10
+    entrar(controlo, operacao="enorme")
+
+
+def test_cada_utilizador_tem_o_seu_balde(relogio):
+    controlo = ControloAdmissao(taxa=1, rajada=2)
+    entrar(controlo, "ana")
+    entrar(controlo, "ana")
+    with pytest.raises(Recusado):
+        entrar(controlo, "ana")
+    entrar(controlo, "rui")
+    assert controlo.estatisticas()["utilizadores"] == 2
+
+
+def test_baldes_inativos_sao_descartados(relogio, monkeypatch):
+    monkeypatch.setattr(admissao, "BALDES_MAXIMOS", 2)
+    controlo = ControloAdmissao(taxa=1, rajada=2)
+    entrar(controlo, "ana")
+    entrar(controlo, "rui")
+    relogio.agora += 2
+    entrar(controlo, "eva")
+    assert set(controlo.baldes) == {"eva"}
+
+
+def test_taxa_zero_nao_limita(relogio):
+    controlo = ControloAdmissao(taxa=0, rajada=1)
+    for _ in range(100):
+        entrar(controlo)
+
+
+def test_controlo_desligado_admite_tudo():
+    controlo = ControloAdmissao(taxa=1, rajada=1, ativo=False)
+    assert controlo.entrar("ana", "listar") is BILHETE_NULO
+    assert controlo.entrar("ana", "listar") is BILHETE_NULO
+
+
+def test_sem_vaga_a_tempo_recusa_por_sobrecarga_e_devolve_os_tokens():
+    controlo = ControloAdmissao(taxa=1, rajada=3, concorrencia={"listar": 1}, espera_maxima=0.05)
+    bilhete = controlo.entrar("ana", "listar")
+    with pytest.raises(Recusado) as e:
+        controlo.entrar("ana", "listar")
+    assert e.value.motivo == "sobrecarga"
+    bilhete.sair()
+    # O pedido recusado não gastou tokens: ainda há dois
+    entrar(controlo)
+    entrar(controlo)
+    assert controlo.estatisticas()["operacoes"]["listar"]["ativos"] == 0
+
+
+def test_vaga_passa_ao_primeiro_da_fila():
+    controlo = ControloAdmissao(taxa=100, rajada=100, concorrencia={"listar": 1}, espera_maxima=5)
+    bilhete = controlo.entrar("ana", "listar")
+    admitido = threading.Event()
+
+    def esperar():
+        with controlo.entrar("rui", "listar"):
+            admitido.set()
+
+    t = threading.Thread(target=esperar)
+    t.start()
+    assert not admitido.wait(0.1)
+    assert controlo.estatisticas()["operacoes"]["listar"]["em_espera"] == 1
+    bilhete.sair()
+    t.join(5)
+    assert admitido.is_set()
+    fila = controlo.estatisticas()["operacoes"]["listar"]
+    assert (fila["ativos"], fila["em_espera"]) == (0, 0)
+
+
+def test_entrar_async_espera_pela_vaga():
+    controlo = ControloAdmissao(taxa=100, rajada=100, concorrencia={"listar": 1}, espera_maxima=5)
+
+    async def cenario():
+        primeiro = await controlo.entrar_async("ana", "listar")
+        segundo = asyncio.ensure_future(controlo.entrar_async("rui", "listar"))
+        await asyncio.sleep(0.05)
+        assert not segundo.done()
+        primeiro.sair()
+        (await segundo).sair()
+
+    asyncio.run(cenario())
+    assert controlo.estatisticas()["admitidos"] == 2
+    assert controlo.estatisticas()["operacoes"]["listar"]["ativos"] == 0
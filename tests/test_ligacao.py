@@ -0,0 +1,72 @@
+import time
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect
+
+from ligacao import LigacaoMongo, ATRASO_MINIMO
+
+
+@pytest.fixture
+def ligacao(replica_set_url):
+    ligacao = LigacaoMongo(replica_set_url, nome_db=f"teste_{uuid.uuid4().hex[:12]}")
+    try:
+        yield ligacao
+    finally:
+        ligacao.client.drop_database(ligacao.db.name)
+        ligacao.client.close()
+
+
+def primario(cliente):
+    """"anfitriao:porta" do primário, segundo a monitorização do driver."""
+    anfitriao = cliente.primary
+    return f"{anfitriao[0]}:{anfitriao[1]}" if anfitriao else None
+
+
+def esperar_primario(cliente, anfitriao=None, timeout=90):
+    """Espera por um primário (ou por `anfitriao` voltar a sê-lo, pela sua prioridade maior)."""
+    limite = time.time() + timeout
+    while time.time() < limite:
+        atual = primario(cliente)
+        if atual and anfitriao in (None, atual):
+            return atual
+        time.sleep(0.5)
+    raise RuntimeError("O replica set ficou sem o primário esperado")
+
+
+@pytest.fixture
+def troca_de_primario(ligacao):
+    """Função que demite o primário atual; no fim espera que o original volte, para os testes seguintes."""
+    original = esperar_primario(ligacao.client)
+
+    def demitir():
+        with MongoClient(original, directConnection=True) as cliente:
+            try:
+                cliente.admin.command("replSetStepDown", 10, secondaryCatchUpPeriodSecs=5)
+            except AutoReconnect:
+                # O primário fecha as ligações ao demitir-se
+                pass
+        return original
+
+    yield demitir
+    esperar_primario(ligacao.client, original)
+
+
+def test_ligacao_pede_repeticao_de_escritas_e_leituras(ligacao):
+    opcoes = ligacao.client.options
+    assert opcoes.retry_writes and opcoes.retry_reads
+    assert ligacao.preferencia.max_staleness == ATRASO_MINIMO
+
+
+def test_escritas_e_leituras_sobrevivem_a_troca_de_primario(ligacao, troca_de_primario):
+    colecao = ligacao.db["produtos"]
+    colecao.insert_one({"id": 1, "stock": 10})
+
+    antigo = troca_de_primario()
+    # O primeiro envio falha (NotWritablePrimary ou ligação fechada); a repetição espera pelo novo primário
+    colecao.insert_one({"id": 2, "stock": 5})
+    colecao.update_one({"id": 1}, {"$inc": {"stock": -1}})
+    assert colecao.find_one({"id": 1})["stock"] == 9
+    assert colecao.count_documents({}) == 2
+    assert primario(ligacao.client) != antigo
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+import pytest
+
+import outbox
+from outbox import Outbox, Relay, Seguidor, Destino, COLECAO_OUTBOX, COLECAO_RELAYS, evento
+
+
+class DestinoMemoria(Destino):
+    """Guarda os eventos publicados; os ids em `falhar` levantam exceção enquanto lá estiverem."""
+
+    nome = "memoria"
+
+    def __init__(self):
+        self.publicados = []
+        self.falhar = set()
+
+    def publicar(self, documento):
+        if documento["produtos"][0] in self.falhar:
+            raise ConnectionError("destino em baixo")
+        self.publicados.append((documento["produtos"][0], documento["dados"]))
+
+
+@pytest.fixture
+def destino():
+    return DestinoMemoria()
+
+
+@pytest.fixture
+def gravar(db):
+    eventos = Outbox(db, "teste", destinos=[DestinoMemoria.nome])
+
+    def gravar(produto_id, dados):
+        eventos.gravar(lambda sessao, versao: (None, [evento("produto_editado", [produto_id], dados)]))
+    return gravar
+
+
+def relay(db, destino):
+    relay = Relay(db, destino, arrendamento=60)
+    relay.criar_indices()
+    return relay
+
+
+def test_so_um_relay_tem_o_arrendamento_e_outro_toma_o_depois_de_expirar(db, destino):
+    primeiro, segundo = relay(db, destino), relay(db, destino)
+    assert primeiro._liderar()
+    assert not segundo._liderar()
+    # Renovar o próprio arrendamento não o perde
+    assert primeiro._liderar()
+
+    arrendamento = db[COLECAO_RELAYS].find_one({"_id": DestinoMemoria.nome})
+    db[COLECAO_RELAYS].update_one(
+        {"_id": DestinoMemoria.nome}, {"$set": {"ate": arrendamento["ate"] - timedelta(seconds=120)}}
+    )
+    assert segundo._liderar()
+    assert not primeiro._liderar()
+
+
+def test_relay_publica_por_ordem_e_marca_os_entregues(db, destino, gravar):
+    for i in range(5):
+        gravar(i % 2, i)
+    assert relay(db, destino).publicar_lote() == 5
+    assert destino.publicados == [(0, 0), (1, 1), (0, 2), (1, 3), (0, 4)]
+    assert db[COLECAO_OUTBOX].count_documents({"destinos": DestinoMemoria.nome}) == 0
+    assert db[COLECAO_OUTBOX].count_documents({"entregue_em": {"$exists": True}}) == 5
+
+
+def test_evento_falhado_retem_os_seguintes_do_produto_e_larga_o_arrendamento(db, destino, gravar):
+    gravar(1, "a")
+    gravar(2, "b")
+    gravar(1, "c")
+    gravar(2, "d")
+    destino.falhar.add(1)
+    primeiro, segundo = relay(db, destino), relay(db, destino)
+    assert primeiro._liderar()
+    assert primeiro.publicar_lote() == 0
+    # O líder que não chega ao destino deixa outro processo tomar o arrendamento
+    assert not primeiro.lider
+    assert segundo._liderar()
+
+    # O evento falhado espera pela nova tentativa; os do produto 2 seguem, os do 1 ficam retidos
+    assert segundo.publicar_lote() == 2
+    assert destino.publicados == [(2, "b"), (2, "d")]
+    falhado = db[COLECAO_OUTBOX].find_one({"dados": "a"})
+    assert falhado["tentativas"][DestinoMemoria.nome] == 1
+
+    destino.falhar.clear()
+    db[COLECAO_OUTBOX].update_one(
+        {"_id": falhado["_id"]}, {"$set": {f"proxima.{DestinoMemoria.nome}": falhado["criado_em"]}}
+    )
+    assert segundo.publicar_lote() == 2
+    assert destino.publicados[2:] == [(1, "a"), (1, "c")]
+
+
+def test_seguidor_repete_o_evento_que_falhou_antes_de_passar_ao_seguinte(db, destino, monkeypatch):
+    esperas = []
+
+    def dormir(segundos):
+        esperas.append(segundos)
+        if len(esperas) == 3:
+            destino.falhar.clear()
+
+    monkeypatch.setattr(outbox.time, "sleep", dormir)
+    seguidor = Seguidor(db, destino)
+    destino.falhar.add(1)
+    seguidor._entregar({"_id": 1, "produtos": [1], "dados": "a"})
+    seguidor._entregar({"_id": 2, "produtos": [2], "dados": "b"})
+    assert destino.publicados == [(1, "a"), (2, "b")]
+    assert esperas == [0.5, 1, 2]
+    assert seguidor.contagens == {"publicados": 2, "falhas": 3}
@@ -0,0 +1,145 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from outbox import Outbox, COLECAO_OUTBOX
+from stock import GestorStock, ErroStock
+
+STOCK_INICIAL = 200
+THREADS = 16
+DECREMENTOS_POR_THREAD = 25
+
+
+@pytest.fixture
+def gestor(db_qualquer):
+    db_qualquer["produtos"].insert_many([{"id": 1, "stock": STOCK_INICIAL}, {"id": 2, "stock": 3}])
+    gestor = GestorStock(db_qualquer["produtos"], db_qualquer["reservas"], Outbox(db_qualquer, "teste"))
+    gestor.criar_indices()
+    return gestor
+
+
+def stock(gestor, produto_id):
+    return gestor.colecao.find_one({"id": produto_id})["stock"]
+
+
+def test_decrementos_concorrentes_nao_perdem_nem_passam_do_stock(gestor):
+    aceites = []
+    barreira = threading.Barrier(THREADS)
+
+    def decrementar():
+        barreira.wait()
+        for _ in range(DECREMENTOS_POR_THREAD):
+            try:
+                gestor.ajustar(1, -1)
+            except ErroStock as e:
+                assert e.codigo == "insuficiente"
+            else:
+                aceites.append(1)
+
+    threads = [threading.Thread(target=decrementar) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    final = stock(gestor, 1)
+    assert final >= 0
+    assert len(aceites) + final == STOCK_INICIAL
+    # Há mais pedidos que stock: tudo o que havia foi vendido
+    assert final == 0
+    eventos = gestor.colecao.database[COLECAO_OUTBOX].count_documents({"tipo": "stock_alterado"})
+    assert eventos == len(aceites)
+
+
+def test_ajustar_recusa_stock_insuficiente_e_produto_inexistente(gestor):
+    assert gestor.ajustar(2, -3) == 0
+    with pytest.raises(ErroStock) as e:
+        gestor.ajustar(2, -1)
+    assert e.value.codigo == "insuficiente"
+    with pytest.raises(ErroStock) as e:
+        gestor.ajustar(99, 1)
+    assert e.value.codigo == "nao_encontrado"
+    assert stock(gestor, 2) == 0
+
+
+def test_ajustar_lote_aplica_cada_ajuste_de_forma_independente(gestor):
+    resultados = gestor.ajustar_lote([(2, -2), (2, -2), (99, 1), (1, 5), (2, 1)])
+    assert [r["ok"] for r in resultados] == [True, False, False, True, True]
+    assert [r.get("stock") for r in resultados] == [1, None, None, STOCK_INICIAL + 5, 2]
+    assert [r.get("codigo") for r in resultados] == [None, "insuficiente", "nao_encontrado", None, None]
+    assert stock(gestor, 2) == 2
+
+
+def test_ajustar_lote_com_ids_repetidos_devolve_o_stock_depois_de_cada_ajuste(gestor):
+    resultados = gestor.ajustar_lote([(1, -10), (1, 4), (2, 1)])
+    assert [r["stock"] for r in resultados] == [STOCK_INICIAL - 10, STOCK_INICIAL - 6, 4]
+
+
+def test_reserva_e_tudo_ou_nada(gestor):
+    with pytest.raises(ErroStock) as e:
+        gestor.reservar([(1, 5), (2, 4)], ttl=60, utilizador="ana")
+    assert e.value.codigo == "insuficiente"
+    assert stock(gestor, 1) == STOCK_INICIAL
+    assert stock(gestor, 2) == 3
+    assert gestor.reservas.count_documents({}) == 0
+
+
+def test_reserva_cancelada_devolve_o_stock(gestor):
+    reserva = gestor.reservar([(1, 5), (2, 3), (1, 1)], ttl=60, utilizador="ana")
+    assert reserva["itens"] == [{"id": 1, "quantidade": 6}, {"id": 2, "quantidade": 3}]
+    assert stock(gestor, 1) == STOCK_INICIAL - 6
+    assert stock(gestor, 2) == 0
+
+    # Só quem criou a reserva a pode terminar
+    with pytest.raises(ErroStock):
+        gestor.cancelar(str(reserva["_id"]), "rui")
+    assert gestor.cancelar(str(reserva["_id"]), "ana")["estado"] == "cancelada"
+    assert stock(gestor, 1) == STOCK_INICIAL
+    assert stock(gestor, 2) == 3
+    with pytest.raises(ErroStock):
+        gestor.cancelar(str(reserva["_id"]), "ana")
+
+
+def test_reserva_confirmada_mantem_o_desconto(gestor):
+    reserva = gestor.reservar([(2, 2)], ttl=60, utilizador="ana")
+    assert gestor.confirmar(str(reserva["_id"]), "ana")["estado"] == "confirmada"
+    assert stock(gestor, 2) == 1
+    # Confirmada já não expira nem pode ser cancelada
+    with pytest.raises(ErroStock):
+        gestor.cancelar(str(reserva["_id"]), "ana")
+    assert gestor.expirar_reservas() == 0
+    assert stock(gestor, 2) == 1
+
+
+def test_reserva_expirada_devolve_o_stock_e_nao_pode_ser_confirmada(gestor):
+    reserva = gestor.reservar([(2, 2)], ttl=60, utilizador="ana")
+    vencida = datetime.now(timezone.utc) - timedelta(seconds=1)
+    gestor.reservas.update_one({"_id": reserva["_id"]}, {"$set": {"expira_em": vencida}})
+    with pytest.raises(ErroStock):
+        gestor.confirmar(str(reserva["_id"]), "ana")
+    assert gestor.expirar_reservas() == 1
+    assert stock(gestor, 2) == 3
+    assert gestor.reservas.find_one({"_id": reserva["_id"]})["estado"] == "expirada"
+
+
+def test_reservas_concorrentes_nao_vendem_o_mesmo_stock(gestor):
+    reservas, recusadas = [], []
+    barreira = threading.Barrier(THREADS)
+
+    def reservar():
+        barreira.wait()
+        try:
+            reservas.append(gestor.reservar([(2, 1), (1, 1)], ttl=60))
+        except ErroStock:
+            recusadas.append(1)
+
+    threads = [threading.Thread(target=reservar) for _ in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(reservas) == 3
+    assert len(recusadas) == THREADS - 3
+    assert stock(gestor, 2) == 0
+    assert stock(gestor, 1) == STOCK_INICIAL - 3
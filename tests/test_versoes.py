@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from outbox import Outbox, evento
+from versoes import Versoes, VersaoExpirada, COLECAO_REMOVIDOS, primeira_versao, nova_versao
+
+
+@pytest.fixture
+def versoes(db_qualquer):
+    versoes = Versoes(db_qualquer, retencao=3600)
+    versoes.criar_indices()
+    return versoes
+
+
+@pytest.fixture
+def outbox(db_qualquer, versoes):
+    return Outbox(db_qualquer, "teste", destinos=[], versoes=versoes)
+
+
+def inserir(outbox, *ids):
+    def escrever(sessao, versao):
+        produtos = [primeira_versao({"id": produto_id, "stock": 1}, versao) for produto_id in ids]
+        outbox.versoes.produtos.insert_many(produtos, session=sessao)
+        return versao, [evento("novo_produto", ids, None)]
+    return outbox.gravar(escrever)
+
+
+def editar(outbox, produto_id, stock):
+    def escrever(sessao, versao):
+        outbox.versoes.produtos.update_one(
+            {"id": produto_id}, nova_versao({"$set": {"stock": stock}}, versao), session=sessao
+        )
+        return versao, [evento("produto_editado", [produto_id], None)]
+    return outbox.gravar(escrever)
+
+
+def remover(outbox, produto_id):
+    def escrever(sessao, versao):
+        outbox.versoes.produtos.delete_one({"id": produto_id}, session=sessao)
+        return versao, [evento("produto_removido", [produto_id], None, removidos=[produto_id])]
+    return outbox.gravar(escrever)
+
+
+def ids(alteracoes):
+    return [p["id"] for p in alteracoes["produtos"]]
+
+
+def test_cada_escrita_sobe_a_versao_e_so_vem_o_que_mudou_depois(versoes, outbox):
+    # Produto anterior às versões: sem `versao`, só aparece no catálogo inteiro
+    versoes.produtos.insert_one({"id": 0, "stock": 1})
+    primeira = inserir(outbox, 1, 2)
+    segunda = editar(outbox, 1, 5)
+    assert segunda == primeira + 1
+
+    catalogo = versoes.alteracoes(0)
+    assert sorted(ids(catalogo)) == [0, 1, 2]
+    assert catalogo["proximo"] == segunda and not catalogo["mais"]
+
+    alteracoes = versoes.alteracoes(primeira)
+    assert alteracoes["produtos"] == [{"id": 1, "stock": 5, "versao": segunda}]
+    assert alteracoes["removidos"] == [] and alteracoes["proximo"] == segunda
+    assert versoes.alteracoes(segunda) == {"produtos": [], "removidos": [], "proximo": segunda, "mais": False}
+
+
+def test_remocao_fica_em_produtos_removidos_e_nova_insercao_a_anula(versoes, outbox, db_qualquer):
+    inicio = inserir(outbox, 1, 2)
+    removido = remover(outbox, 1)
+    assert db_qualquer[COLECAO_REMOVIDOS].find_one({"id": 1}, {"_id": 0, "removido_em": 0}) == {
+        "id": 1, "versao": removido
+    }
+    assert versoes.alteracoes(inicio)["removidos"] == [1]
+
+    inserir(outbox, 1)
+    alteracoes = versoes.alteracoes(inicio)
+    assert ids(alteracoes) == [1] and alteracoes["removidos"] == []
+
+
+def test_paginas_seguem_proximo_sem_partir_uma_escrita(versoes, outbox):
+    inicio = inserir(outbox, 1)
+    for produto_id in range(2, 5):
+        inserir(outbox, produto_id)
+    lote = inserir(outbox, 5, 6, 7)
+
+    vistos, desde, paginas = [], inicio, 0
+    while True:
+        alteracoes = versoes.alteracoes(desde, limite=2)
+        vistos += ids(alteracoes)
+        desde, paginas = alteracoes["proximo"], paginas + 1
+        if not alteracoes["mais"]:
+            break
+    # O lote de três produtos vem inteiro numa página, apesar do limite de 2
+    assert vistos == [2, 3, 4, 5, 6, 7] and desde == lote and paginas == 3
+
+
+def test_versao_reservada_e_por_gravar_segura_o_token(db):
+    versoes = Versoes(db)
+    outbox = Outbox(db, "teste", destinos=[], versoes=versoes)
+    antes = inserir(outbox, 1)
+    # Sem transações uma escrita reservada e ainda a decorrer fica em `pendentes`
+    pendente = versoes.reservar()
+    depois = editar(outbox, 1, 3)
+    assert depois > pendente
+    assert versoes.alteracoes(antes)["proximo"] == antes
+
+    versoes.libertar(pendente)
+    alteracoes = versoes.alteracoes(antes)
+    assert alteracoes["proximo"] == depois and ids(alteracoes) == [1]
+
+
+def test_versao_desconhecida_ou_ja_apagada_obriga_a_ressincronizar(versoes, outbox):
+    for produto_id in range(1, 4):
+        atual = inserir(outbox, produto_id)
+    with pytest.raises(VersaoExpirada):
+        versoes.alteracoes(atual + 1)
+
+    # Uma marca mais antiga que a retenção: as remoções até à primeira marca recente podem ter sido apagadas
+    agora = datetime.now(timezone.utc)
+    versoes.marcas.insert_many([
+        {"em": agora - timedelta(seconds=versoes.retencao + 60), "valor": 1},
+        {"em": agora - timedelta(seconds=versoes.retencao - 60), "valor": 2}
+    ])
+    with pytest.raises(VersaoExpirada):
+        versoes.alteracoes(1)
+    assert ids(versoes.alteracoes(2)) == [3]